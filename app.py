@@ -1,8 +1,7 @@
 import streamlit as st
 import os
-from utils.paciente import patient_area
-from utils.agente_saude import acs_area
-from utils.medico import medico_area
+from utils.rerun import show_work, start_run
+from utils.tracing import debug_panel, serve_metrics
 
 
 def disclaimer():
@@ -21,6 +20,9 @@ def disclaimer():
 
 def main():
     """Função principal do aplicativo Streamlit."""
+    start_run()
+    serve_metrics()
+
     # Carregar imagem do cabeçalho
     image_path = r"images/LeisHticIA.png"
     if os.path.exists(image_path):
@@ -82,17 +84,27 @@ def main():
             for key, value in info.items():
                 st.write(f"- **{key}**: {value}")
 
+    # As áreas são importadas sob demanda: banco, Google Maps e o modelo
+    # só são carregados quando a página correspondente é aberta
     elif page == "Área do paciente":
+        from utils.paciente import patient_area
         patient_area()
         disclaimer()
 
     elif page == "Área do ACS":
+        from utils.agente_saude import acs_area
         acs_area()
         disclaimer()
 
     elif page == "Área do médico":
+        from utils.medico import medico_area
         medico_area()
 
+    # Contador de trabalho do rerun (etapas feitas e evitadas pela memoização)
+    show_work()
+    # Latência por etapa (só com TRACING=1)
+    debug_panel()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,196 @@
+"""
+Benchmark reprodutível de inferência do classificador.
+
+Mede, com o backend selecionado por ``CLASSIFIER_BACKEND``:
+
+- tempo de carga do modelo;
+- acurácia em ``dataset_classifier/test``;
+- latência p50/p95/p99 de ponta a ponta (decodificação + classificação) de
+  uma imagem, no conjunto de teste e num conjunto sintético de resoluções
+  variadas gerado com semente fixa;
+- imagens por segundo para cada combinação de tamanho de lote e número de
+  threads do torch;
+- pico de memória residente (RSS) do processo.
+
+O resultado é gravado em JSON; ``--compare`` confronta com um resultado
+anterior e falha se houver regressão além da tolerância.
+
+Uso::
+
+    python -m benchmarks.inference --output bench.json
+    python -m benchmarks.inference --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from utils.backends import DEFAULT_BACKEND, TEST_DIR, load_test_set
+from utils.classifier import MODEL_VERSION, classify_batch_local, load_model
+from utils.preprocess import decode_upload
+
+SYNTHETIC_SIZES = [(224, 224), (480, 640), (720, 1280), (1080, 1920), (3024, 4032)]
+
+
+def synthetic_images(per_size=4, seed=0):
+    """Gera JPEGs sintéticos (ruído suavizado) em várias resoluções."""
+    rng = np.random.default_rng(seed)
+    encoded = []
+    for height, width in SYNTHETIC_SIZES:
+        for _ in range(per_size):
+            small = rng.integers(0, 256, size=(max(height // 16, 1), max(width // 16, 1), 3), dtype=np.uint8)
+            image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+            encoded.append(cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes())
+    return encoded
+
+
+def percentiles(samples):
+    """Retorna p50/p95/p99 e média, em milissegundos."""
+    ms = np.asarray(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+    }
+
+
+def latency(encoded_images, repeat=1):
+    """Latência de ponta a ponta de uma imagem por vez (decodificação + classificação)."""
+    samples = []
+    for _ in range(repeat):
+        for data in encoded_images:
+            start = time.perf_counter()
+            classify_batch_local([decode_upload(data)])
+            samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def throughput(images, batch_sizes, thread_counts, min_seconds=2.0):
+    """Imagens por segundo para cada (threads, tamanho de lote)."""
+    results = []
+    for threads in thread_counts:
+        torch.set_num_threads(threads)
+        for batch_size in batch_sizes:
+            batch = [images[i % len(images)] for i in range(batch_size)]
+            classify_batch_local(batch, batch_size)  # aquecimento
+            done, start = 0, time.perf_counter()
+            while time.perf_counter() - start < min_seconds:
+                classify_batch_local(batch, batch_size)
+                done += batch_size
+            elapsed = time.perf_counter() - start
+            results.append({
+                "threads": threads,
+                "batch_size": batch_size,
+                "images_per_s": done / elapsed,
+                "ms_per_image": elapsed / done * 1000,
+            })
+    return results
+
+
+def peak_rss_mb():
+    """Pico de RSS do processo, em MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss é em KB no Linux e em bytes no macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run(args):
+    start = time.perf_counter()
+    load_model()
+    load_time = time.perf_counter() - start
+
+    images, labels = load_test_set(args.test_dir)
+    predictions = classify_batch_local(images)
+    accuracy = float(np.mean([p.index == label for p, label in zip(predictions, labels)]))
+
+    test_encoded = [cv2.imencode(".jpg", image)[1].tobytes() for image in images]
+    synthetic = synthetic_images(args.synthetic_per_size, args.seed)
+
+    return {
+        "meta": {
+            "model_version": MODEL_VERSION,
+            "backend": DEFAULT_BACKEND,
+            "torch": torch.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "model_load_s": load_time,
+        "accuracy": accuracy,
+        "num_test_images": len(images),
+        "latency_test_set": latency(test_encoded, args.repeat),
+        "latency_synthetic": latency(synthetic, args.repeat),
+        "throughput": throughput(images, args.batch_sizes, args.threads, args.min_seconds),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(current, baseline, tolerance):
+    """
+    Lista as regressões de ``current`` em relação a ``baseline``.
+
+    Returns
+    -------
+    list of str
+        Uma mensagem por métrica que piorou mais que ``tolerance`` (fração).
+    """
+    regressions = []
+    if current["accuracy"] < baseline["accuracy"] - 0.01:
+        regressions.append(f"accuracy {baseline['accuracy']:.3f} -> {current['accuracy']:.3f}")
+    for key in ("latency_test_set", "latency_synthetic"):
+        for stat in ("p50_ms", "p95_ms"):
+            old, new = baseline[key][stat], current[key][stat]
+            if new > old * (1 + tolerance):
+                regressions.append(f"{key}.{stat} {old:.1f} -> {new:.1f}")
+    old_tp = {(r["threads"], r["batch_size"]): r["images_per_s"] for r in baseline["throughput"]}
+    for r in current["throughput"]:
+        old = old_tp.get((r["threads"], r["batch_size"]))
+        if old and r["images_per_s"] < old * (1 - tolerance):
+            regressions.append(f"throughput threads={r['threads']} batch={r['batch_size']} "
+                               f"{old:.1f} -> {r['images_per_s']:.1f} img/s")
+    if current["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak_rss_mb {baseline['peak_rss_mb']:.0f} -> {current['peak_rss_mb']:.0f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de inferência do classificador.")
+    parser.add_argument("--test-dir", default=TEST_DIR)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--threads", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument("--synthetic-per-size", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3, help="Repetições das medições de latência.")
+    parser.add_argument("--min-seconds", type=float, default=2.0,
+                        help="Duração mínima de cada medição de throughput.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Arquivo JSON de saída.")
+    parser.add_argument("--compare", help="JSON de um resultado anterior para detectar regressões.")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            raise SystemExit("Regressões encontradas:\n" + "\n".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark de importação e de cold start da aplicação.
+
+Cada medição roda num processo Python novo, para que nada venha de caches
+de módulos do processo atual:
+
+- ``import_app``: tempo de ``import app`` e quais módulos pesados vieram junto;
+- ``render_home``: renderização da página "Sobre as doenças" com o
+  ``AppTest`` do Streamlit, conferindo que o torch não foi importado;
+- ``load_model``: construção do modelo a partir dos pesos locais.
+
+Uso::
+
+    python -m benchmarks.startup --repeat 5 --output startup.json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ("torch", "torchvision", "cv2", "sqlalchemy", "googlemaps", "folium")
+
+_SNIPPETS = {
+    "import_app": """
+import sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+""",
+    "render_home": """
+import sys, time
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+at = AppTest.from_file("app.py", default_timeout=120).run()
+elapsed = time.perf_counter() - start
+assert not at.exception, at.exception
+""",
+    "load_model": """
+import sys, time
+start = time.perf_counter()
+from utils.classifier import load_model
+load_model()
+elapsed = time.perf_counter() - start
+""",
+}
+
+_REPORT = """
+import json
+print(json.dumps({"seconds": elapsed,
+                  "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(name):
+    """Roda um cenário num processo novo e retorna tempo e módulos carregados."""
+    result = subprocess.run([sys.executable, "-c", _SNIPPETS[name] + _REPORT],
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run(scenarios, repeat):
+    """
+    Executa cada cenário ``repeat`` vezes.
+
+    Returns
+    -------
+    dict
+        Mediana, mínimo e máximo (em segundos) e módulos pesados carregados
+        por cenário.
+    """
+    report = {}
+    for name in scenarios:
+        samples = [measure(name) for _ in range(repeat)]
+        seconds = [s["seconds"] for s in samples]
+        report[name] = {
+            "median_s": statistics.median(seconds),
+            "min_s": min(seconds),
+            "max_s": max(seconds),
+            "heavy_modules_loaded": samples[-1]["loaded"],
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de importação e cold start.")
+    parser.add_argument("--scenarios", nargs="+", default=list(_SNIPPETS), choices=list(_SNIPPETS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Arquivo JSON de saída.")
+    args = parser.parse_args()
+
+    report = run(args.scenarios, args.repeat)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+    if "torch" in report.get("render_home", {}).get("heavy_modules_loaded", []):
+        raise SystemExit("A página inicial não deveria importar o torch.")
+
+
+if __name__ == "__main__":
+    main()
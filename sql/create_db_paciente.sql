@@ -12,5 +12,8 @@ CREATE TABLE PACIENTE (
     HISTORICO_DIABETES BOOLEAN NOT NULL,
     HISTORICO_CANCER BOOLEAN NOT NULL,
     ANTI_INFLAMATORIO_SEM_EFEITO BOOLEAN NOT NULL,
-    IMAGEM_LESAO BYTEA NOT NULL
+    -- SHA-256 das imagens no armazenamento de blobs (utils/blobstore.py)
+    IMAGEM_HASH CHAR(64) NOT NULL,
+    MINIATURA_HASH CHAR(64) NOT NULL,
+    ENTRADA_MODELO_HASH CHAR(64) NOT NULL
 );
@@ -0,0 +1,11 @@
+-- Tabela PREDICAO: predição gravada no cadastro do paciente
+
+CREATE TABLE IF NOT EXISTS PREDICAO (
+    PREDICAO_ID SERIAL PRIMARY KEY,
+    PACIENTE_ID INTEGER NOT NULL UNIQUE REFERENCES PACIENTE (PACIENTE_ID) ON DELETE CASCADE,
+    VERSAO_MODELO VARCHAR(100) NOT NULL,
+    CLASSE VARCHAR(50) NOT NULL,
+    PROBABILIDADE REAL NOT NULL,
+    PROBABILIDADES REAL[] NOT NULL,
+    CRIADO_EM TIMESTAMP NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,7 @@
+-- Tabela EMBEDDING_LESAO: embeddings para a busca de casos semelhantes
+
+CREATE TABLE IF NOT EXISTS EMBEDDING_LESAO (
+    PACIENTE_ID INTEGER PRIMARY KEY REFERENCES PACIENTE (PACIENTE_ID) ON DELETE CASCADE,
+    VERSAO_MODELO VARCHAR(100) NOT NULL,
+    VETOR BYTEA NOT NULL
+);
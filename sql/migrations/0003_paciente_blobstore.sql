@@ -0,0 +1,20 @@
+-- Imagens do PACIENTE no armazenamento de blobs (utils/blobstore.py).
+-- Em bancos antigos, as colunas BYTEA continuam até rodar:
+--     python -m utils.blobstore --migrate --drop-columns
+
+ALTER TABLE PACIENTE
+    ADD COLUMN IF NOT EXISTS IMAGEM_HASH CHAR(64),
+    ADD COLUMN IF NOT EXISTS MINIATURA_HASH CHAR(64),
+    ADD COLUMN IF NOT EXISTS ENTRADA_MODELO_HASH CHAR(64);
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'paciente' AND column_name = 'imagem_lesao') THEN
+        ALTER TABLE PACIENTE
+            ALTER COLUMN IMAGEM_LESAO DROP NOT NULL,
+            ADD COLUMN IF NOT EXISTS IMAGEM_MINIATURA BYTEA,
+            ADD COLUMN IF NOT EXISTS ENTRADA_MODELO BYTEA;
+    END IF;
+END
+$$;
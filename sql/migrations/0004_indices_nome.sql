@@ -0,0 +1,6 @@
+-- Índices únicos nos nomes de usuário usados no login (WHERE NOME = :username).
+-- Falha se houver nomes duplicados: resolva-os antes de aplicar.
+
+CREATE UNIQUE INDEX IF NOT EXISTS PACIENTE_NOME_UNICO ON PACIENTE (NOME);
+CREATE UNIQUE INDEX IF NOT EXISTS MEDICO_NOME_UNICO ON MEDICO (NOME);
+CREATE UNIQUE INDEX IF NOT EXISTS AGENTE_COMUNITARIO_NOME_UNICO ON AGENTE_COMUNITARIO (NOME);
@@ -0,0 +1,13 @@
+-- Busca de pacientes pelo médico: trechos do nome, sem diferenciar acentos e maiúsculas.
+
+CREATE EXTENSION IF NOT EXISTS unaccent;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- unaccent() não é IMMUTABLE; o wrapper com dicionário fixo pode ser indexado
+CREATE OR REPLACE FUNCTION F_UNACCENT(TEXT) RETURNS TEXT
+    LANGUAGE SQL IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT public.unaccent('public.unaccent', $1) $$;
+
+-- Trigramas: LIKE '%trecho%'
+CREATE INDEX IF NOT EXISTS PACIENTE_NOME_BUSCA_TRGM
+    ON PACIENTE USING GIN (F_UNACCENT(LOWER(NOME)) gin_trgm_ops);
@@ -0,0 +1,5 @@
+-- Identificador da captura feita na fila offline do ACS (utils/fila_offline.py).
+-- Torna a sincronização idempotente: reenviar a mesma captura não duplica o paciente.
+
+ALTER TABLE PACIENTE ADD COLUMN IF NOT EXISTS CAPTURA_ID UUID;
+CREATE UNIQUE INDEX IF NOT EXISTS PACIENTE_CAPTURA_ID_UNICO ON PACIENTE (CAPTURA_ID);
@@ -0,0 +1,39 @@
+"""Classificação das falhas da sincronização da fila offline (``utils.fila_offline``)."""
+import errno
+
+import pytest
+
+sqlalchemy_exc = pytest.importorskip("sqlalchemy.exc")
+fila_offline = pytest.importorskip("utils.fila_offline")
+
+
+class _ErroDriver(Exception):
+    def __init__(self, pgcode=None):
+        super().__init__("erro do driver")
+        self.pgcode = pgcode
+
+
+def _dbapi(tipo, pgcode=None, invalidated=False):
+    return tipo("SELECT 1", {}, _ErroDriver(pgcode), connection_invalidated=invalidated)
+
+
+@pytest.mark.parametrize("erro", [
+    sqlalchemy_exc.TimeoutError("pool esgotado"),
+    _dbapi(sqlalchemy_exc.OperationalError),  # conexão recusada, sem SQLSTATE
+    _dbapi(sqlalchemy_exc.OperationalError, pgcode="08006"),
+    _dbapi(sqlalchemy_exc.DBAPIError, pgcode="57P01", invalidated=True),
+    ConnectionRefusedError(),
+    OSError(errno.ESTALE, "montagem perdida"),
+])
+def test_falhas_de_conexao_adiam(erro):
+    assert fila_offline._is_offline(erro)
+
+
+@pytest.mark.parametrize("erro", [
+    _dbapi(sqlalchemy_exc.OperationalError, pgcode="57014"),  # statement_timeout
+    _dbapi(sqlalchemy_exc.DataError),
+    OSError(errno.ENOSPC, "disco cheio"),
+    ValueError("entrada do modelo inválida"),
+])
+def test_demais_falhas_viram_erro(erro):
+    assert not fila_offline._is_offline(erro)
@@ -0,0 +1,64 @@
+"""Erros por linha na importação em lote (``utils.importacao``)."""
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+importacao = pytest.importorskip("utils.importacao")
+
+CABECALHO = ";".join(importacao.COLUMNS)
+
+
+def _jpeg(side=600, seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, (side, side, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def _linha(nome, imagem):
+    return f"{nome};senha;01/02/1990;Rua A, 1;01001000;11999999999;1 mês;Sim;Não;Não;{imagem}"
+
+
+class _Predicao:
+    label = "Leishmaniose"
+
+
+@pytest.fixture
+def sem_modelo(monkeypatch):
+    """Substitui o pool, o bcrypt e o modelo por versões rápidas e determinísticas."""
+    monkeypatch.setattr(importacao, "_get_import_pool", lambda: ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr(importacao, "_hash_password", lambda senha: b"hash")
+    monkeypatch.setattr(importacao, "classify_and_embed",
+                        lambda imagens: ([_Predicao()] * len(imagens), np.zeros((len(imagens), 4))))
+
+
+def test_jpeg_truncado_vira_erro_da_linha(sem_modelo):
+    integra = _jpeg()
+    truncada = integra[:len(integra) // 2]
+    csv_text = "\n".join([CABECALHO, _linha("Ana", "ana.jpg"), _linha("Bia", "bia.jpg")])
+
+    rows, erros = importacao.parse_rows(csv_text, {"ana.jpg": integra, "bia.jpg": truncada})
+    prontas = importacao._prepare(rows, erros, progress=lambda fracao: None)
+
+    assert [row.values["nome"] for row in prontas] == ["Ana"]
+    assert [(erro.linha, erro.nome) for erro in erros] == [(3, "Bia")]
+    assert erros[0].mensagem.startswith("Imagem inválida")
+
+
+def test_read_zip_limita_o_tamanho_das_imagens(monkeypatch):
+    monkeypatch.setattr(importacao, "MAX_UPLOAD_BYTES", 1024)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("pacientes.csv", "\n".join([CABECALHO, _linha("Ana", "ana.jpg")]))
+        archive.writestr("ana.jpg", b"\0" * 10_000)
+
+    csv_text, images = importacao.read_zip(buffer.getvalue())
+    rows, erros = importacao.parse_rows(csv_text, images)
+
+    assert rows == []
+    assert [erro.nome for erro in erros] == ["Ana"]
+    assert "maior que" in erros[0].mensagem
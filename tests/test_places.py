@@ -0,0 +1,42 @@
+"""Cache com validade dos resultados do Google Places (``utils.places``)."""
+import pytest
+
+places = pytest.importorskip("utils.places")
+
+
+class _Relogio:
+    agora = 0.0
+
+    def monotonic(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = _Relogio()
+    monkeypatch.setattr(places, "time", relogio)
+    return relogio
+
+
+def test_entrada_vence_depois_do_ttl(relogio):
+    cache = places.TTLCache(maxsize=10, ttl_s=60)
+    cache.put("a", 1)
+    cache.put("b", 2, ttl_s=300)
+
+    relogio.agora = 59
+    assert cache.get("a") == 1
+    relogio.agora = 61
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_descarta_a_menos_usada(relogio):
+    cache = places.TTLCache(maxsize=2, ttl_s=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
@@ -0,0 +1,74 @@
+"""Índice de embeddings em disco (``utils.vector_index``)."""
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+vector_index = pytest.importorskip("utils.vector_index")
+
+DIM = vector_index.EMBEDDING_DIM
+
+
+def _vetores(*eixos):
+    """Vetores unitários nos eixos dados: a similaridade entre eixos distintos é 0."""
+    vetores = np.zeros((len(eixos), DIM), dtype=np.float32)
+    vetores[np.arange(len(eixos)), eixos] = 1.0
+    return vetores
+
+
+@pytest.fixture
+def indice(tmp_path):
+    return vector_index.SimilarityIndex(str(tmp_path), "v1")
+
+
+def test_busca_ordena_e_exclui(indice):
+    indice.add([1, 2, 3], _vetores(0, 1, 2))
+    consulta = (_vetores(0)[0] + 0.5 * _vetores(1)[0]) / np.sqrt(1.25)
+
+    assert [paciente_id for paciente_id, _ in indice.search(consulta, k=2)] == [1, 2]
+    assert [paciente_id for paciente_id, _ in indice.search(consulta, k=2, exclude={1})] == [2, 3]
+
+
+def test_vale_a_linha_mais_recente_de_cada_id(indice):
+    indice.add([1, 2], _vetores(0, 1))
+    # Paciente 1 reembeddado: a linha antiga continua no arquivo, mas não vale mais
+    indice.add([1], _vetores(2))
+
+    assert len(indice) == 3
+    assert dict(indice.search(_vetores(0)[0], k=3)) == {1: 0.0, 2: 0.0}
+    assert indice.search(_vetores(2)[0], k=3) == [(1, 1.0), (2, 0.0)]
+
+
+def test_vetores_sem_id_sao_descartados_no_proximo_add(indice):
+    indice.add([1], _vetores(0))
+    # Escrita interrompida: vetores gravados, ids não
+    with open(indice.vectors_path, "ab") as f:
+        f.write(_vetores(5, 6).tobytes())
+
+    indice.add([2], _vetores(1))
+
+    assert os.path.getsize(indice.vectors_path) == 2 * vector_index.ROW_BYTES
+    assert os.path.getsize(indice.ids_path) == 2 * 8
+    assert indice.search(_vetores(1)[0], k=1) == [(2, 1.0)]
+    assert indice.search(_vetores(5)[0], k=1)[0][1] == 0.0
+
+
+def test_reset_e_visto_por_outro_leitor(tmp_path, indice):
+    indice.add([1, 2], _vetores(0, 1))
+    leitor = vector_index.SimilarityIndex(str(tmp_path), "v1")
+    assert len(leitor) == 2
+
+    total = indice.reset([([3], _vetores(2)), ([4], _vetores(3))])
+
+    assert total == 2
+    assert len(leitor) == 2
+    assert leitor.search(_vetores(0)[0], k=1)[0][0] in (3, 4)
+    assert leitor.search(_vetores(3)[0], k=1) == [(4, 1.0)]
+    assert 1 not in {paciente_id for paciente_id, _ in leitor.search(_vetores(0)[0], k=5)}
+
+
+def test_indice_vazio(indice):
+    assert len(indice) == 0
+    assert indice.search(_vetores(0)[0]) == []
+    assert indice.reset([]) == 0
+    assert indice.search(_vetores(0)[0]) == []
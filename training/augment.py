@@ -0,0 +1,228 @@
+"""
+Aumento de dados em lote, com operações vetorizadas de tensor.
+
+Reproduz o pipeline de treino do notebook (``RandomResizedCrop``, flips,
+``RandomBrightnessContrast`` e ``RandomCLAHE``/equalização) sobre lotes
+uint8 inteiros ``(N, 3, H, W)``, em vez de imagem por imagem com PIL dentro
+do ``DataLoader``. A aleatoriedade vem de um ``torch.Generator`` próprio,
+então a mesma semente gera sempre os mesmos lotes.
+
+Para comparar o throughput com o pipeline PIL::
+
+    python -m training.augment --batch-size 64
+"""
+import argparse
+import math
+import time
+
+import torch
+import torch.nn.functional as F
+
+from training.transforms import MEAN, STD
+
+_MEAN = torch.tensor(MEAN).view(1, 3, 1, 1)
+_STD = torch.tensor(STD).view(1, 3, 1, 1)
+
+
+def normalize_batch(images):
+    """Converte um lote uint8 ``(N, 3, H, W)`` para float normalizado pela ImageNet."""
+    return (images.float() / 255 - _MEAN) / _STD
+
+
+def equalize_batch(images):
+    """
+    Equalização de histograma por canal, como ``PIL.ImageOps.equalize``.
+
+    Parameters
+    ----------
+    images : torch.Tensor
+        Lote uint8 ``(N, C, H, W)``.
+
+    Returns
+    -------
+    torch.Tensor
+        Lote uint8 equalizado.
+    """
+    n, c, h, w = images.shape
+    flat = images.reshape(n * c, h * w).long()
+    offsets = torch.arange(n * c).view(-1, 1) * 256
+    hist = torch.bincount((flat + offsets).view(-1), minlength=n * c * 256).view(n * c, 256)
+
+    # step = (total - contagem do último nível não vazio) // 255, como no PIL
+    levels = torch.arange(256).expand(n * c, 256)
+    last = torch.where(hist > 0, levels, torch.zeros_like(levels)).max(dim=1).values
+    step = (hist.sum(dim=1) - hist.gather(1, last.view(-1, 1)).squeeze(1)) // 255
+
+    exclusive = hist.cumsum(dim=1) - hist
+    safe_step = step.clamp_min(1).view(-1, 1)
+    lut = ((safe_step // 2 + exclusive) // safe_step).clamp_max(255)
+    lut = torch.where(step.view(-1, 1) > 0, lut, levels)
+    return lut.gather(1, flat).view(n, c, h, w).to(torch.uint8)
+
+
+class BatchAugment:
+    """
+    Pipeline de aumento de dados aplicado a lotes uint8 inteiros.
+
+    Parameters
+    ----------
+    size : int, optional
+        Lado da saída.
+    scale : tuple of float, optional
+        Faixa da área relativa do recorte (``RandomResizedCrop``).
+    ratio : tuple of float, optional
+        Faixa da razão de aspecto do recorte.
+    brightness, contrast : tuple of float, optional
+        Faixas dos fatores de brilho e contraste.
+    p_flip, p_brightness, p_contrast, p_equalize : float, optional
+        Probabilidades de cada operação por imagem.
+    seed : int, optional
+        Semente do gerador.
+    """
+
+    def __init__(self, size=224, scale=(0.8, 1.2), ratio=(3 / 4, 4 / 3),
+                 brightness=(0.9, 1.1), contrast=(0.9, 1.1),
+                 p_flip=0.5, p_brightness=0.5, p_contrast=0.5, p_equalize=0.5, seed=0):
+        self.size = size
+        self.scale = scale
+        self.ratio = ratio
+        self.brightness = brightness
+        self.contrast = contrast
+        self.p_flip = p_flip
+        self.p_brightness = p_brightness
+        self.p_contrast = p_contrast
+        self.p_equalize = p_equalize
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def _uniform(self, n, low, high):
+        return low + (high - low) * torch.rand(n, generator=self.generator)
+
+    def _coin(self, n, p):
+        return torch.rand(n, generator=self.generator) < p
+
+    def resized_crop(self, images):
+        """Recorte aleatório redimensionado, via ``affine_grid`` + ``grid_sample`` no lote todo."""
+        n = images.shape[0]
+        area = self._uniform(n, *self.scale)
+        log_ratio = self._uniform(n, math.log(self.ratio[0]), math.log(self.ratio[1]))
+        aspect = torch.exp(log_ratio)
+        # Largura e altura relativas do recorte, limitadas à imagem
+        w = torch.sqrt(area * aspect).clamp(max=1.0)
+        h = torch.sqrt(area / aspect).clamp(max=1.0)
+        x0 = self._uniform(n, 0, 1) * (1 - w)
+        y0 = self._uniform(n, 0, 1) * (1 - h)
+
+        theta = torch.zeros(n, 2, 3)
+        theta[:, 0, 0] = w
+        theta[:, 1, 1] = h
+        theta[:, 0, 2] = (x0 + w / 2) * 2 - 1
+        theta[:, 1, 2] = (y0 + h / 2) * 2 - 1
+        grid = F.affine_grid(theta, (n, 3, self.size, self.size), align_corners=False)
+        return F.grid_sample(images, grid, mode='bilinear', padding_mode='border', align_corners=False)
+
+    def flips(self, images):
+        """Flips horizontal e vertical independentes por imagem."""
+        n = images.shape[0]
+        horizontal = self._coin(n, self.p_flip).view(-1, 1, 1, 1)
+        vertical = self._coin(n, self.p_flip).view(-1, 1, 1, 1)
+        images = torch.where(horizontal, images.flip(-1), images)
+        return torch.where(vertical, images.flip(-2), images)
+
+    def brightness_contrast(self, images):
+        """Brilho e contraste como ``ImageEnhance`` do PIL, com fatores por imagem."""
+        n = images.shape[0]
+        factor = torch.where(self._coin(n, self.p_brightness),
+                             self._uniform(n, *self.brightness), torch.ones(n))
+        images = images * factor.view(-1, 1, 1, 1)
+
+        factor = torch.where(self._coin(n, self.p_contrast),
+                             self._uniform(n, *self.contrast), torch.ones(n)).view(-1, 1, 1, 1)
+        # O contraste do PIL mistura a imagem com a média do seu tom de cinza
+        gray = (0.299 * images[:, 0] + 0.587 * images[:, 1] + 0.114 * images[:, 2])
+        mean = gray.mean(dim=(1, 2)).view(-1, 1, 1, 1)
+        return (mean + factor * (images - mean)).clamp(0, 255)
+
+    def __call__(self, images):
+        """
+        Aplica o pipeline a um lote.
+
+        Parameters
+        ----------
+        images : torch.Tensor
+            Lote uint8 ``(N, 3, H, W)``.
+
+        Returns
+        -------
+        torch.Tensor
+            Lote float ``(N, 3, size, size)`` normalizado, pronto para o modelo.
+        """
+        x = self.resized_crop(images.float())
+        x = self.flips(x)
+        x = self.brightness_contrast(x).round().to(torch.uint8)
+
+        equalize = self._coin(x.shape[0], self.p_equalize)
+        if equalize.any():
+            x[equalize] = equalize_batch(x[equalize])
+        return normalize_batch(x)
+
+
+def benchmark(images, batch_size, repeat=3, seed=0):
+    """
+    Compara o throughput do pipeline PIL por imagem com o aumento em lote.
+
+    Parameters
+    ----------
+    images : np.ndarray
+        Imagens uint8 ``(N, H, W, 3)`` (por exemplo, o memmap do dataset).
+    batch_size : int
+        Tamanho do lote do aumento vetorizado.
+
+    Returns
+    -------
+    dict
+        Imagens por segundo de cada pipeline e o ganho.
+    """
+    import numpy as np
+    from PIL import Image
+
+    from training.transforms import data_transforms
+
+    transform = data_transforms['train']
+    pil_images = [Image.fromarray(np.array(image)) for image in images]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for image in pil_images:
+            transform(image)
+    pil_rate = repeat * len(pil_images) / (time.perf_counter() - start)
+
+    augment = BatchAugment(seed=seed)
+    batches = [torch.from_numpy(np.array(images[i:i + batch_size])).permute(0, 3, 1, 2)
+               for i in range(0, len(images), batch_size)]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for batch in batches:
+            augment(batch)
+    batch_rate = repeat * len(images) / (time.perf_counter() - start)
+
+    return {"pil_images_per_s": pil_rate, "batch_images_per_s": batch_rate,
+            "speedup": batch_rate / pil_rate}
+
+
+def main():
+    from training.dataset import MemmapImageFolder
+    from training.features import TRAIN_DIR
+
+    parser = argparse.ArgumentParser(description="Throughput do aumento em lote vs. PIL.")
+    parser.add_argument("--train-dir", default=TRAIN_DIR)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    print(benchmark(MemmapImageFolder(args.train_dir).images, args.batch_size, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
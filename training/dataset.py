@@ -0,0 +1,229 @@
+"""
+Cache pré-decodificado e em memory map do dataset de treino.
+
+O ``ImageFolder`` do notebook relê e redecodifica cada JPEG em todas as
+épocas. Aqui o dataset é decodificado e redimensionado uma única vez para um
+array uint8 ``(N, 224, 224, 3)`` em disco, com um índice de rótulos ao lado.
+O diretório do cache é identificado pelos hashes dos arquivos: qualquer
+imagem adicionada, removida ou alterada gera um cache novo.
+
+O array é aberto em memory map somente leitura, então os workers do
+``DataLoader`` e vários processos de treino compartilham as mesmas páginas
+do page cache do sistema. A construção e a escrita dos manifestos são
+serializadas por ``flock`` e todos os arquivos são gravados num temporário
+seguido de ``os.replace``: processos que abrem o mesmo dataset ao mesmo
+tempo nunca leem um arquivo pela metade.
+
+Uso::
+
+    python -m training.dataset dataset_classifier/train
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+from torchvision import datasets
+
+from training.features import file_hash
+
+CACHE_DIR = os.getenv('DATASET_CACHE_DIR', '.cache/datasets')
+IMAGE_SIZE = 224
+
+
+def _file_hashes(paths, manifest):
+    """Reaproveita hashes do manifesto anterior quando tamanho e mtime não mudaram."""
+    known = {entry["path"]: entry for entry in manifest.get("files", [])}
+    entries = []
+    for path in paths:
+        stat = os.stat(path)
+        entry = known.get(path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            entry = {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                     "sha256": file_hash(path)}
+        entries.append(entry)
+    return entries
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def fingerprint(entries, labels, size):
+    """Identifica o conteúdo do dataset (hashes, rótulos e resolução)."""
+    digest = hashlib.sha256(f"size={size}".encode())
+    for entry, label in zip(entries, labels):
+        digest.update(f"{entry['sha256']}:{label}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def _decode_into(args):
+    """Decodifica um bloco de imagens direto no memmap (executa num worker)."""
+    array_path, shape, start, paths, size = args
+    images = np.memmap(array_path, dtype=np.uint8, mode='r+', shape=shape)
+    for offset, path in enumerate(paths):
+        with Image.open(path) as image:
+            # Mesmo redimensionamento do transforms.Resize((224, 224)) sobre PIL
+            images[start + offset] = np.asarray(
+                image.convert('RGB').resize((size, size), Image.BILINEAR))
+    images.flush()
+
+
+class MemmapImageFolder(Dataset):
+    """
+    Dataset em memory map criado a partir de uma pasta no formato ``ImageFolder``.
+
+    Parameters
+    ----------
+    root : str
+        Pasta com uma subpasta por classe.
+    transform : callable, optional
+        Transformação aplicada à imagem PIL. Sem ela, ``__getitem__`` devolve
+        o tensor uint8 ``(3, H, W)``, próprio para aumento de dados em lote.
+    size : int, optional
+        Lado das imagens armazenadas.
+    cache_dir : str, optional
+        Diretório raiz dos caches.
+    num_workers : int, optional
+        Processos usados na construção do cache.
+    """
+
+    def __init__(self, root, transform=None, size=IMAGE_SIZE, cache_dir=CACHE_DIR,
+                 num_workers=os.cpu_count() or 1):
+        self.root = root
+        self.transform = transform
+        self.size = size
+
+        folder = datasets.ImageFolder(root)
+        self.classes = folder.classes
+        self.class_to_idx = folder.class_to_idx
+        paths = [path for path, _ in folder.samples]
+        labels = [label for _, label in folder.samples]
+
+        name = os.path.basename(os.path.normpath(root))
+        manifest_index = os.path.join(cache_dir, f"{name}.latest.json")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Sob torchrun, todos os ranks chegam aqui: o primeiro constrói o
+        # cache e os demais, ao obter o lock, encontram o manifesto pronto
+        with open(os.path.join(cache_dir, f"{name}.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            previous = {}
+            if os.path.exists(manifest_index):
+                with open(manifest_index) as f:
+                    previous = json.load(f)
+
+            entries = _file_hashes(paths, previous)
+            self.path = os.path.join(cache_dir, f"{name}-{fingerprint(entries, labels, size)}")
+            self.images_path = os.path.join(self.path, "images.u8")
+            self.labels_path = os.path.join(self.path, "labels.npy")
+            self.shape = (len(paths), size, size, 3)
+
+            # O manifesto é gravado por último e marca o cache como completo
+            if not os.path.exists(os.path.join(self.path, "manifest.json")):
+                self._build(paths, labels, num_workers)
+
+            manifest = {"root": root, "classes": self.classes, "shape": self.shape, "files": entries}
+            _write_json(os.path.join(self.path, "manifest.json"), manifest)
+            _write_json(manifest_index, manifest)
+
+        self.labels = np.load(self.labels_path)
+        self._images = None
+
+    def _build(self, paths, labels, num_workers):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f"{self.images_path}.{os.getpid()}.tmp"
+        np.memmap(tmp_path, dtype=np.uint8, mode='w+', shape=self.shape).flush()
+
+        chunk = max(1, len(paths) // (num_workers * 4))
+        jobs = [(tmp_path, self.shape, start, paths[start:start + chunk], self.size)
+                for start in range(0, len(paths), chunk)]
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            list(pool.map(_decode_into, jobs))
+
+        labels_tmp_path = f"{self.labels_path}.{os.getpid()}.tmp"
+        with open(labels_tmp_path, "wb") as f:
+            np.save(f, np.asarray(labels, dtype=np.int64))
+        os.replace(labels_tmp_path, self.labels_path)
+        os.replace(tmp_path, self.images_path)
+
+    @property
+    def images(self):
+        """Array ``(N, H, W, 3)`` uint8 em memory map, aberto sob demanda em cada worker."""
+        if self._images is None:
+            self._images = np.memmap(self.images_path, dtype=np.uint8, mode='r', shape=self.shape)
+        return self._images
+
+    def __getstate__(self):
+        # O memmap é reaberto no worker em vez de ser serializado
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        image = self.images[index]
+        label = int(self.labels[index])
+        if self.transform is not None:
+            return self.transform(Image.fromarray(np.array(image))), label
+        return torch.from_numpy(np.array(image)).permute(2, 0, 1), label
+
+
+def make_loader(dataset, batch_size=8, shuffle=False, num_workers=os.cpu_count() or 0,
+                sampler=None, seed=0):
+    """
+    Cria um ``DataLoader`` multi-worker sobre o dataset em memory map.
+
+    Parameters
+    ----------
+    dataset : MemmapImageFolder
+        O dataset.
+    batch_size : int, optional
+        Tamanho do lote.
+    shuffle : bool, optional
+        Embaralha as amostras a cada época (ignorado se ``sampler`` for dado).
+    num_workers : int, optional
+        Número de workers.
+    sampler : torch.utils.data.Sampler, optional
+        Sampler explícito, por exemplo um ``DistributedSampler``.
+    seed : int, optional
+        Semente do embaralhamento.
+
+    Returns
+    -------
+    torch.utils.data.DataLoader
+    """
+    return DataLoader(dataset,
+                      batch_size=batch_size,
+                      shuffle=shuffle if sampler is None else False,
+                      sampler=sampler,
+                      num_workers=num_workers,
+                      persistent_workers=num_workers > 0,
+                      generator=torch.Generator().manual_seed(seed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Constrói o cache em memory map de um dataset.")
+    parser.add_argument("root", nargs="+")
+    parser.add_argument("--size", type=int, default=IMAGE_SIZE)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args()
+
+    for root in args.root:
+        dataset = MemmapImageFolder(root, size=args.size, cache_dir=args.cache_dir)
+        print(f"{root}: {len(dataset)} imagens em {dataset.images_path}")
+
+
+if __name__ == "__main__":
+    main()
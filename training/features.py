@@ -0,0 +1,310 @@
+"""
+Cache de features da AlexNet congelada para treinar só a camada final.
+
+O notebook congela todos os parâmetros exceto ``model.classifier[6]``, mas a
+cada época recalcula as convoluções e as camadas fc6/fc7 para todas as
+imagens. Aqui as ativações de 4096 dimensões da penúltima camada são
+calculadas uma vez, gravadas em disco (chave: hash da imagem + transformação)
+e as épocas treinam apenas a ``Linear`` final sobre elas.
+
+Para o treino com aumento de dados, é pré-calculado um número fixo de
+visões aumentadas por imagem, com sementes determinísticas; cada época usa
+uma dessas visões.
+
+Observação: as features são extraídas em modo de avaliação, então o dropout
+antes de fc6/fc7 (ativo no ``model.train()`` do notebook) não é aplicado.
+
+Uso::
+
+    python -m training.features --views 10 --epochs 100
+"""
+import argparse
+import hashlib
+import os
+import random
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+from torchvision import datasets, models
+
+from training.transforms import data_transforms
+
+TRAIN_DIR = 'dataset_classifier/train'
+TEST_DIR = 'dataset_classifier/test'
+CACHE_DIR = os.getenv('FEATURE_CACHE_DIR', '.cache/features')
+MODELS_DIR = 'models'
+FEATURE_DIM = 4096
+
+
+def file_hash(path):
+    """Retorna o SHA-256 do conteúdo de um arquivo."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def transform_key(transform, seed):
+    """Identifica uma transformação (e a semente das visões) no cache."""
+    return hashlib.sha1(f"{transform!r}|seed={seed}".encode()).hexdigest()[:16]
+
+
+def build_backbone():
+    """
+    Retorna a AlexNet ImageNet truncada na penúltima camada (saída de fc7).
+
+    Returns
+    -------
+    torch.nn.Module
+        Módulo que mapeia ``(N, 3, 224, 224)`` para ``(N, 4096)``.
+    """
+    alexnet = models.alexnet(weights='AlexNet_Weights.IMAGENET1K_V1')
+    backbone = nn.Sequential(
+        alexnet.features,
+        alexnet.avgpool,
+        nn.Flatten(1),
+        *alexnet.classifier[:6]
+    )
+    backbone.eval()
+    for param in backbone.parameters():
+        param.requires_grad = False
+    return backbone
+
+
+class _ViewDataset(Dataset):
+    """Carrega e transforma as visões ``(caminho, visão)`` ainda fora do cache."""
+
+    def __init__(self, items, transform, seed):
+        self.items = items
+        self.transform = transform
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        path, digest, view = self.items[index]
+        # Semente derivada da imagem e da visão: a mesma visão é sempre igual
+        view_seed = int(digest[:8], 16) ^ (self.seed * 1_000_003 + view)
+        random.seed(view_seed)
+        torch.manual_seed(view_seed)
+        image = Image.open(path).convert('RGB')
+        return self.transform(image), index
+
+
+class FeatureCache:
+    """
+    Cache em disco das features da penúltima camada.
+
+    Cada imagem é gravada em ``<cache_dir>/<transform_key>/<hh>/<sha256>.npy``
+    com forma ``(views, 4096)`` em float32.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Diretório raiz do cache.
+    batch_size : int, optional
+        Tamanho do lote de extração.
+    num_workers : int, optional
+        Número de processos de leitura e transformação das imagens.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, batch_size=32, num_workers=os.cpu_count() or 0):
+        self.cache_dir = cache_dir
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self._backbone = None
+
+    @property
+    def backbone(self):
+        if self._backbone is None:
+            self._backbone = build_backbone()
+        return self._backbone
+
+    def _path(self, key, digest):
+        return os.path.join(self.cache_dir, key, digest[:2], f"{digest}.npy")
+
+    def features(self, paths, transform, views=1, seed=0):
+        """
+        Retorna as features das imagens, calculando só o que não está em cache.
+
+        Parameters
+        ----------
+        paths : sequence of str
+            Caminhos das imagens.
+        transform : callable
+            Transformação PIL -> tensor normalizado.
+        views : int, optional
+            Número de visões por imagem (use >1 com transformações aleatórias).
+        seed : int, optional
+            Semente base das visões aumentadas.
+
+        Returns
+        -------
+        np.ndarray
+            Matriz ``(len(paths), views, 4096)`` float32.
+        """
+        key = transform_key(transform, seed)
+        digests = [file_hash(path) for path in paths]
+        out = np.empty((len(paths), views, FEATURE_DIM), dtype=np.float32)
+
+        missing = []
+        for i, (path, digest) in enumerate(zip(paths, digests)):
+            cached = self._path(key, digest)
+            if os.path.exists(cached):
+                stored = np.load(cached, mmap_mode='r')
+                if stored.shape[0] >= views:
+                    out[i] = stored[:views]
+                    continue
+            missing.append(i)
+
+        if missing:
+            items = [(paths[i], digests[i], view) for i in missing for view in range(views)]
+            loader = DataLoader(_ViewDataset(items, transform, seed),
+                                batch_size=self.batch_size,
+                                num_workers=self.num_workers)
+            with torch.no_grad():
+                for batch, indices in loader:
+                    for feature, index in zip(self.backbone(batch).numpy(), indices.tolist()):
+                        out[missing[index // views], index % views] = feature
+
+            for i in missing:
+                cached = self._path(key, digests[i])
+                os.makedirs(os.path.dirname(cached), exist_ok=True)
+                np.save(cached, out[i])
+
+        return out
+
+
+def train_head(train_features, train_labels, num_classes, epochs=100, lr=0.001, batch_size=8, seed=0):
+    """
+    Treina a ``Linear`` final sobre features em cache.
+
+    Em cada época é usada uma visão por imagem (rodízio entre as visões
+    pré-calculadas).
+
+    Parameters
+    ----------
+    train_features : np.ndarray
+        Features ``(N, views, 4096)``.
+    train_labels : np.ndarray
+        Rótulos ``(N,)``.
+    num_classes : int
+        Número de classes.
+    epochs : int, optional
+        Número de épocas.
+    lr : float, optional
+        Taxa de aprendizado do Adam.
+    batch_size : int, optional
+        Tamanho do lote.
+    seed : int, optional
+        Semente de inicialização e embaralhamento.
+
+    Returns
+    -------
+    tuple of (torch.nn.Linear, list of float)
+        A camada treinada e a perda média de cada época.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    torch.manual_seed(seed)
+    features = torch.from_numpy(train_features)
+    labels = torch.as_tensor(train_labels, dtype=torch.long)
+    views = features.shape[1]
+
+    head = nn.Linear(FEATURE_DIM, num_classes)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr)
+
+    train_losses = []
+    for epoch in range(epochs):
+        epoch_features = features[:, epoch % views]
+        order = torch.randperm(len(labels), generator=generator)
+        running_loss = 0.0
+        num_batches = 0
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            optimizer.zero_grad()
+            loss = criterion(head(epoch_features[idx]), labels[idx])
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item()
+            num_batches += 1
+        train_losses.append(running_loss / num_batches)
+        print(f'Epoch [{epoch+1}/{epochs}], Loss: {train_losses[-1]:.4f}')
+    return head, train_losses
+
+
+def evaluate_head(head, features, labels):
+    """Retorna a acurácia da camada final sobre features ``(N, 1, 4096)``."""
+    with torch.no_grad():
+        predicted = head(torch.from_numpy(features[:, 0])).argmax(dim=1).numpy()
+    return float((predicted == np.asarray(labels)).mean())
+
+
+def save_weights(head, acc, models_dir=MODELS_DIR):
+    """
+    Salva os pesos completos da AlexNet no formato consumido por ``load_model``.
+
+    Returns
+    -------
+    str
+        Caminho do arquivo ``.pth`` gravado.
+    """
+    model = models.alexnet(weights='AlexNet_Weights.IMAGENET1K_V1')
+    model.classifier[6] = head
+    return save_state_dict(model.state_dict(), acc, head.out_features, models_dir)
+
+
+def save_state_dict(state_dict, acc, num_classes, models_dir=MODELS_DIR):
+    """
+    Grava um ``state_dict`` completo da AlexNet com o nome usado pelo notebook.
+
+    Returns
+    -------
+    str
+        Caminho ``models/alexnet_acc_{acc}_num_classes{n}_weights.pth``.
+    """
+    os.makedirs(models_dir, exist_ok=True)
+    path = os.path.join(models_dir, f'alexnet_acc_{acc:.2f}_num_classes{num_classes}_weights.pth')
+    torch.save(state_dict, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Treina a camada final da AlexNet sobre features em cache.")
+    parser.add_argument("--train-dir", default=TRAIN_DIR)
+    parser.add_argument("--test-dir", default=TEST_DIR)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--views", type=int, default=10,
+                        help="Visões aumentadas pré-calculadas por imagem de treino.")
+    parser.add_argument("--epochs", type=int, default=100)
+    parser.add_argument("--lr", type=float, default=0.001)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    train_dataset = datasets.ImageFolder(root=args.train_dir)
+    test_dataset = datasets.ImageFolder(root=args.test_dir)
+    train_paths, train_labels = zip(*train_dataset.samples)
+    test_paths, test_labels = zip(*test_dataset.samples)
+
+    cache = FeatureCache(args.cache_dir)
+    train_features = cache.features(train_paths, data_transforms['train'], views=args.views, seed=args.seed)
+    test_features = cache.features(test_paths, data_transforms['test'])
+
+    head, _ = train_head(train_features, np.array(train_labels), len(train_dataset.classes),
+                         epochs=args.epochs, lr=args.lr, batch_size=args.batch_size, seed=args.seed)
+    acc = evaluate_head(head, test_features, test_labels)
+    print(f'Accuracy: {acc:.4f}')
+
+    if not args.no_save:
+        print(f'Pesos salvos em {save_weights(head, acc)}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Treino data-parallel em CPU da AlexNet, substituindo o laço do notebook.
+
+Usa ``torch.distributed`` com o backend gloo. Numa máquina, ``--nproc``
+dispara um processo por grupo de núcleos; para vários nós, use o
+``torchrun``, que define ``RANK``/``WORLD_SIZE``/``MASTER_ADDR``::
+
+    python -m training.train --nproc 4 --epochs 100
+    torchrun --nnodes 2 --nproc-per-node 4 --rdzv-endpoint host:29500 -m training.train
+
+O treino é determinístico para uma mesma semente e número de processos,
+grava um checkpoint por época (``--resume`` continua de onde parou) e, ao
+final, salva os pesos no mesmo formato consumido por ``load_model``.
+"""
+import argparse
+import os
+import random
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
+from torchvision import models
+
+from training.augment import BatchAugment
+from training.dataset import MemmapImageFolder, make_loader
+from training.features import TEST_DIR, TRAIN_DIR, save_state_dict
+from training.transforms import data_transforms
+
+CHECKPOINT_DIR = 'checkpoints'
+
+# Camadas treináveis: só a última (como no notebook), todo o classificador ou a rede inteira
+TRAINABLE = {
+    "head": ("classifier.6.",),
+    "classifier": ("classifier.",),
+    "all": ("",),
+}
+
+
+def seed_everything(seed):
+    """Fixa as sementes de Python, NumPy e torch."""
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    torch.use_deterministic_algorithms(True, warn_only=True)
+
+
+def build_model(num_classes, trainable="head"):
+    """
+    AlexNet da ImageNet com a última camada trocada e as demais congeladas.
+
+    Parameters
+    ----------
+    num_classes : int
+        Número de classes.
+    trainable : str, optional
+        Uma das chaves de ``TRAINABLE``.
+
+    Returns
+    -------
+    torch.nn.Module
+    """
+    model = models.alexnet(weights='AlexNet_Weights.IMAGENET1K_V1')
+    model.classifier[6] = nn.Linear(model.classifier[6].in_features, num_classes)
+    prefixes = TRAINABLE[trainable]
+    for name, param in model.named_parameters():
+        param.requires_grad = name.startswith(prefixes)
+    return model
+
+
+def evaluate(model, loader):
+    """Retorna a acurácia do modelo sobre um loader."""
+    model.eval()
+    correct = total = 0
+    with torch.no_grad():
+        for inputs, labels in loader:
+            correct += (model(inputs).argmax(dim=1) == labels).sum().item()
+            total += labels.size(0)
+    return correct / total
+
+
+def train(rank, world_size, args):
+    """Laço de treino de um processo (rank) do grupo."""
+    distributed = world_size > 1
+    if distributed and not dist.is_initialized():
+        dist.init_process_group("gloo", rank=rank, world_size=world_size)
+
+    # Divide os núcleos da máquina entre os processos locais
+    local_world_size = int(os.getenv("LOCAL_WORLD_SIZE", args.nproc or world_size))
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+    seed_everything(args.seed + rank)
+
+    # O rank 0 constrói o cache; os demais esperam na barreira e só então o abrem
+    if distributed and rank != 0:
+        dist.barrier()
+    if args.batch_augment:
+        # O loader entrega lotes uint8 e o aumento é feito no lote inteiro
+        train_dataset = MemmapImageFolder(args.train_dir)
+        augment = BatchAugment(seed=args.seed + rank)
+    else:
+        train_dataset = MemmapImageFolder(args.train_dir, transform=data_transforms['train'])
+        augment = None
+    if distributed and rank == 0:
+        dist.barrier()
+    sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank,
+                                 shuffle=True, seed=args.seed) if distributed else None
+    train_loader = make_loader(train_dataset, batch_size=args.batch_size, shuffle=True,
+                               num_workers=args.workers, sampler=sampler, seed=args.seed + rank)
+
+    torch.manual_seed(args.seed)  # mesma inicialização da cabeça em todos os ranks
+    model = build_model(len(train_dataset.classes), args.trainable)
+    ddp_model = DistributedDataParallel(model) if distributed else model
+
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam([p for p in model.parameters() if p.requires_grad], lr=args.lr)
+
+    start_epoch = 0
+    checkpoint_path = os.path.join(args.checkpoint_dir, "last.pt")
+    if args.resume and os.path.exists(checkpoint_path):
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+        model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        start_epoch = checkpoint["epoch"] + 1
+        if rank == 0:
+            print(f"Retomando da época {start_epoch + 1}")
+
+    for epoch in range(start_epoch, args.epochs):
+        if sampler is not None:
+            sampler.set_epoch(epoch)
+        ddp_model.train()
+        running = torch.zeros(2)
+        for inputs, labels in train_loader:
+            if augment is not None:
+                inputs = augment(inputs)
+            optimizer.zero_grad()
+            loss = criterion(ddp_model(inputs), labels)
+            loss.backward()
+            optimizer.step()
+            running += torch.tensor([loss.item(), 1.0])
+        if distributed:
+            dist.all_reduce(running)
+
+        if rank == 0:
+            print(f'Epoch [{epoch+1}/{args.epochs}], Loss: {running[0] / running[1]:.4f}')
+            os.makedirs(args.checkpoint_dir, exist_ok=True)
+            tmp_path = f"{checkpoint_path}.tmp"
+            torch.save({"epoch": epoch,
+                        "model": model.state_dict(),
+                        "optimizer": optimizer.state_dict(),
+                        "args": vars(args)}, tmp_path)
+            os.replace(tmp_path, checkpoint_path)
+
+    if rank == 0:
+        test_dataset = MemmapImageFolder(args.test_dir, transform=data_transforms['test'])
+        acc = evaluate(model, make_loader(test_dataset, batch_size=32, num_workers=args.workers))
+        print(f'Accuracy: {acc:.4f}')
+        if not args.no_save:
+            print(f'Pesos salvos em {save_state_dict(model.state_dict(), acc, len(test_dataset.classes))}')
+
+    if distributed:
+        dist.barrier()
+        dist.destroy_process_group()
+
+
+def _spawned(local_rank, args):
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    os.environ.setdefault("MASTER_PORT", str(args.port))
+    train(local_rank, args.nproc, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Treino data-parallel em CPU da AlexNet.")
+    parser.add_argument("--train-dir", default=TRAIN_DIR)
+    parser.add_argument("--test-dir", default=TEST_DIR)
+    parser.add_argument("--trainable", choices=list(TRAINABLE), default="head")
+    parser.add_argument("--epochs", type=int, default=100)
+    parser.add_argument("--lr", type=float, default=0.001)
+    parser.add_argument("--batch-size", type=int, default=8, help="Lote por processo.")
+    parser.add_argument("--workers", type=int, default=2, help="Workers do DataLoader por processo.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-augment", action="store_true",
+                        help="Aumento de dados vetorizado no lote em vez do pipeline PIL.")
+    parser.add_argument("--nproc", type=int, default=0,
+                        help="Processos locais a disparar (ignorado sob torchrun).")
+    parser.add_argument("--port", type=int, default=29500)
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR)
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    if "RANK" in os.environ:
+        # Lançado pelo torchrun (um ou vários nós)
+        train(int(os.environ["RANK"]), int(os.environ["WORLD_SIZE"]), args)
+    elif args.nproc > 1:
+        # Constrói o cache antes de disparar os processos, para não construí-lo em paralelo
+        MemmapImageFolder(args.train_dir)
+        MemmapImageFolder(args.test_dir)
+        mp.spawn(_spawned, args=(args,), nprocs=args.nproc, join=True)
+    else:
+        train(0, 1, args)
+
+
+if __name__ == "__main__":
+    main()
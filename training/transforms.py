@@ -0,0 +1,63 @@
+"""
+Transformações de treino e teste, portadas do notebook AlexNet_classifier.ipynb.
+"""
+import random
+
+from PIL import ImageEnhance, ImageOps
+from torchvision import transforms
+
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
+
+# Definir as transformações personalizadas
+class RandomBrightnessContrast:
+    def __init__(self, brightness=(0.9, 1.1), contrast=(0.9, 1.1)):
+        self.brightness = brightness
+        self.contrast = contrast
+
+    def __call__(self, img):
+        if random.random() > 0.5:
+            enhancer = ImageEnhance.Brightness(img)
+            img = enhancer.enhance(random.uniform(*self.brightness))
+        if random.random() > 0.5:
+            enhancer = ImageEnhance.Contrast(img)
+            img = enhancer.enhance(random.uniform(*self.contrast))
+        return img
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(brightness={self.brightness}, contrast={self.contrast})"
+
+
+class RandomCLAHE:
+    def __init__(self, clip_limit=2.0, tile_grid_size=(8, 8)):
+        self.clip_limit = clip_limit
+        self.tile_grid_size = tile_grid_size
+
+    def __call__(self, img):
+        if random.random() > 0.5:
+            img = ImageOps.equalize(img)
+        return img
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(clip_limit={self.clip_limit}, tile_grid_size={self.tile_grid_size})"
+
+
+# Definir as transformações para o dataset
+data_transforms = {
+    'train': transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.RandomResizedCrop(224, scale=(0.8, 1.2)),
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomVerticalFlip(),
+        RandomBrightnessContrast(),
+        RandomCLAHE(),
+        transforms.ToTensor(),
+        transforms.Normalize(MEAN, STD)
+    ]),
+    'test': transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize(MEAN, STD)
+    ]),
+}
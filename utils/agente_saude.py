@@ -1,41 +1,16 @@
-import os
-import bcrypt
 import streamlit as st
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
+from utils.auth import AuthBusy, authenticate, current_user, hash_password, login
+from utils.db import database_available, get_session
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 import time
+import json
+import zipfile
+from utils.fila_offline import CONFLITO, ERRO, PENDENTE, SINCRONIZADO, get_queue, sync_now, sync_status
+from utils.importacao import COLUMNS, import_patients, read_zip
 from utils.paciente import register
+from utils.tracing import span
 
-load_dotenv()
-
-# Obtendo os valores das variáveis de ambiente
-host = os.getenv('DB_HOST', 'localhost')
-port = os.getenv('DB_PORT', 5432)
-database = os.getenv('DB_DATABASE', 'LeisHticIA_gold')
-user = os.getenv('DB_USER', 'postgres')
-password = os.environ.get("PG_PASSWORD")
-
-# Configurando a conexão com o banco de dados usando SQLAlchemy
-DATABASE_URL = f"postgresql://{user}:{password}@{host}:{port}/{database}"
-
-
-@st.cache_resource
-def get_engine():
-    """
-    Retorna o engine do SQLAlchemy para conex o com o banco de dados.
-    
-    Returns
-    -------
-    engine : sqlalchemy.engine.Engine
-        O engine do SQLAlchemy para conex o com o banco de dados.
-    """
-    return create_engine(DATABASE_URL)
-
-
-# Inicializando o SessionMaker
-engine = get_engine()
-Session = sessionmaker(bind=engine)
 
 # Página de login/cadastro do ACS
 
@@ -66,18 +41,17 @@ def acs_login():
     register_button = st.button("Cadastrar-se")
 
     if login_button:
-        session = Session()
+        session = get_session()
         try:
-            query = text("SELECT * FROM AGENTE_COMUNITARIO WHERE NOME = :username")
-            result = session.execute(
-                query, {"username": username}).mappings().fetchone()
-
-            if result and bcrypt.checkpw(password.encode('utf-8'), bytes(result["senha"])):
+            user = authenticate(session, "acs", username, password)
+            if user:
+                login(user)
                 st.success("Login realizado com sucesso!")
-                st.session_state["acs_logged_in"] = True
-                st.session_state["acs_user"] = result
+                st.rerun()
             else:
                 st.error("Usuário ou senha inválidos!")
+        except AuthBusy:
+            st.warning("Muitos acessos no momento. Tente novamente em alguns segundos.")
         except Exception as e:
             st.error(f"Erro ao conectar ao banco: {e}")
         finally:
@@ -115,9 +89,12 @@ def acs_register():
         if not nome or not area or not senha:
             st.error("Por favor, preencha todos os campos.")
             return
-        hashed_password = bcrypt.hashpw(
-            senha.encode('utf-8'), bcrypt.gensalt(12))
-        session = Session()
+        try:
+            hashed_password = hash_password(senha)
+        except AuthBusy:
+            st.warning("Muitos acessos no momento. Tente novamente em alguns segundos.")
+            return
+        session = get_session()
         try:
             query = text("""
                 INSERT INTO AGENTE_COMUNITARIO (NOME, SENHA, ENDERECO, CEP, AREA, MICRO_AREA)
@@ -136,12 +113,121 @@ def acs_register():
             time.sleep(2)
             st.session_state["show_register"] = False
             st.rerun()
+        except IntegrityError:
+            st.error("Já existe um cadastro com esse nome. Escolha outro nome de usuário.")
+            session.rollback()
         except Exception as e:
             st.error(f"Erro ao inserir dados: {e}")
             session.rollback()
         finally:
             session.close()
 
+
+# Importação de vários pacientes de uma vez
+def bulk_import():
+    """
+    Importa em lote os pacientes coletados em campo.
+
+    Aceita um ZIP com um CSV e as imagens, ou um CSV com as imagens enviadas
+    à parte. Ao final, mostra os pacientes gravados e os erros de cada linha.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    None
+    """
+    st.subheader("Importação em lote")
+    st.caption("Colunas do CSV: " + ", ".join(COLUMNS) + ". A coluna imagem traz o nome do arquivo da foto.")
+    arquivo = st.file_uploader("Arquivo CSV ou ZIP", type=["csv", "zip"], key="importacao_arquivo")
+    fotos = st.file_uploader("Imagens (se o CSV for enviado sem ZIP)", type=["jpg", "jpeg", "png"],
+                             accept_multiple_files=True, key="importacao_fotos")
+
+    if not st.button("Importar", disabled=arquivo is None):
+        return
+
+    try:
+        if arquivo.name.lower().endswith(".zip"):
+            csv_text, images = read_zip(arquivo.getvalue())
+        else:
+            csv_text = arquivo.getvalue().decode("utf-8-sig")
+            images = {foto.name: foto.getvalue() for foto in fotos}
+    except (ValueError, zipfile.BadZipFile, UnicodeDecodeError) as e:
+        st.error(f"Arquivo inválido: {e}")
+        return
+
+    barra = st.progress(0.0, text="Importando pacientes...")
+    session = get_session()
+    try:
+        with span("bulk_import"):
+            report = import_patients(session, csv_text, images,
+                                     progress=lambda fracao: barra.progress(fracao, text="Importando pacientes..."))
+    except ValueError as e:
+        st.error(str(e))
+        return
+    finally:
+        session.close()
+
+    st.success(f"{len(report.importados)} paciente(s) importado(s), {len(report.erros)} linha(s) com erro.")
+    if report.importados:
+        st.dataframe([{"Linha": linha, "Nome": nome, "ID": paciente_id, "Predição": classe}
+                      for linha, nome, paciente_id, classe in report.importados], hide_index=True)
+    if report.erros:
+        st.dataframe([{"Linha": erro.linha, "Nome": erro.nome, "Erro": erro.mensagem}
+                      for erro in report.erros], hide_index=True)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _banco_disponivel():
+    # Verificado no máximo a cada 30 s, para não esperar o timeout de
+    # conexão a cada rerun quando o aparelho está sem rede
+    return database_available()
+
+
+# Cadastros guardados no aparelho
+def offline_queue():
+    """
+    Mostra a fila offline do aparelho e permite sincronizá-la.
+
+    Cadastros em conflito (nome já usado no banco central) podem ser
+    renomeados e devolvidos à fila.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    None
+    """
+    status = sync_status()
+    contagem = status["contagem"]
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Pendentes", contagem.get(PENDENTE, 0))
+    col2.metric("Sincronizados", contagem.get(SINCRONIZADO, 0))
+    col3.metric("Conflitos e erros", contagem.get(CONFLITO, 0) + contagem.get(ERRO, 0))
+    if status["ultima"]:
+        st.caption(f"Última sincronização: {status['ultima']}")
+    if status["erro"]:
+        st.error(f"Erro na última sincronização: {status['erro']}")
+
+    if st.button("Sincronizar agora", disabled=not contagem.get(PENDENTE)):
+        with st.spinner("Enviando cadastros..."):
+            with span("offline_sync"):
+                gravados = sync_now()
+        _banco_disponivel.clear()
+        st.success(f"{gravados} cadastro(s) enviado(s).")
+
+    for captura in get_queue().with_status(CONFLITO) + get_queue().with_status(ERRO):
+        nome = json.loads(captura["DADOS"])["nome"]
+        with st.expander(f"{nome} — {captura['MENSAGEM']}"):
+            novo_nome = st.text_input("Novo nome", value=nome, key=f"captura_{captura['CAPTURA_ID']}")
+            if st.button("Reenviar", key=f"reenviar_{captura['CAPTURA_ID']}"):
+                get_queue().resolve(captura["CAPTURA_ID"], novo_nome)
+                st.rerun()
+
 # Controla o fluxo entre login e cadastro
 
 
@@ -153,12 +239,26 @@ def acs_area():
     Caso contrário, verifica se o botão de cadastro foi apertado e, se sim, chama a função
     de cadastro, senão, chama a função de login.
     """
-    if "acs_logged_in" not in st.session_state or not st.session_state["acs_logged_in"]:
+    user = current_user("acs")
+    if user is None:
         if "show_register" in st.session_state and st.session_state["show_register"]:
             acs_register()
         else:
             acs_login()
     else:
-        st.success(f"Bem-vindo, {st.session_state['acs_user']['nome']}!")
+        st.success(f"Bem-vindo, {user.nome}!")
         st.write("Agora você pode cadastrar pacientes.")
-        register()
+        online = _banco_disponivel()
+        if not online:
+            st.warning("Sem conexão com o banco: os cadastros ficam salvos no aparelho "
+                       "e são enviados quando a conexão voltar.")
+        individual, lote, fila = st.tabs(["Cadastro individual", "Importação em lote", "Fila offline"])
+        with individual:
+            register(fila=None if online else get_queue(), acs_id=user.id)
+        with lote:
+            if online:
+                bulk_import()
+            else:
+                st.info("A importação em lote precisa de conexão com o banco.")
+        with fila:
+            offline_queue()
@@ -0,0 +1,264 @@
+"""
+Autenticação compartilhada pelas áreas do paciente, do médico e do ACS.
+
+- o login lê apenas ``ID``, ``NOME`` e ``SENHA`` da tabela do perfil;
+- o bcrypt roda num pool de threads limitado, fora da thread do script
+  Streamlit (a biblioteca libera o GIL durante o hash), e logins além da
+  capacidade do pool recebem ``AuthBusy`` em vez de enfileirar sem limite;
+- depois do login, a sessão guarda só um token assinado (HMAC-SHA256) com
+  perfil, id, nome e validade: os reruns verificam o token sem ir ao banco;
+- se ``BCRYPT_ROUNDS`` mudar, a senha é refeita com o novo custo no
+  próximo login bem-sucedido.
+
+Configuração por variáveis de ambiente: ``BCRYPT_ROUNDS`` (12),
+``AUTH_WORKERS`` (2), ``AUTH_MAX_PENDING`` (16), ``SESSION_SECRET`` e
+``SESSION_TTL_S`` (8 horas). Sem ``SESSION_SECRET``, uma chave aleatória é
+gerada por processo e os tokens deixam de valer quando o app reinicia.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import bcrypt
+import streamlit as st
+from sqlalchemy import text
+
+from utils.tracing import count, span
+
+logger = logging.getLogger(__name__)
+
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+AUTH_WORKERS = int(os.getenv('AUTH_WORKERS', 2))
+AUTH_MAX_PENDING = int(os.getenv('AUTH_MAX_PENDING', 16))
+SESSION_TTL_S = int(os.getenv('SESSION_TTL_S', 8 * 3600))
+SESSION_SECRET = (os.getenv('SESSION_SECRET') or '').encode('utf-8') or secrets.token_bytes(32)
+
+# Tabela e chave primária de cada perfil
+ROLES = {
+    "paciente": ("PACIENTE", "PACIENTE_ID"),
+    "medico": ("MEDICO", "MEDICO_ID"),
+    "acs": ("AGENTE_COMUNITARIO", "ACS_ID"),
+}
+
+
+class AuthBusy(RuntimeError):
+    """Há logins demais aguardando o bcrypt; o usuário deve tentar de novo."""
+
+
+@dataclass(frozen=True)
+class User:
+    """Usuário autenticado, reconstruído a partir do token da sessão."""
+
+    role: str
+    id: int
+    nome: str
+
+
+_pending = threading.BoundedSemaphore(AUTH_MAX_PENDING)
+
+
+@st.cache_resource(show_spinner=False)
+def _get_hash_pool():
+    """Retorna o pool de threads que executa o bcrypt."""
+    return ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="auth-bcrypt")
+
+
+def _run_bcrypt(fn, *args):
+    if not _pending.acquire(blocking=False):
+        count("bcrypt_rejected")
+        raise AuthBusy("muitos logins simultâneos")
+    try:
+        with span("bcrypt"):
+            return _get_hash_pool().submit(fn, *args).result()
+    finally:
+        _pending.release()
+
+
+def hash_password(password, rounds=None):
+    """
+    Gera o hash bcrypt de uma senha no pool de autenticação.
+
+    Parameters
+    ----------
+    password : str
+        A senha em texto puro.
+    rounds : int, optional
+        O fator de custo; por padrão ``BCRYPT_ROUNDS``.
+
+    Returns
+    -------
+    bytes
+        O hash no formato ``$2b$<custo>$...``.
+    """
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
+    return _run_bcrypt(bcrypt.hashpw, password.encode('utf-8'), salt)
+
+
+def check_password(password, hashed):
+    """Confere uma senha contra um hash bcrypt no pool de autenticação."""
+    return _run_bcrypt(bcrypt.checkpw, password.encode('utf-8'), bytes(hashed))
+
+
+def hash_rounds(hashed):
+    """Retorna o fator de custo gravado num hash bcrypt."""
+    return int(bytes(hashed)[4:6])
+
+
+_dummy_hash = None
+
+
+def _get_dummy_hash():
+    # Hash usado quando o usuário não existe, para que a resposta leve o
+    # mesmo tempo e não revele quais nomes estão cadastrados
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_hex(16))
+    return _dummy_hash
+
+
+def authenticate(session, role, nome, password):
+    """
+    Verifica as credenciais de um usuário.
+
+    Apenas id, nome e hash são lidos. Se o hash armazenado usar um custo
+    diferente de ``BCRYPT_ROUNDS``, a senha é refeita e gravada.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Sessão aberta do banco de dados.
+    role : str
+        Uma das chaves de ``ROLES``.
+    nome : str
+        O nome de usuário.
+    password : str
+        A senha digitada.
+
+    Returns
+    -------
+    User or None
+        O usuário autenticado, ou ``None`` se as credenciais forem inválidas.
+
+    Raises
+    ------
+    AuthBusy
+        Se o pool de autenticação estiver saturado.
+    """
+    table, id_column = ROLES[role]
+    row = session.execute(
+        text(f"SELECT {id_column} AS id, NOME AS nome, SENHA AS senha FROM {table} WHERE NOME = :nome"),
+        {"nome": nome}).mappings().fetchone()
+
+    if row is None:
+        check_password(password, _get_dummy_hash())
+        return None
+    if not check_password(password, row["senha"]):
+        return None
+
+    if hash_rounds(row["senha"]) != BCRYPT_ROUNDS:
+        session.execute(
+            text(f"UPDATE {table} SET SENHA = :senha WHERE {id_column} = :id"),
+            {"senha": hash_password(password), "id": row["id"]})
+        session.commit()
+        logger.info("Senha de %s %s refeita com custo %d.", role, row["id"], BCRYPT_ROUNDS)
+
+    return User(role=role, id=row["id"], nome=row["nome"])
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode('ascii')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload):
+    return hmac.new(SESSION_SECRET, payload, hashlib.sha256).digest()
+
+
+def issue_token(user, ttl_s=SESSION_TTL_S):
+    """
+    Gera um token de sessão assinado para o usuário.
+
+    Parameters
+    ----------
+    user : User
+        O usuário autenticado.
+    ttl_s : int, optional
+        Validade do token, em segundos.
+
+    Returns
+    -------
+    str
+        ``<payload>.<assinatura>``, ambos em base64 url-safe.
+    """
+    payload = json.dumps({"r": user.role, "i": user.id, "n": user.nome, "e": int(time.time()) + ttl_s},
+                         separators=(",", ":")).encode('utf-8')
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload))}"
+
+
+def verify_token(token, role=None):
+    """
+    Valida um token de sessão sem consultar o banco.
+
+    Parameters
+    ----------
+    token : str
+        O token gerado por ``issue_token``.
+    role : str, optional
+        Se informado, o token também precisa ser desse perfil.
+
+    Returns
+    -------
+    User or None
+        O usuário do token, ou ``None`` se ele for inválido, adulterado,
+        expirado ou de outro perfil.
+    """
+    try:
+        payload_b64, signature_b64 = token.split(".")
+        payload = _b64decode(payload_b64)
+        if not hmac.compare_digest(_b64decode(signature_b64), _sign(payload)):
+            return None
+        claims = json.loads(payload)
+    except (AttributeError, ValueError):
+        return None
+    if claims["e"] < time.time() or (role is not None and claims["r"] != role):
+        return None
+    return User(role=claims["r"], id=claims["i"], nome=claims["n"])
+
+
+def login(user):
+    """Guarda o token do usuário na sessão do Streamlit."""
+    st.session_state[f"{user.role}_token"] = issue_token(user)
+
+
+def logout(role):
+    """Remove o token do perfil da sessão do Streamlit."""
+    st.session_state.pop(f"{role}_token", None)
+
+
+def current_user(role):
+    """
+    Retorna o usuário logado no perfil, verificando apenas o token da sessão.
+
+    Parameters
+    ----------
+    role : str
+        Uma das chaves de ``ROLES``.
+
+    Returns
+    -------
+    User or None
+        O usuário logado, ou ``None`` se não houver token válido.
+    """
+    token = st.session_state.get(f"{role}_token")
+    return verify_token(token, role) if token else None
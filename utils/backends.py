@@ -0,0 +1,271 @@
+"""
+Backends de inferência em CPU para o classificador AlexNet.
+
+O backend é escolhido pela variável de ambiente ``CLASSIFIER_BACKEND``:
+
+- ``eager``: modelo PyTorch fp32 padrão;
+- ``torchscript``: grafo TorchScript congelado (``torch.jit.freeze``);
+- ``int8``: camadas ``Linear`` quantizadas dinamicamente para INT8;
+- ``onnx``: sessão do ONNX Runtime.
+
+Todos recebem um tensor ``(N, 3, 224, 224)`` e devolvem os logits ``(N, C)``
+na ordem de ``CLASSES``. Os artefatos exportados são gravados ao lado dos
+pesos e reaproveitados nas próximas cargas.
+
+Para conferir a acurácia de cada backend no conjunto de teste::
+
+    python -m utils.backends --backends eager torchscript int8 onnx
+"""
+import argparse
+import io
+import json
+import os
+import time
+
+import torch
+from torchvision import models
+
+BACKENDS = ("eager", "torchscript", "int8", "onnx")
+DEFAULT_BACKEND = os.getenv('CLASSIFIER_BACKEND', 'eager')
+NUM_THREADS = int(os.getenv('CLASSIFIER_NUM_THREADS', 0))
+TEST_DIR = 'dataset_classifier/test'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def build_eager(weights_path, num_classes):
+    """
+    Constrói a AlexNet fp32 e carrega os pesos treinados.
+
+    Parameters
+    ----------
+    weights_path : str
+        Caminho do ``state_dict`` salvo pelo notebook de treino.
+    num_classes : int
+        Número de classes da última camada.
+
+    Returns
+    -------
+    torch.nn.Module
+        O modelo em modo de avaliação.
+    """
+    # Sem pesos da ImageNet: todos os pesos vêm do arquivo local (funciona offline)
+    model = models.alexnet(weights=None)
+    model.classifier[6] = torch.nn.Linear(4096, num_classes)
+    model.load_state_dict(torch.load(weights_path,
+                                     weights_only=True,
+                                     map_location=torch.device('cpu')))
+    model.eval()
+    return model
+
+
+def artifact_path(weights_path, backend):
+    """Retorna o caminho do artefato exportado para um backend."""
+    base = os.path.splitext(weights_path)[0]
+    return {
+        "torchscript": f"{base}.torchscript.pt",
+        "onnx": f"{base}.onnx",
+    }[backend]
+
+
+def build_torchscript(weights_path, num_classes):
+    """Carrega (ou exporta) o grafo TorchScript congelado do modelo."""
+    path = artifact_path(weights_path, "torchscript")
+    if os.path.exists(path):
+        return torch.jit.load(path, map_location='cpu')
+
+    scripted = torch.jit.script(build_eager(weights_path, num_classes))
+    frozen = torch.jit.optimize_for_inference(torch.jit.freeze(scripted))
+    torch.jit.save(frozen, path)
+    return frozen
+
+
+def build_int8(weights_path, num_classes):
+    """Quantiza dinamicamente as camadas ``Linear`` do modelo para INT8."""
+    return torch.ao.quantization.quantize_dynamic(
+        build_eager(weights_path, num_classes), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxModel:
+    """
+    Adapta uma sessão do ONNX Runtime à interface ``model(batch) -> logits``.
+
+    Parameters
+    ----------
+    path : str
+        Caminho do modelo ``.onnx``.
+    """
+
+    def __init__(self, path):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if NUM_THREADS:
+            options.intra_op_num_threads = NUM_THREADS
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        outputs = self.session.run(None, {self.input_name: batch.numpy()})
+        return torch.from_numpy(outputs[0])
+
+
+def build_onnx(weights_path, num_classes):
+    """Carrega (ou exporta) o modelo ONNX e abre uma sessão do ONNX Runtime."""
+    path = artifact_path(weights_path, "onnx")
+    if not os.path.exists(path):
+        torch.onnx.export(build_eager(weights_path, num_classes),
+                          torch.zeros(1, 3, 224, 224),
+                          path,
+                          input_names=["input"],
+                          output_names=["logits"],
+                          dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+                          opset_version=17)
+    return OnnxModel(path)
+
+
+_BUILDERS = {
+    "eager": build_eager,
+    "torchscript": build_torchscript,
+    "int8": build_int8,
+    "onnx": build_onnx,
+}
+
+
+def load_backend(backend, weights_path, num_classes):
+    """
+    Constrói o modelo de inferência para o backend pedido.
+
+    Parameters
+    ----------
+    backend : str
+        Um dos valores de ``BACKENDS``.
+    weights_path : str
+        Caminho dos pesos treinados.
+    num_classes : int
+        Número de classes do modelo.
+
+    Returns
+    -------
+    callable
+        Objeto que recebe um tensor ``(N, 3, 224, 224)`` e devolve os logits.
+
+    Raises
+    ------
+    ValueError
+        Se o backend não for suportado.
+    """
+    if backend not in _BUILDERS:
+        raise ValueError(f"Backend desconhecido: {backend!r}. Use um de {BACKENDS}.")
+    if NUM_THREADS:
+        torch.set_num_threads(NUM_THREADS)
+    return _BUILDERS[backend](weights_path, num_classes)
+
+
+def load_test_set(root=TEST_DIR):
+    """
+    Lê as imagens de teste no formato do ``ImageFolder`` (uma pasta por classe).
+
+    Returns
+    -------
+    tuple of (list of np.ndarray, list of int)
+        Imagens BGR e rótulos, com as pastas em ordem alfabética.
+    """
+    import cv2
+
+    images, labels = [], []
+    for label, class_dir in enumerate(sorted(os.listdir(root))):
+        class_path = os.path.join(root, class_dir)
+        if not os.path.isdir(class_path):
+            continue
+        for name in sorted(os.listdir(class_path)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            image = cv2.imread(os.path.join(class_path, name), cv2.IMREAD_COLOR)
+            if image is not None:
+                images.append(image)
+                labels.append(label)
+    return images, labels
+
+
+def parity_check(backends, weights_path, root=TEST_DIR, batch_size=32):
+    """
+    Compara a acurácia e as saídas de cada backend com o modelo eager.
+
+    Parameters
+    ----------
+    backends : sequence of str
+        Backends a avaliar.
+    weights_path : str
+        Caminho dos pesos treinados.
+    root : str, optional
+        Pasta do conjunto de teste.
+    batch_size : int, optional
+        Tamanho do lote de inferência.
+
+    Returns
+    -------
+    dict
+        Métricas por backend: acurácia, concordância com o eager, maior
+        diferença absoluta de probabilidade, latência média por imagem e
+        tamanho do artefato em disco.
+    """
+    from utils.classifier import CLASSES
+    from utils.preprocess import preprocess_batch
+
+    images, labels = load_test_set(root)
+    batch = preprocess_batch(images)
+    labels = torch.tensor(labels)
+
+    def run(model):
+        outputs = []
+        start = time.perf_counter()
+        with torch.no_grad():
+            for i in range(0, len(batch), batch_size):
+                outputs.append(torch.softmax(model(batch[i:i + batch_size]), dim=1))
+        return torch.cat(outputs), (time.perf_counter() - start) / len(batch)
+
+    reference, _ = run(build_eager(weights_path, len(CLASSES)))
+    report = {}
+    for backend in backends:
+        model = load_backend(backend, weights_path, len(CLASSES))
+        probabilities, latency = run(model)
+        predicted = probabilities.argmax(dim=1)
+        if backend in ("torchscript", "onnx"):
+            size = os.path.getsize(artifact_path(weights_path, backend))
+        elif backend == "int8":
+            buffer = io.BytesIO()
+            torch.save(model.state_dict(), buffer)
+            size = buffer.tell()
+        else:
+            size = os.path.getsize(weights_path)
+        report[backend] = {
+            "accuracy": (predicted == labels).float().mean().item(),
+            "agreement_with_eager": (predicted == reference.argmax(dim=1)).float().mean().item(),
+            "max_abs_prob_diff": (probabilities - reference).abs().max().item(),
+            "latency_ms_per_image": latency * 1000,
+            "size_bytes": size,
+        }
+    return report
+
+
+def main():
+    from utils.classifier import MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="Checagem de paridade dos backends de inferência.")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--weights", default=MODEL_PATH)
+    parser.add_argument("--test-dir", default=TEST_DIR)
+    parser.add_argument("--min-agreement", type=float, default=0.95,
+                        help="Falha se algum backend concordar menos que isso com o eager.")
+    args = parser.parse_args()
+
+    report = parity_check(args.backends, args.weights, args.test_dir)
+    print(json.dumps(report, indent=2))
+    failed = [b for b, r in report.items() if r["agreement_with_eager"] < args.min_agreement]
+    if failed:
+        raise SystemExit(f"Backends abaixo da paridade mínima: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Armazenamento endereçado por conteúdo das imagens de lesão.
+
+Os bytes ficam fora do banco, num diretório local, em
+``<raiz>/<hh>/<hh>/<sha256>``; o banco guarda apenas o hash SHA-256. Uploads
+idênticos são gravados uma única vez, e consultas como o ``SELECT *`` do
+login não trafegam mais imagens.
+
+Para mover as imagens BYTEA já existentes na tabela PACIENTE para o
+armazenamento, em blocos::
+
+    python -m utils.blobstore --migrate [--drop-columns]
+"""
+import argparse
+import functools
+import hashlib
+import os
+import tempfile
+
+BLOB_STORE_DIR = os.getenv('BLOB_STORE_DIR', 'data/blobs')
+# Linhas lidas por vez do cursor no servidor durante a migração
+STREAM_PARTITION_ROWS = 10
+
+
+class BlobNotFound(KeyError):
+    """Não existe blob com o hash pedido."""
+
+
+class BlobStore:
+    """
+    Armazenamento de blobs imutáveis indexados pelo SHA-256 do conteúdo.
+
+    Parameters
+    ----------
+    root : str, optional
+        Diretório raiz do armazenamento.
+    """
+
+    def __init__(self, root=BLOB_STORE_DIR):
+        self.root = root
+
+    def path(self, digest):
+        """Caminho do blob, em dois níveis de subdiretórios para não lotar uma pasta só."""
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, data):
+        """
+        Grava um blob, se ainda não existir, e retorna seu hash.
+
+        A escrita é atômica (arquivo temporário + ``os.replace``), então
+        leitores nunca veem blobs parciais e gravações concorrentes do mesmo
+        conteúdo são inofensivas.
+
+        Parameters
+        ----------
+        data : bytes-like
+            Conteúdo do blob.
+
+        Returns
+        -------
+        str
+            SHA-256 hexadecimal do conteúdo.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return digest
+
+    def get(self, digest):
+        """
+        Lê um blob.
+
+        Raises
+        ------
+        BlobNotFound
+            Se o hash não estiver no armazenamento.
+        """
+        try:
+            with open(self.path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise BlobNotFound(digest) from None
+
+    def exists(self, digest):
+        """Indica se o blob existe."""
+        return os.path.exists(self.path(digest))
+
+
+@functools.lru_cache(maxsize=None)
+def get_store(root=BLOB_STORE_DIR):
+    """Retorna o armazenamento de blobs compartilhado do processo."""
+    return BlobStore(root)
+
+
+def migrate(engine, store, chunk_size=100, drop_columns=False):
+    """
+    Move as imagens BYTEA da tabela PACIENTE para o armazenamento de blobs.
+
+    As linhas são lidas em blocos por paginação de chave (``PACIENTE_ID``),
+    com cursor no servidor, e cada bloco é confirmado em sua própria
+    transação, então a migração pode ser interrompida e retomada. Cadastros
+    anteriores à miniatura ganham miniatura e entrada do modelo.
+
+    Uma imagem corrompida não interrompe a migração: a linha recebe só o
+    ``IMAGEM_HASH`` (o arquivo original é preservado), e os ids dessas
+    linhas são listados ao final. Elas bloqueiam ``drop_columns`` até serem
+    corrigidas, pois ficam sem miniatura e entrada do modelo.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        Engine do banco.
+    store : BlobStore
+        Armazenamento de destino.
+    chunk_size : int, optional
+        Linhas por bloco.
+    drop_columns : bool, optional
+        Remove as colunas BYTEA ao final, se não restar linha pendente.
+
+    Returns
+    -------
+    int
+        Número de linhas migradas.
+    """
+    from sqlalchemy import text
+
+    from utils.ingest import InvalidImage, ingest_image
+
+    select = text("""
+        SELECT PACIENTE_ID, IMAGEM_LESAO, IMAGEM_MINIATURA, ENTRADA_MODELO
+        FROM PACIENTE
+        WHERE IMAGEM_HASH IS NULL AND PACIENTE_ID > :last_id
+        ORDER BY PACIENTE_ID
+        LIMIT :limit
+    """)
+    update = text("""
+        UPDATE PACIENTE
+        SET IMAGEM_HASH = :imagem_hash,
+            MINIATURA_HASH = :miniatura_hash,
+            ENTRADA_MODELO_HASH = :entrada_modelo_hash
+        WHERE PACIENTE_ID = :paciente_id
+    """)
+
+    total, last_id, skipped = 0, 0, []
+    while True:
+        with engine.begin() as conn:
+            # Cursor no servidor lido em partições: só algumas imagens por vez
+            # ficam na memória, e do bloco guardam-se apenas os hashes
+            result = conn.execution_options(stream_results=True).execute(
+                select, {"last_id": last_id, "limit": chunk_size}).mappings()
+            params = []
+            for partition in result.partitions(STREAM_PARTITION_ROWS):
+                for row in partition:
+                    miniatura, entrada = row["imagem_miniatura"], row["entrada_modelo"]
+                    if miniatura is None or entrada is None:
+                        try:
+                            ingested = ingest_image(bytes(row["imagem_lesao"]))
+                            miniatura, entrada = ingested.thumbnail, ingested.model_input_bytes
+                        except InvalidImage as e:
+                            print(f"Paciente {row['paciente_id']}: imagem inválida ({e}); "
+                                  "migrada sem miniatura e entrada do modelo")
+                            skipped.append(row["paciente_id"])
+                    params.append({
+                        "paciente_id": row["paciente_id"],
+                        "imagem_hash": store.put(row["imagem_lesao"]),
+                        "miniatura_hash": store.put(miniatura) if miniatura is not None else None,
+                        "entrada_modelo_hash": store.put(entrada) if entrada is not None else None,
+                    })
+            if not params:
+                break
+            conn.execute(update, params)
+        total += len(params)
+        last_id = params[-1]["paciente_id"]
+        print(f"{total} pacientes migrados")
+
+    if skipped:
+        print(f"{len(skipped)} paciente(s) com imagem inválida, sem miniatura e entrada do modelo: {skipped}")
+
+    if drop_columns:
+        with engine.begin() as conn:
+            pending = conn.execute(text("""
+                SELECT PACIENTE_ID FROM PACIENTE
+                WHERE IMAGEM_HASH IS NULL OR MINIATURA_HASH IS NULL OR ENTRADA_MODELO_HASH IS NULL
+                ORDER BY PACIENTE_ID
+            """)).scalars().all()
+            if pending:
+                raise RuntimeError(f"{len(pending)} pacientes ainda sem hashes ({pending[:20]}); "
+                                   "colunas mantidas.")
+            # Mesmas restrições do esquema novo (sql/create_db_paciente.sql)
+            conn.execute(text("""
+                ALTER TABLE PACIENTE
+                    ALTER COLUMN IMAGEM_HASH SET NOT NULL,
+                    ALTER COLUMN MINIATURA_HASH SET NOT NULL,
+                    ALTER COLUMN ENTRADA_MODELO_HASH SET NOT NULL,
+                    DROP COLUMN IMAGEM_LESAO,
+                    DROP COLUMN IMAGEM_MINIATURA,
+                    DROP COLUMN ENTRADA_MODELO
+            """))
+    return total
+
+
+def main():
+    from utils.db import get_engine
+
+    parser = argparse.ArgumentParser(description="Armazenamento de blobs das imagens de lesão.")
+    parser.add_argument("--migrate", action="store_true",
+                        help="Move as imagens BYTEA de PACIENTE para o armazenamento.")
+    parser.add_argument("--chunk-size", type=int, default=100)
+    parser.add_argument("--drop-columns", action="store_true",
+                        help="Remove as colunas BYTEA depois da migração.")
+    parser.add_argument("--root", default=BLOB_STORE_DIR)
+    args = parser.parse_args()
+
+    if args.migrate:
+        migrate(get_engine(), get_store(args.root), args.chunk_size, args.drop_columns)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,58 @@
-import cv2
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
 import streamlit as st
 import torch
 import torch.nn.functional as F
-from torchvision import models, transforms
-from PIL import Image
+from utils.backends import DEFAULT_BACKEND, build_eager, load_backend
+from utils.inference_service import SERVICE_URL, InferenceClient, ServiceUnavailable
+from utils.preprocess import allocate_batch, preprocess_batch
+from utils.tracing import count, span
+
+logger = logging.getLogger(__name__)
+
+
+# Pesos do modelo; o nome do arquivo identifica a versão do modelo
+MODEL_PATH = os.getenv('CLASSIFIER_WEIGHTS', 'models/alexnet_acc_0.74_num_classes6_weights.pth')
+MODEL_VERSION = os.path.splitext(os.path.basename(MODEL_PATH))[0].removesuffix('_weights')
 
 
 @st.cache_resource(show_spinner=False)
-def load_model():
+def load_model(backend=DEFAULT_BACKEND):
     """
-    Load a pre-trained AlexNet model and weights from a file.
+    Load the trained AlexNet classifier with the selected inference backend.
+
+    Parameters
+    ----------
+    backend : str, optional
+        One of ``utils.backends.BACKENDS``; defaults to the
+        ``CLASSIFIER_BACKEND`` environment variable (``eager``).
 
     Returns:
-        A pre-trained AlexNet model with 5 output classes, loaded from a file.
+        A callable mapping a ``(N, 3, 224, 224)`` batch to logits over ``CLASSES``.
     """
-    model = models.alexnet(weights='AlexNet_Weights.IMAGENET1K_V1')
-    model.classifier[6] = torch.nn.Linear(4096, 6)
-    model.load_state_dict(torch.load('models/alexnet_acc_0.74_num_classes6_weights.pth',
-                                     weights_only=True,
-                                     map_location=torch.device('cpu')))
-    model.eval()
+    return load_backend(backend, MODEL_PATH, num_classes=6)
 
-    return model
 
+@st.cache_resource(show_spinner=False)
+def load_eager_model():
+    """
+    Load the eager fp32 AlexNet, needed to reach intermediate layers.
 
-model = load_model()
+    Reuses the model returned by ``load_model`` when the selected backend is
+    ``eager``; the TorchScript, INT8 and ONNX backends don't expose the
+    intermediate layers, so in that case the fp32 weights are loaded once.
 
-# Define image transformations
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
+    Returns
+    -------
+    torchvision.models.AlexNet
+        The model in evaluation mode.
+    """
+    if DEFAULT_BACKEND == "eager":
+        return load_model()
+    return build_eager(MODEL_PATH, num_classes=6)
 
 
 # Classes do modelo
@@ -53,48 +74,212 @@ MENSAGENS = [
     "A lesão aparenta ser causada por doença venosa."
 ]
 
+# Limiar de confiança para exibir a classificação ao usuário
+CONFIANCA_MINIMA = 0.7
+
+# Tamanho máximo do lote de inferência e número de workers do pré-processamento
+BATCH_SIZE = int(os.getenv('CLASSIFIER_BATCH_SIZE', 32))
+PREPROCESS_WORKERS = int(os.getenv('CLASSIFIER_PREPROCESS_WORKERS', os.cpu_count() or 1))
 
-def classify_image(image):
 
-    # Pré-processamento da imagem
+@dataclass(frozen=True)
+class Prediction:
     """
-    Classifies an input image into one of the predefined classes.
+    Resultado da classificação de uma imagem.
+
+    Attributes
+    ----------
+    index : int
+        Índice da classe mais provável em ``CLASSES``.
+    label : str
+        Nome da classe mais provável.
+    probability : float
+        Probabilidade da classe mais provável.
+    probabilities : tuple of float
+        Vetor completo de probabilidades, na ordem de ``CLASSES``.
+    """
+    index: int
+    label: str
+    probability: float
+    probabilities: tuple
+
+    @classmethod
+    def from_probabilities(cls, probabilities):
+        """
+        Builds a prediction from a full probability vector.
+
+        Parameters
+        ----------
+        probabilities : sequence of float
+            Probabilities in ``CLASSES`` order.
+
+        Returns
+        -------
+        Prediction
+        """
+        probabilities = tuple(float(p) for p in probabilities)
+        index = max(range(len(probabilities)), key=probabilities.__getitem__)
+        return cls(index=index, label=CLASSES[index], probability=probabilities[index],
+                   probabilities=probabilities)
 
-    This function processes the input image to predict its class using
-    a pre-trained AlexNet model. It transforms the image, makes predictions,
-    and returns the most probable class along with its probability. If the
-    probability is high enough, a message related to the predicted class is
-    displayed.
+
+@st.cache_resource(show_spinner=False)
+def _get_preprocess_pool():
+    """Retorna o pool de threads compartilhado pelo pré-processamento."""
+    return ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS,
+                              thread_name_prefix="classifier-preprocess")
+
+
+def predict_tensors(batch):
+    """
+    Runs a single forward pass over a stacked batch of preprocessed images.
 
     Parameters
     ----------
-    image : np.ndarray
-        The input image as a NumPy array in BGR format.
+    batch : torch.Tensor
+        A ``(N, 3, 224, 224)`` tensor.
 
     Returns
     -------
-    tuple
-        A tuple containing the predicted class (str) and the maximum probability (float).
+    list of Prediction
+        One prediction per row of ``batch``.
     """
-    image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    img = transform(image).unsqueeze(0)
+    with span("forward"), torch.no_grad():
+        probabilities = F.softmax(load_model()(batch), dim=1)
 
-    # Predição
-    with torch.no_grad():
-        outputs = model(img)
-        probabilities = F.softmax(outputs, dim=1)
+    max_probabilities, predicted_classes = torch.max(probabilities, dim=1)
+    return [
+        Prediction(index=index, label=CLASSES[index], probability=probability,
+                   probabilities=tuple(row))
+        for index, probability, row in zip(predicted_classes.tolist(),
+                                           max_probabilities.tolist(),
+                                           probabilities.tolist())
+    ]
 
-    # Obter a classe com maior probabilidade
-    max_probability, predicted_class = torch.max(probabilities, dim=1)
-    max_probability = max_probability.item()
-    predicted_class = predicted_class.item()
 
-    # Exibir resultado
-    if max_probability >= 0.7:
-        st.write(f"{MENSAGENS[predicted_class]} Probabilidade: {max_probability * 100:.0f}%")
-        if predicted_class != 5:
+@st.cache_resource(show_spinner=False)
+def _get_service_client():
+    """Retorna o cliente do serviço de inferência, se ``INFERENCE_SERVICE_URL`` estiver definida."""
+    return InferenceClient(SERVICE_URL) if SERVICE_URL else None
+
+
+@st.cache_resource(show_spinner=False)
+def _get_request_pool():
+    """Pool de threads que envia as imagens de um lote ao serviço em paralelo."""
+    return ThreadPoolExecutor(max_workers=BATCH_SIZE, thread_name_prefix="classifier-request")
+
+
+def _classify_remote(client, image):
+    probabilities, model_version = client.predict(image)
+    if model_version != MODEL_VERSION:
+        raise ServiceUnavailable(f"serviço com modelo {model_version}, esperado {MODEL_VERSION}")
+    return Prediction.from_probabilities(probabilities)
+
+
+def classify_batch(images, batch_size=BATCH_SIZE):
+    """
+    Classifies several images, preferably through the shared inference service.
+
+    When ``INFERENCE_SERVICE_URL`` is set, the images are sent concurrently to
+    the service, which micro-batches them with the requests of every other
+    session. If the service is unreachable, saturated or serving another
+    model version, the images are classified in process instead.
+
+    Parameters
+    ----------
+    images : sequence of np.ndarray
+        The input images as NumPy arrays in BGR format.
+    batch_size : int, optional
+        Maximum number of images per in-process forward pass.
+
+    Returns
+    -------
+    list of Prediction
+        One prediction per input image, in the same order.
+    """
+    images = list(images)
+    count("images_classified", len(images))
+    client = _get_service_client()
+    if client is not None and images:
+        try:
+            with span("remote_inference"):
+                return list(_get_request_pool().map(lambda image: _classify_remote(client, image), images))
+        except ServiceUnavailable as e:
+            count("remote_inference_fallbacks")
+            logger.warning("Serviço de inferência indisponível (%s); usando o modelo local.", e)
+    return classify_batch_local(images, batch_size)
+
+
+def classify_batch_local(images, batch_size=BATCH_SIZE):
+    """
+    Classifies several images with one stacked forward pass per batch.
+
+    The images are resized and normalized in parallel by a shared thread pool
+    (OpenCV and NumPy release the GIL) into one preallocated float32 buffer,
+    which is scored ``batch_size`` rows at a time. This function has no
+    Streamlit side effects, so it can be used outside the UI.
+
+    Parameters
+    ----------
+    images : sequence of np.ndarray
+        The input images as NumPy arrays in BGR format.
+    batch_size : int, optional
+        Maximum number of images per forward pass.
+
+    Returns
+    -------
+    list of Prediction
+        One prediction per input image, in the same order.
+    """
+    images = list(images)
+    if not images:
+        return []
+
+    buffer = allocate_batch(min(batch_size, len(images)))
+    predictions = []
+    for start in range(0, len(images), batch_size):
+        with span("preprocess"):
+            batch = preprocess_batch(images[start:start + batch_size], pool=_get_preprocess_pool(), out=buffer)
+        predictions.extend(predict_tensors(batch))
+    return predictions
+
+
+def show_prediction(prediction):
+    """
+    Exibe na página a mensagem correspondente a uma predição.
+
+    Parameters
+    ----------
+    prediction : Prediction
+        Predição retornada por ``classify_batch``.
+    """
+    if prediction.probability >= CONFIANCA_MINIMA:
+        st.write(f"{MENSAGENS[prediction.index]} Probabilidade: {prediction.probability * 100:.0f}%")
+        if prediction.index != 5:
             st.write("Consulte hospitais especializados mais próximos para uma avaliação médica!")
     else:
         st.write("Confiança insuficiente para uma classificação precisa. Tente uma imagem mais clara.")
 
-    return CLASSES[predicted_class], max_probability
+
+def classify_image(image):
+    """
+    Classifies an input image into one of the predefined classes.
+
+    Thin UI wrapper around ``classify_batch``: it classifies a single image
+    and displays the message related to the predicted class when the
+    probability is high enough.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        The input image as a NumPy array in BGR format.
+
+    Returns
+    -------
+    tuple
+        A tuple containing the predicted class (str) and the maximum probability (float).
+    """
+    prediction = classify_batch([image])[0]
+    show_prediction(prediction)
+
+    return prediction.label, prediction.probability
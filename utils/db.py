@@ -0,0 +1,184 @@
+"""
+Engine e pool de conexões únicos do banco, compartilhados pelas três áreas.
+
+As configurações vêm de variáveis de ambiente:
+
+- ``DB_HOST``, ``DB_PORT``, ``DB_DATABASE``, ``DB_USER``, ``PG_PASSWORD``;
+- ``DB_POOL_SIZE`` e ``DB_MAX_OVERFLOW``: conexões fixas e extras do pool;
+- ``DB_POOL_TIMEOUT``: espera máxima por uma conexão livre, em segundos;
+- ``DB_POOL_RECYCLE``: idade máxima de uma conexão, em segundos;
+- ``DB_STATEMENT_TIMEOUT_MS`` e ``DB_LOCK_TIMEOUT_MS``: limites no Postgres;
+- ``DB_CONNECT_TIMEOUT_S``: espera máxima para abrir uma conexão nova.
+
+``pool_metrics()`` expõe as retiradas de conexão e o tempo de espera, para
+identificar falta de conexões com muitas sessões simultâneas. Com
+``TRACING=1`` (``utils.tracing``), cada consulta entra no histograma
+``postgres`` e o estado do pool vai para ``/metrics``.
+"""
+import os
+import threading
+import time
+
+import streamlit as st
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from utils import tracing
+
+load_dotenv()
+
+# Obtendo os valores das variáveis de ambiente
+host = os.getenv('DB_HOST', 'localhost')
+port = os.getenv('DB_PORT', 5432)
+database = os.getenv('DB_DATABASE', 'LeisHticIA_gold')
+user = os.getenv('DB_USER', 'postgres')
+password = os.environ.get("PG_PASSWORD")
+
+# Configurando a conexão com o banco de dados usando SQLAlchemy
+DATABASE_URL = f"postgresql://{user}:{password}@{host}:{port}/{database}"
+
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 15000))
+LOCK_TIMEOUT_MS = int(os.getenv('DB_LOCK_TIMEOUT_MS', 5000))
+CONNECT_TIMEOUT_S = int(os.getenv('DB_CONNECT_TIMEOUT_S', 5))
+
+
+class PoolStats:
+    """Contadores de retirada de conexões do pool (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+
+    def record(self, wait_s, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_total_s += wait_s
+            self.wait_max_s = max(self.wait_max_s, wait_s)
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """``QueuePool`` que mede quanto tempo cada retirada de conexão esperou."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_stats.record(time.perf_counter() - start)
+        return connection
+
+
+@st.cache_resource
+def get_engine():
+    """
+    Retorna o engine do SQLAlchemy para conexão com o banco de dados.
+
+    Um único engine (e pool) por processo, criado no primeiro uso.
+
+    Returns
+    -------
+    engine : sqlalchemy.engine.Engine
+        O engine do SQLAlchemy para conexão com o banco de dados.
+    """
+    engine = create_engine(
+        DATABASE_URL,
+        poolclass=InstrumentedQueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE,
+        pool_pre_ping=True,
+        connect_args={
+            "options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS} -c lock_timeout={LOCK_TIMEOUT_MS}",
+            "application_name": "leishticia",
+            "connect_timeout": CONNECT_TIMEOUT_S,
+        },
+    )
+    if tracing.TRACING:
+        _trace_queries(engine)
+        tracing.add_collector("db_pool", pool_metrics)
+    return engine
+
+
+def _trace_queries(engine):
+    """Mede a duração de cada consulta no histograma ``postgres``."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_inicio_consulta", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _end(conn, cursor, statement, parameters, context, executemany):
+        tracing.registry.observe("postgres", time.perf_counter() - conn.info["_inicio_consulta"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("_inicio_consulta") if context.connection is not None else None
+        if starts:
+            tracing.registry.observe("postgres", time.perf_counter() - starts.pop())
+        tracing.count("postgres_errors")
+
+
+# SessionMaker sem engine: a conexão só é criada no primeiro uso
+Session = sessionmaker()
+
+
+def get_session():
+    """Abre uma sessão no engine compartilhado."""
+    return Session(bind=get_engine())
+
+
+def database_available():
+    """
+    Indica se o banco responde, sem levantar exceção.
+
+    Usado pela área do ACS para decidir entre gravar direto no banco ou na
+    fila local (``utils.fila_offline``).
+    """
+    try:
+        with get_engine().connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return True
+    except (OperationalError, PoolTimeoutError):
+        return False
+
+
+def pool_metrics():
+    """
+    Retorna o estado do pool e as estatísticas de espera por conexão.
+
+    Returns
+    -------
+    dict
+        Tamanho configurado, conexões em uso e em overflow, retiradas,
+        timeouts e tempos médio e máximo de espera.
+    """
+    pool = get_engine().pool
+    checkouts = pool_stats.checkouts
+    return {
+        "pool_size": pool.size(),
+        "max_overflow": MAX_OVERFLOW,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "checkouts": checkouts,
+        "timeouts": pool_stats.timeouts,
+        "wait_mean_ms": pool_stats.wait_total_s / checkouts * 1000 if checkouts else 0.0,
+        "wait_max_ms": pool_stats.wait_max_s * 1000,
+    }
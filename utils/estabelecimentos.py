@@ -0,0 +1,381 @@
+"""
+Índice local de estabelecimentos de saúde, para buscar hospitais sem a API do Google.
+
+O cadastro público de estabelecimentos (CSV ``tbEstabelecimento`` do CNES,
+separado por ``;``, em latin-1) é importado para uma tabela SQLite local::
+
+    python -m utils.estabelecimentos --import tbEstabelecimento.csv
+
+Só entram estabelecimentos com coordenadas válidas e dos tipos em
+``TIPOS_UNIDADE`` (hospitais, pronto-socorros, UPAs e centros de
+especialidades). As especialidades (feridas, oncologia, diabetes,
+dermatologia) são deduzidas do nome e do tipo por palavras-chave e
+guardadas como máscara de bits.
+
+Na consulta, as coordenadas são carregadas num ``BallTree`` com métrica
+haversine (radianos), e as buscas por raio e pelos k mais próximos, com
+filtro de especialidade, são vetorizadas com NumPy. O resultado tem a mesma
+forma de ``utils.paciente.find_nearby_hospitals``.
+"""
+import argparse
+import contextlib
+import csv
+import logging
+import os
+import sqlite3
+import time
+import unicodedata
+
+import numpy as np
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+ESTABELECIMENTOS_PATH = os.getenv('ESTABELECIMENTOS_PATH', 'data/estabelecimentos.sqlite3')
+EARTH_RADIUS_M = 6_371_000.0
+
+# Tipos de unidade do CNES (TP_UNIDADE) com atendimento a lesões
+TIPOS_UNIDADE = {
+    "05": "Hospital geral",
+    "07": "Hospital especializado",
+    "15": "Unidade mista",
+    "20": "Pronto-socorro geral",
+    "21": "Pronto-socorro especializado",
+    "36": "Clínica/centro de especialidade",
+    "62": "Hospital/dia",
+    "73": "Pronto atendimento",
+}
+
+# Especialidade -> palavras-chave procuradas no nome e no tipo (sem acento)
+ESPECIALIDADES = {
+    "feridas": ("ferida", "curativo", "estomaterap", "lesao", "vascular", "angiolog"),
+    "oncologia": ("oncolog", "cancer", "cacon", "unacon", "radioterap", "quimioterap"),
+    "diabetes": ("diabet", "endocrin", "pe diabetico"),
+    "dermatologia": ("dermato", "hanseni", "leishman", "pele"),
+}
+_BITS = {nome: 1 << i for i, nome in enumerate(ESPECIALIDADES)}
+
+# Nomes aceitos para cada coluna, do dump do CNES a CSVs simplificados
+_COLUNAS = {
+    "cnes": ("CO_CNES", "CNES"),
+    "nome": ("NO_FANTASIA", "NO_RAZAO_SOCIAL", "NOME"),
+    "logradouro": ("NO_LOGRADOURO", "LOGRADOURO", "ENDERECO"),
+    "numero": ("NU_ENDERECO", "NUMERO"),
+    "bairro": ("NO_BAIRRO", "BAIRRO"),
+    "cep": ("CO_CEP", "CEP"),
+    "lat": ("NU_LATITUDE", "LATITUDE", "LAT"),
+    "lng": ("NU_LONGITUDE", "LONGITUDE", "LNG"),
+    "tipo": ("TP_UNIDADE", "TIPO"),
+    "sempre_aberto": ("TP_ESTAB_SEMPRE_ABERTO", "SEMPRE_ABERTO"),
+}
+
+# Limites aproximados do território brasileiro, para descartar coordenadas trocadas
+_LAT_RANGE = (-34.0, 6.0)
+_LNG_RANGE = (-74.5, -28.0)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ESTABELECIMENTO (
+    CNES TEXT PRIMARY KEY,
+    NOME TEXT NOT NULL,
+    ENDERECO TEXT NOT NULL,
+    CEP TEXT,
+    LAT REAL NOT NULL,
+    LNG REAL NOT NULL,
+    TIPO TEXT NOT NULL,
+    ESPECIALIDADES INTEGER NOT NULL,
+    SEMPRE_ABERTO INTEGER NOT NULL
+);
+"""
+
+
+@contextlib.contextmanager
+def _connect(path):
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def _fold(text):
+    return unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii").lower()
+
+
+def specialty_mask(*texts):
+    """Máscara de bits das especialidades cujas palavras-chave aparecem nos textos."""
+    folded = " ".join(_fold(text) for text in texts)
+    mask = 0
+    for nome, keywords in ESPECIALIDADES.items():
+        if any(keyword in folded for keyword in keywords):
+            mask |= _BITS[nome]
+    return mask
+
+
+def _float(value):
+    try:
+        return float((value or "").strip().replace(",", "."))
+    except ValueError:
+        return None
+
+
+def _resolve_columns(fieldnames):
+    upper = {name.strip().upper(): name for name in fieldnames}
+    resolved = {}
+    for key, aliases in _COLUNAS.items():
+        resolved[key] = next((upper[alias] for alias in aliases if alias in upper), None)
+    missing = [key for key in ("cnes", "nome", "lat", "lng") if resolved[key] is None]
+    if missing:
+        raise ValueError(f"Colunas ausentes no CSV: {', '.join(missing)}")
+    return resolved
+
+
+def parse_registry(path, encoding="latin-1", tipos=TIPOS_UNIDADE):
+    """
+    Lê o CSV de estabelecimentos e gera as linhas válidas.
+
+    Parameters
+    ----------
+    path : str
+        Caminho do CSV.
+    encoding : str, optional
+        Codificação do arquivo (o CNES usa latin-1).
+    tipos : collection of str, optional
+        Tipos de unidade aceitos; ``None`` aceita todos.
+
+    Yields
+    ------
+    tuple
+        ``(cnes, nome, endereco, cep, lat, lng, tipo, especialidades, sempre_aberto)``.
+    """
+    with open(path, newline="", encoding=encoding) as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=";,")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(f, dialect=dialect)
+        col = _resolve_columns(reader.fieldnames or [])
+
+        def get(row, key):
+            return (row.get(col[key]) or "").strip() if col[key] else ""
+
+        for row in reader:
+            tipo = get(row, "tipo").zfill(2) if get(row, "tipo") else ""
+            if tipos is not None and col["tipo"] and tipo not in tipos:
+                continue
+            lat, lng = _float(get(row, "lat")), _float(get(row, "lng"))
+            if lat is None or lng is None:
+                continue
+            if not (_LAT_RANGE[0] <= lat <= _LAT_RANGE[1] and _LNG_RANGE[0] <= lng <= _LNG_RANGE[1]):
+                continue
+            nome = get(row, "nome").title()
+            endereco = ", ".join(part.title() for part in
+                                 (get(row, "logradouro"), get(row, "numero"), get(row, "bairro")) if part)
+            tipo_nome = TIPOS_UNIDADE.get(tipo, tipo)
+            yield (get(row, "cnes"), nome, endereco or "Endereço não disponível", get(row, "cep"), lat, lng,
+                   tipo_nome, specialty_mask(nome, tipo_nome), int(get(row, "sempre_aberto").upper() == "S"))
+
+
+def import_registry(csv_path, db_path=ESTABELECIMENTOS_PATH, encoding="latin-1", chunk_size=10_000):
+    """
+    Importa o CSV de estabelecimentos, substituindo o conteúdo anterior.
+
+    A troca é feita numa única transação: consultas concorrentes veem a
+    tabela antiga até o commit.
+
+    Returns
+    -------
+    int
+        Número de estabelecimentos importados.
+    """
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    total = 0
+    with _connect(db_path) as connection:
+        connection.executescript(_SCHEMA)
+        connection.execute("DELETE FROM ESTABELECIMENTO")
+        chunk = []
+        for row in parse_registry(csv_path, encoding):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                connection.executemany("INSERT OR REPLACE INTO ESTABELECIMENTO VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                       chunk)
+                total += len(chunk)
+                chunk = []
+        connection.executemany("INSERT OR REPLACE INTO ESTABELECIMENTO VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", chunk)
+        total += len(chunk)
+    return total
+
+
+class FacilityIndex:
+    """
+    Índice espacial dos estabelecimentos importados.
+
+    Parameters
+    ----------
+    db_path : str, optional
+        Tabela SQLite gerada por ``import_registry``.
+    """
+
+    def __init__(self, db_path=ESTABELECIMENTOS_PATH):
+        with _connect(db_path) as connection:
+            connection.executescript(_SCHEMA)
+            rows = connection.execute(
+                "SELECT NOME, ENDERECO, TIPO, LAT, LNG, ESPECIALIDADES, SEMPRE_ABERTO FROM ESTABELECIMENTO"
+            ).fetchall()
+        self.nomes = [row[0] for row in rows]
+        self.enderecos = [row[1] for row in rows]
+        self.tipos = [row[2] for row in rows]
+        coords = np.array([(row[3], row[4]) for row in rows], dtype=np.float64).reshape(-1, 2)
+        self.lats, self.lngs = coords[:, 0], coords[:, 1]
+        self.especialidades = np.array([row[5] for row in rows], dtype=np.int64)
+        self.sempre_aberto = np.array([row[6] for row in rows], dtype=bool)
+        self.tree = None
+        if len(rows):
+            # Importado aqui: a página do paciente importa este módulo mesmo
+            # quando a busca é pelo Google, e o sklearn é caro de carregar
+            from sklearn.neighbors import BallTree
+            self.tree = BallTree(np.radians(coords), metric="haversine")
+
+    def __len__(self):
+        return len(self.nomes)
+
+    def _mask(self, especialidades):
+        bits = 0
+        for nome in especialidades or ():
+            bits |= _BITS[nome]
+        return bits
+
+    def within(self, latitude, longitude, radius_m, especialidades=None, limit=20):
+        """
+        Estabelecimentos dentro de um raio, do mais próximo ao mais distante.
+
+        Parameters
+        ----------
+        latitude, longitude : float
+            Ponto de referência, em graus.
+        radius_m : float
+            Raio, em metros.
+        especialidades : collection of str, optional
+            Chaves de ``ESPECIALIDADES``; basta atender a uma delas.
+        limit : int, optional
+            Número máximo de resultados.
+
+        Returns
+        -------
+        tuple of (np.ndarray, np.ndarray)
+            Índices dos estabelecimentos e distâncias em metros.
+        """
+        if self.tree is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        point = np.radians([[latitude, longitude]])
+        idx, dist = self.tree.query_radius(point, r=radius_m / EARTH_RADIUS_M,
+                                           return_distance=True, sort_results=True)
+        idx, dist = idx[0], dist[0] * EARTH_RADIUS_M
+        bits = self._mask(especialidades)
+        if bits:
+            keep = (self.especialidades[idx] & bits) != 0
+            idx, dist = idx[keep], dist[keep]
+        return idx[:limit], dist[:limit]
+
+    def nearest(self, latitude, longitude, k=10, especialidades=None):
+        """
+        Os ``k`` estabelecimentos mais próximos que atendem ao filtro.
+
+        Sem filtro é uma única consulta ao BallTree; com filtro, a consulta
+        é repetida com quatro vezes mais vizinhos até achar ``k`` que atendam.
+
+        Returns
+        -------
+        tuple of (np.ndarray, np.ndarray)
+            Índices dos estabelecimentos e distâncias em metros.
+        """
+        if self.tree is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        point = np.radians([[latitude, longitude]])
+        bits = self._mask(especialidades)
+        n = k
+        while True:
+            n = min(n, len(self))
+            dist, idx = self.tree.query(point, k=n)
+            idx, dist = idx[0], dist[0] * EARTH_RADIUS_M
+            if bits:
+                keep = (self.especialidades[idx] & bits) != 0
+                idx, dist = idx[keep], dist[keep]
+            if len(idx) >= k or n == len(self):
+                return idx[:k], dist[:k]
+            n *= 4
+
+    def as_hospitals(self, idx, dist):
+        """Converte resultados na tupla usada pelo mapa da área do paciente."""
+        hospitals = []
+        for i, d in zip(idx, dist):
+            horario = ["Aberto 24 horas"] if self.sempre_aberto[i] else ["Horário não disponível"]
+            hospitals.append((self.nomes[i], f"{self.enderecos[i]} ({self.tipos[i]}, {d / 1000:.1f} km)",
+                              "N/A", float(self.lats[i]), float(self.lngs[i]), horario))
+        return hospitals
+
+
+@st.cache_resource(show_spinner=False)
+def get_facility_index():
+    """Retorna o índice de estabelecimentos, carregado no primeiro uso."""
+    start = time.perf_counter()
+    index = FacilityIndex()
+    logger.info("Índice de %d estabelecimentos carregado em %.2f s.", len(index), time.perf_counter() - start)
+    return index
+
+
+def find_nearby_facilities(latitude, longitude, radius=5000, especialidades=("feridas", "oncologia", "diabetes"),
+                           limit=20):
+    """
+    Busca local de hospitais, no mesmo formato de ``find_nearby_hospitals``.
+
+    Prefere os estabelecimentos com as especialidades pedidas dentro do
+    raio; se não houver nenhum, completa com os mais próximos de qualquer
+    especialidade dentro do raio.
+
+    Returns
+    -------
+    list of tuple
+        ``(nome, endereço, avaliação, lat, lng, horários)``.
+    """
+    index = get_facility_index()
+    idx, dist = index.within(latitude, longitude, radius, especialidades, limit)
+    if len(idx) == 0:
+        idx, dist = index.within(latitude, longitude, radius, None, limit)
+    return index.as_hospitals(idx, dist)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa e consulta o índice local de estabelecimentos de saúde.")
+    parser.add_argument("--import", dest="csv_path", help="CSV de estabelecimentos (CNES) a importar")
+    parser.add_argument("--encoding", default="latin-1")
+    parser.add_argument("--db", default=ESTABELECIMENTOS_PATH)
+    parser.add_argument("--near", nargs=2, type=float, metavar=("LAT", "LNG"),
+                        help="Consulta os mais próximos de um ponto")
+    parser.add_argument("--radius", type=float, default=5000)
+    parser.add_argument("--especialidade", action="append", choices=list(ESPECIALIDADES))
+    args = parser.parse_args()
+
+    if args.csv_path:
+        start = time.perf_counter()
+        total = import_registry(args.csv_path, args.db, args.encoding)
+        print(f"{total} estabelecimentos importados em {time.perf_counter() - start:.1f} s")
+
+    if args.near:
+        start = time.perf_counter()
+        index = FacilityIndex(args.db)
+        print(f"{len(index)} estabelecimentos indexados em {time.perf_counter() - start:.2f} s")
+        start = time.perf_counter()
+        idx, dist = index.within(*args.near, args.radius, args.especialidade)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for hospital in index.as_hospitals(idx, dist):
+            print(f"{hospital[0]} — {hospital[1]}")
+        print(f"{len(idx)} resultados em {elapsed_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
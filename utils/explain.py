@@ -0,0 +1,143 @@
+"""
+Explicações Grad-CAM para a área do médico.
+
+Diferente da classe ``AlexNetGradCAM`` do notebook, este módulo reutiliza o
+modelo já carregado e captura ativações e gradientes do mesmo forward que
+gera a predição: o custo de uma explicação é um backward a mais, não uma
+nova carga de pesos seguida de outra inferência. O forward é feito camada a
+camada (sem hooks), então o modelo compartilhado pode ser usado por várias
+sessões ao mesmo tempo.
+
+O Grad-CAM precisa de gradientes e por isso usa o modelo eager em fp32,
+enquanto a predição exibida pode vir de outro backend (TorchScript, INT8,
+ONNX). Para que o mapa explique a classe mostrada ao médico, a área do
+médico passa essa classe em ``target_class``.
+"""
+import hashlib
+
+import cv2
+import numpy as np
+import streamlit as st
+import torch
+import torch.nn.functional as F
+
+from utils.classifier import MODEL_VERSION, Prediction, load_eager_model
+from utils.preprocess import preprocess_batch
+
+# Última camada de ativação convolucional (features[:12] no notebook)
+TARGET_LAYER = 12
+HEATMAP_ALPHA = 0.4
+
+
+def explain_tensors(model, batch, target_classes=None):
+    """
+    Calcula predições e mapas Grad-CAM de um lote em um forward e um backward.
+
+    Parameters
+    ----------
+    model : torchvision.models.AlexNet
+        Modelo eager em modo de avaliação.
+    batch : torch.Tensor
+        Lote pré-processado ``(N, 3, 224, 224)``.
+    target_classes : sequence of int, optional
+        Classe explicada por imagem; por padrão, a classe predita.
+
+    Returns
+    -------
+    tuple of (list of Prediction, np.ndarray)
+        As predições e os mapas ``(N, 13, 13)`` normalizados em [0, 1].
+    """
+    with torch.enable_grad():
+        activations = model.features[:TARGET_LAYER](batch)
+        if not activations.requires_grad:
+            activations.requires_grad_()
+        x = model.features[TARGET_LAYER:](activations)
+        x = torch.flatten(model.avgpool(x), 1)
+        logits = model.classifier(x)
+
+        probabilities = F.softmax(logits.detach(), dim=1)
+        if target_classes is None:
+            targets = probabilities.argmax(dim=1)
+        else:
+            targets = torch.as_tensor(target_classes)
+
+        # As imagens do lote são independentes: um único backward da soma
+        # dá o gradiente de cada amostra em relação à sua própria classe-alvo
+        selected = logits.gather(1, targets.view(-1, 1)).sum()
+        gradients, = torch.autograd.grad(selected, activations)
+
+    weights = gradients.mean(dim=(2, 3), keepdim=True)
+    heatmaps = F.relu((weights * activations.detach()).mean(dim=1))
+    maxima = heatmaps.flatten(1).max(dim=1).values.clamp_min(1e-8)
+    heatmaps = (heatmaps / maxima.view(-1, 1, 1)).numpy()
+
+    predictions = [Prediction.from_probabilities(row) for row in probabilities.tolist()]
+    return predictions, heatmaps
+
+
+def explain_batch(images, target_classes=None):
+    """
+    Classifica e explica imagens BGR em lote.
+
+    Parameters
+    ----------
+    images : sequence of np.ndarray
+        Imagens BGR uint8.
+    target_classes : sequence of int, optional
+        Classe explicada por imagem; por padrão, a classe predita.
+
+    Returns
+    -------
+    tuple of (list of Prediction, np.ndarray)
+        As predições e os mapas Grad-CAM ``(N, 13, 13)``.
+    """
+    return explain_tensors(load_eager_model(), preprocess_batch(list(images)), target_classes)
+
+
+def render_heatmap(image, heatmap, alpha=HEATMAP_ALPHA):
+    """
+    Sobrepõe um mapa Grad-CAM (colormap JET) à imagem BGR original.
+
+    Returns
+    -------
+    np.ndarray
+        Imagem BGR uint8 com o mapa sobreposto.
+    """
+    heatmap = cv2.resize(heatmap, (image.shape[1], image.shape[0]))
+    jet_heatmap = cv2.applyColorMap(np.uint8(255 * heatmap), cv2.COLORMAP_JET)
+    return cv2.addWeighted(jet_heatmap, alpha, image, 1.0, 0)
+
+
+def image_hash(image):
+    """Retorna o SHA-256 dos pixels de uma imagem."""
+    return hashlib.sha256(memoryview(np.ascontiguousarray(image))).hexdigest()
+
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def _explain_cached(digest, model_version, target_class, _image):
+    predictions, heatmaps = explain_batch([_image], None if target_class is None else [target_class])
+    return predictions[0], render_heatmap(_image, heatmaps[0])
+
+
+def explain_image(image, target_class=None):
+    """
+    Classifica e explica uma imagem, com o resultado renderizado em cache.
+
+    O cache é indexado pelo hash da imagem, pela versão do modelo e pela
+    classe explicada, de modo que consultas repetidas ao mesmo paciente não
+    refazem o Grad-CAM.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        Imagem BGR uint8.
+    target_class : int, optional
+        Índice da classe explicada, normalmente a da predição exibida; por
+        padrão, a classe predita pelo modelo eager.
+
+    Returns
+    -------
+    tuple of (Prediction, np.ndarray)
+        A predição e a imagem BGR com o mapa de calor sobreposto.
+    """
+    return _explain_cached(image_hash(image), MODEL_VERSION, target_class, image)
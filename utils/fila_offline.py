@@ -0,0 +1,474 @@
+"""
+Fila local de cadastros do ACS, para trabalho de campo sem conexão.
+
+Quando o banco central não responde, a área do ACS grava o cadastro numa
+fila SQLite no próprio aparelho. A imagem é normalizada e classificada
+localmente, a senha já vai com hash, e as imagens ficam num armazenamento
+de blobs local. Nada no cadastro depende da rede.
+
+Uma thread de sincronização envia a fila ao Postgres quando há conexão:
+
+- cada captura tem um ``CAPTURA_ID`` (UUID) gravado também em PACIENTE
+  (índice único), então reenviar uma captura nunca duplica o paciente;
+- os blobs são copiados um a um para o armazenamento central; como são
+  endereçados por conteúdo, os que já chegaram são pulados e um envio
+  interrompido continua de onde parou. O armazenamento central é o
+  ``BLOB_STORE_DIR`` do servidor, acessível no aparelho por um ponto de
+  montagem compartilhado (NFS, SMB...) indicado em
+  ``CENTRAL_BLOB_STORE_DIR``; sem ele a sincronização é recusada, pois o
+  servidor não conseguiria ler as imagens dos pacientes gravados;
+- antes de gravar, o lote é comparado com o banco: capturas já presentes
+  são marcadas como sincronizadas, e nomes já usados por outro paciente
+  viram conflitos, que o ACS resolve renomeando o cadastro;
+- as demais capturas do lote vão em INSERTs de várias linhas numa única
+  transação (``utils.importacao.insert_patients``).
+
+Configuração: ``OFFLINE_DIR`` (``.cache/offline``),
+``CENTRAL_BLOB_STORE_DIR`` (obrigatório para sincronizar),
+``SYNC_BATCH_SIZE`` (50) e ``SYNC_INTERVAL_S`` (60).
+"""
+import contextlib
+import errno
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import date, datetime, timezone
+
+import numpy as np
+import streamlit as st
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, IntegrityError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from utils.blobstore import BlobNotFound, BlobStore, get_store
+from utils.classifier import MODEL_VERSION, Prediction
+from utils.db import get_session
+from utils.importacao import insert_patients
+from utils.ingest import model_input_from_bytes
+from utils.similarity import classify_and_embed, index_embeddings
+
+logger = logging.getLogger(__name__)
+
+OFFLINE_DIR = os.getenv('OFFLINE_DIR', '.cache/offline')
+# Armazenamento de blobs do servidor, montado no aparelho
+CENTRAL_BLOB_STORE_DIR = os.getenv('CENTRAL_BLOB_STORE_DIR')
+SYNC_BATCH_SIZE = int(os.getenv('SYNC_BATCH_SIZE', 50))
+SYNC_INTERVAL_S = float(os.getenv('SYNC_INTERVAL_S', 60))
+
+PENDENTE, SINCRONIZADO, CONFLITO, ERRO = "pendente", "sincronizado", "conflito", "erro"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS CAPTURA (
+    CAPTURA_ID TEXT PRIMARY KEY,
+    ACS_ID INTEGER,
+    CRIADO_EM TEXT NOT NULL,
+    DADOS TEXT NOT NULL,
+    SENHA BLOB NOT NULL,
+    IMAGEM_HASH TEXT NOT NULL,
+    MINIATURA_HASH TEXT NOT NULL,
+    ENTRADA_MODELO_HASH TEXT NOT NULL,
+    VERSAO_MODELO TEXT NOT NULL,
+    PROBABILIDADES TEXT NOT NULL,
+    EMBEDDING BLOB NOT NULL,
+    STATUS TEXT NOT NULL DEFAULT 'pendente',
+    MENSAGEM TEXT,
+    PACIENTE_ID INTEGER,
+    TENTATIVAS INTEGER NOT NULL DEFAULT 0,
+    SINCRONIZADO_EM TEXT
+);
+CREATE INDEX IF NOT EXISTS CAPTURA_STATUS ON CAPTURA (STATUS, CRIADO_EM);
+"""
+
+# Erros de rede do sistema (inclusive do armazenamento central montado)
+_NETWORK_ERRNOS = {errno.ENETDOWN, errno.ENETUNREACH, errno.EHOSTDOWN, errno.EHOSTUNREACH,
+                   errno.ETIMEDOUT, errno.ENOTCONN, errno.ESTALE}
+
+
+class CaptureQueue:
+    """
+    Fila durável de cadastros em SQLite.
+
+    Cada operação abre sua própria conexão, então a fila pode ser usada a
+    partir das threads das sessões do Streamlit e da thread de sincronização.
+
+    Parameters
+    ----------
+    root : str, optional
+        Diretório da fila e do armazenamento de blobs local.
+    """
+
+    def __init__(self, root=OFFLINE_DIR):
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, "fila.sqlite3")
+        self.blobs = BlobStore(os.path.join(root, "blobs"))
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def enqueue(self, values, senha_hash, imagem, predicao, embedding, acs_id=None):
+        """
+        Grava um cadastro na fila.
+
+        Parameters
+        ----------
+        values : dict
+            Campos do formulário (``nome``, ``data_nascimento`` como ``date``,
+            ``endereco``, ``cep``, ``telefone``, ``tempo_lesao`` e os três
+            históricos como ``bool``).
+        senha_hash : bytes
+            Hash bcrypt da senha.
+        imagem : IngestedImage
+            Artefatos da imagem da lesão.
+        predicao : Prediction
+            Predição calculada localmente.
+        embedding : np.ndarray
+            Embedding da imagem.
+        acs_id : int, optional
+            ACS que fez a captura.
+
+        Returns
+        -------
+        str
+            O ``CAPTURA_ID`` gerado.
+        """
+        captura_id = str(uuid.uuid4())
+        dados = dict(values, data_nascimento=values["data_nascimento"].isoformat())
+        with self._connect() as connection:
+            connection.execute(
+                """INSERT INTO CAPTURA (CAPTURA_ID, ACS_ID, CRIADO_EM, DADOS, SENHA, IMAGEM_HASH,
+                   MINIATURA_HASH, ENTRADA_MODELO_HASH, VERSAO_MODELO, PROBABILIDADES, EMBEDDING)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (captura_id, acs_id, _now(), json.dumps(dados), bytes(senha_hash),
+                 self.blobs.put(imagem.canonical), self.blobs.put(imagem.thumbnail),
+                 self.blobs.put(imagem.model_input_bytes), MODEL_VERSION,
+                 json.dumps([float(p) for p in predicao.probabilities]),
+                 np.asarray(embedding, dtype=np.float32).tobytes()))
+        _get_sync_worker().wake()
+        return captura_id
+
+    def pending(self, limit=SYNC_BATCH_SIZE):
+        """Retorna as capturas pendentes mais antigas."""
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT * FROM CAPTURA WHERE STATUS = ? ORDER BY CRIADO_EM LIMIT ?",
+                (PENDENTE, limit)).fetchall()
+
+    def with_status(self, status):
+        """Retorna as capturas com o status dado."""
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT * FROM CAPTURA WHERE STATUS = ? ORDER BY CRIADO_EM", (status,)).fetchall()
+
+    def counts(self):
+        """Retorna o número de capturas por status."""
+        with self._connect() as connection:
+            return dict(connection.execute("SELECT STATUS, COUNT(*) FROM CAPTURA GROUP BY STATUS").fetchall())
+
+    def mark_synced(self, synced):
+        """Marca capturas como sincronizadas; ``synced`` mapeia ``CAPTURA_ID -> PACIENTE_ID``."""
+        with self._connect() as connection:
+            connection.executemany(
+                "UPDATE CAPTURA SET STATUS = ?, PACIENTE_ID = ?, MENSAGEM = NULL, SINCRONIZADO_EM = ? "
+                "WHERE CAPTURA_ID = ?",
+                [(SINCRONIZADO, paciente_id, _now(), captura_id) for captura_id, paciente_id in synced.items()])
+
+    def mark(self, captura_id, status, mensagem):
+        """Registra um conflito ou erro de uma captura."""
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE CAPTURA SET STATUS = ?, MENSAGEM = ?, TENTATIVAS = TENTATIVAS + 1 WHERE CAPTURA_ID = ?",
+                (status, mensagem, captura_id))
+
+    def resolve(self, captura_id, nome):
+        """Renomeia uma captura em conflito e a devolve à fila."""
+        with self._connect() as connection:
+            row = connection.execute("SELECT DADOS FROM CAPTURA WHERE CAPTURA_ID = ?", (captura_id,)).fetchone()
+            dados = dict(json.loads(row["DADOS"]), nome=nome)
+            connection.execute(
+                "UPDATE CAPTURA SET DADOS = ?, STATUS = ?, MENSAGEM = NULL WHERE CAPTURA_ID = ?",
+                (json.dumps(dados), PENDENTE, captura_id))
+        _get_sync_worker().wake()
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def _is_offline(exc):
+    """
+    Indica se o erro é falta de conexão, e não um problema da captura.
+
+    Só esses erros deixam a captura pendente para a próxima tentativa:
+    conexão com o banco invalidada ou recusada, pool esgotado e erros de
+    socket. Os demais (tempo de consulta esgotado, dados recusados, disco
+    cheio...) marcam a captura como erro, com a mensagem.
+    """
+    if isinstance(exc, PoolTimeoutError):
+        return True
+    if isinstance(exc, DBAPIError):
+        if exc.connection_invalidated:
+            return True
+        # Falhas ao conectar vêm do cliente, sem SQLSTATE; as de conexão
+        # reportadas pelo servidor são da classe 08
+        sqlstate = getattr(exc.orig, "pgcode", None)
+        if sqlstate is not None:
+            return sqlstate.startswith("08")
+        return isinstance(exc, (OperationalError, InterfaceError)) or isinstance(exc.orig, OSError)
+    if isinstance(exc, OSError):
+        return isinstance(exc, (ConnectionError, TimeoutError)) or exc.errno in _NETWORK_ERRNOS
+    return False
+
+
+def _central_store():
+    # O armazenamento local do aparelho (BLOB_STORE_DIR) não serve de destino:
+    # o servidor nunca veria as imagens e os pacientes ficariam sem foto
+    if not CENTRAL_BLOB_STORE_DIR:
+        raise RuntimeError("CENTRAL_BLOB_STORE_DIR não configurado; sincronização desativada.")
+    if not os.path.isdir(CENTRAL_BLOB_STORE_DIR):
+        raise RuntimeError(f"Armazenamento central {CENTRAL_BLOB_STORE_DIR} indisponível; "
+                           "verifique o ponto de montagem.")
+    return get_store(CENTRAL_BLOB_STORE_DIR)
+
+
+def _upload_blobs(queue, rows, store):
+    # Cópia retomável: blobs já presentes no armazenamento central são pulados
+    enviadas = []
+    for row in rows:
+        try:
+            for digest in (row["IMAGEM_HASH"], row["MINIATURA_HASH"], row["ENTRADA_MODELO_HASH"]):
+                if not store.exists(digest):
+                    store.put(queue.blobs.get(digest))
+        except BlobNotFound as e:
+            queue.mark(row["CAPTURA_ID"], ERRO, f"Imagem {e} ausente no aparelho.")
+            continue
+        except OSError as e:
+            if _is_offline(e):
+                raise
+            logger.exception("Falha ao enviar as imagens da captura %s.", row["CAPTURA_ID"])
+            queue.mark(row["CAPTURA_ID"], ERRO, f"Falha ao enviar as imagens: {e}")
+            continue
+        enviadas.append(row)
+    return enviadas
+
+
+def _prediction_and_embedding(queue, rows):
+    predicoes = [Prediction.from_probabilities(json.loads(row["PROBABILIDADES"])) for row in rows]
+    embeddings = [np.frombuffer(row["EMBEDDING"], dtype=np.float32) for row in rows]
+
+    # Capturas classificadas por outra versão do modelo são reclassificadas
+    # a partir da entrada do modelo guardada no aparelho
+    stale = [i for i, row in enumerate(rows) if row["VERSAO_MODELO"] != MODEL_VERSION]
+    if stale:
+        images = [model_input_from_bytes(queue.blobs.get(rows[i]["ENTRADA_MODELO_HASH"])) for i in stale]
+        novas, novos = classify_and_embed(images)
+        for i, predicao, embedding in zip(stale, novas, novos):
+            predicoes[i], embeddings[i] = predicao, embedding
+    return predicoes, embeddings
+
+
+def _paciente_row(row):
+    dados = json.loads(row["DADOS"])
+    return {
+        "nome": dados["nome"],
+        "senha": row["SENHA"],
+        "data_de_nascimento": date.fromisoformat(dados["data_nascimento"]),
+        "endereco": dados["endereco"],
+        "cep": dados["cep"],
+        "telefone": dados["telefone"],
+        "tempo_com_a_lesao": dados["tempo_lesao"],
+        "historico_diabetes": dados["historico_diabetes"],
+        "historico_cancer": dados["historico_cancer"],
+        "anti_inflamatorio_sem_efeito": dados["anti_inflamatorio"],
+        "imagem_hash": row["IMAGEM_HASH"],
+        "miniatura_hash": row["MINIATURA_HASH"],
+        "entrada_modelo_hash": row["ENTRADA_MODELO_HASH"],
+        "captura_id": row["CAPTURA_ID"],
+    }
+
+
+def _sync_batch(session, queue, rows):
+    """Sincroniza um lote; retorna quantas capturas foram gravadas."""
+    pacientes = [_paciente_row(row) for row in rows]
+
+    # Detecção de conflitos: capturas já gravadas e nomes já em uso
+    existentes = session.execute(text("""
+        SELECT CAPTURA_ID::text AS captura_id, NOME, PACIENTE_ID FROM PACIENTE
+        WHERE CAPTURA_ID = ANY(CAST(:ids AS UUID[])) OR NOME = ANY(:nomes)
+    """), {"ids": [p["captura_id"] for p in pacientes],
+           "nomes": [p["nome"] for p in pacientes]}).mappings().all()
+    session.rollback()
+    lote = {p["captura_id"] for p in pacientes}
+    por_captura = {e["captura_id"]: e["paciente_id"] for e in existentes if e["captura_id"] in lote}
+    nomes_em_uso = {e["nome"] for e in existentes if e["captura_id"] not in lote}
+
+    ja_gravadas = {p["captura_id"]: por_captura[p["captura_id"]] for p in pacientes if p["captura_id"] in por_captura}
+    queue.mark_synced(ja_gravadas)
+    novos = []
+    for row, paciente in zip(rows, pacientes):
+        if paciente["captura_id"] in ja_gravadas:
+            continue
+        if paciente["nome"] in nomes_em_uso:
+            queue.mark(paciente["captura_id"], CONFLITO, "Já existe um paciente com esse nome no banco central.")
+            continue
+        novos.append((row, paciente))
+    if not novos:
+        return 0
+
+    rows, pacientes = [row for row, _ in novos], [paciente for _, paciente in novos]
+    try:
+        predicoes, embeddings = _prediction_and_embedding(queue, rows)
+        ids = insert_patients(session, pacientes, predicoes, embeddings)
+        session.commit()
+    except IntegrityError:
+        # Outro aparelho gravou o mesmo nome (ou captura) nesse meio tempo:
+        # refaz um a um para classificar cada captura
+        session.rollback()
+        if len(rows) == 1:
+            queue.mark(rows[0]["CAPTURA_ID"], CONFLITO, "Já existe um paciente com esse nome no banco central.")
+            return 0
+        return sum(_sync_batch(session, queue, [row]) for row in rows)
+    except Exception as e:
+        session.rollback()
+        if _is_offline(e):
+            raise
+        if len(rows) == 1:
+            logger.exception("Falha ao sincronizar a captura %s.", rows[0]["CAPTURA_ID"])
+            queue.mark(rows[0]["CAPTURA_ID"], ERRO, str(e))
+            return 0
+        return sum(_sync_batch(session, queue, [row]) for row in rows)
+
+    queue.mark_synced({p["captura_id"]: paciente_id for p, paciente_id in zip(pacientes, ids)})
+    index_embeddings(ids, np.stack(embeddings))
+    return len(ids)
+
+
+def sync(queue, batch_size=SYNC_BATCH_SIZE):
+    """
+    Envia as capturas pendentes ao banco central, em lotes.
+
+    Para no primeiro erro de conexão; as capturas restantes continuam
+    pendentes e são enviadas na próxima tentativa.
+
+    Parameters
+    ----------
+    queue : CaptureQueue
+        A fila local.
+    batch_size : int, optional
+        Capturas por transação.
+
+    Returns
+    -------
+    int
+        Número de pacientes gravados no banco central.
+
+    Raises
+    ------
+    RuntimeError
+        Se o armazenamento central (``CENTRAL_BLOB_STORE_DIR``) não estiver
+        configurado ou montado.
+    """
+    store = _central_store()
+    total = 0
+    while True:
+        rows = queue.pending(batch_size)
+        if not rows:
+            return total
+        session = get_session()
+        try:
+            rows = _upload_blobs(queue, rows, store)
+            gravados = _sync_batch(session, queue, rows) if rows else 0
+        except Exception as e:
+            if not _is_offline(e):
+                raise
+            logger.info("Sincronização adiada, sem conexão: %s", e)
+            return total
+        finally:
+            session.close()
+        total += gravados
+        logger.info("%d captura(s) sincronizada(s).", gravados)
+
+
+class SyncWorker:
+    """Thread que sincroniza a fila periodicamente ou quando acordada."""
+
+    def __init__(self, queue, interval_s=SYNC_INTERVAL_S):
+        self.queue = queue
+        self.interval_s = interval_s
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self.last_run = None
+        self.last_error = None
+        threading.Thread(target=self._run, name="fila-offline-sync", daemon=True).start()
+
+    def wake(self):
+        """Pede uma sincronização imediata."""
+        self._wake.set()
+
+    def sync_now(self):
+        """Sincroniza na thread atual; retorna o número de pacientes gravados."""
+        with self._lock:
+            try:
+                total = sync(self.queue)
+                self.last_error = None
+                return total
+            except Exception as e:
+                logger.exception("Falha na sincronização da fila offline.")
+                self.last_error = str(e)
+                return 0
+            finally:
+                self.last_run = _now()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval_s)
+            self._wake.clear()
+            # Uma falha (fila SQLite travada, disco cheio...) não pode matar a thread
+            try:
+                if self.queue.counts().get(PENDENTE):
+                    self.sync_now()
+            except Exception as e:
+                logger.exception("Falha ao verificar a fila offline.")
+                self.last_error = str(e)
+
+
+@st.cache_resource(show_spinner=False)
+def get_queue():
+    """Retorna a fila offline do aparelho."""
+    return CaptureQueue()
+
+
+@st.cache_resource(show_spinner=False)
+def _get_sync_worker():
+    """Retorna a thread de sincronização, iniciada no primeiro uso."""
+    return SyncWorker(get_queue())
+
+
+def sync_status():
+    """
+    Resumo da fila para a interface.
+
+    Returns
+    -------
+    dict
+        Contagem por status e horário e erro da última sincronização.
+    """
+    worker = _get_sync_worker()
+    return {"contagem": get_queue().counts(), "ultima": worker.last_run, "erro": worker.last_error}
+
+
+def sync_now():
+    """Sincroniza imediatamente e retorna o número de pacientes gravados."""
+    return _get_sync_worker().sync_now()
@@ -0,0 +1,355 @@
+"""
+Geocodificação de endereços com cache, usada pela busca de hospitais.
+
+Cada consulta passa por três camadas antes de chegar à API:
+
+1. o endereço é normalizado (acentos, caixa, abreviações, espaços) e o CEP
+   é extraído, de modo que grafias diferentes do mesmo endereço usem a mesma
+   chave;
+2. um LRU em memória e um armazenamento SQLite local com validade
+   (``GEOCODE_TTL_DAYS`` para acertos, ``GEOCODE_NEGATIVE_TTL_H`` para
+   endereços não encontrados) evitam repetir chamadas entre reruns e
+   reinícios do app;
+3. se o cliente falhar ou não encontrar o endereço, usa-se o centroide do
+   CEP de uma tabela local (``GEOCODE_CEP_TABLE``, CSV ``cep,lat,lng``),
+   exato ou pelo prefixo de 5 dígitos.
+
+O cliente é plugável (``GEOCODER=google`` ou ``local``): ``LocalGeocoder``
+responde a partir de uma tabela em memória e substitui o Google em testes e
+execuções offline. ``Geocoder.metrics()`` informa as taxas de acerto.
+"""
+import contextlib
+import csv
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+
+import streamlit as st
+
+from utils.places import TTLCache
+from utils.tracing import add_collector
+
+logger = logging.getLogger(__name__)
+
+GEOCODER = os.getenv('GEOCODER', 'google')
+GEOCODE_CACHE_PATH = os.getenv('GEOCODE_CACHE_PATH', '.cache/geocoding.sqlite3')
+GEOCODE_CEP_TABLE = os.getenv('GEOCODE_CEP_TABLE', 'data/cep_centroides.csv')
+GEOCODE_TTL_DAYS = float(os.getenv('GEOCODE_TTL_DAYS', 90))
+GEOCODE_NEGATIVE_TTL_H = float(os.getenv('GEOCODE_NEGATIVE_TTL_H', 24))
+GEOCODE_LRU_SIZE = int(os.getenv('GEOCODE_LRU_SIZE', 1024))
+
+_CEP_RE = re.compile(r"\b(\d{5})-?(\d{3})\b")
+_ABBREVIATIONS = {
+    "r": "rua", "av": "avenida", "trav": "travessa", "tv": "travessa", "al": "alameda",
+    "pc": "praca", "pca": "praca", "rod": "rodovia", "est": "estrada", "jd": "jardim",
+    "vl": "vila", "pq": "parque", "n": "", "no": "", "nº": "", "num": "",
+}
+
+
+@dataclass(frozen=True)
+class Location:
+    """Coordenadas de um endereço e a origem da resposta."""
+
+    lat: float
+    lng: float
+    fonte: str
+
+
+def normalize_cep(cep):
+    """Retorna o CEP com 8 dígitos, ou ``None`` se não for um CEP válido."""
+    digits = re.sub(r"\D", "", cep or "")
+    return digits if len(digits) == 8 else None
+
+
+def normalize_address(address):
+    """
+    Normaliza um endereço para uso como chave de cache.
+
+    Remove acentos e pontuação, passa para minúsculas, expande abreviações
+    comuns (``R.``, ``Av.``...) e descarta o CEP, que é tratado à parte.
+
+    Parameters
+    ----------
+    address : str
+        Endereço digitado.
+
+    Returns
+    -------
+    str
+    """
+    text = _CEP_RE.sub(" ", address or "")
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+    tokens = [_ABBREVIATIONS.get(token, token) for token in re.sub(r"[^\w]+", " ", text).split()]
+    return " ".join(token for token in tokens if token)
+
+
+def extract_cep(address):
+    """Extrai o primeiro CEP de um endereço, com 8 dígitos."""
+    match = _CEP_RE.search(address or "")
+    return match.group(1) + match.group(2) if match else None
+
+
+class GoogleGeocoder:
+    """Cliente de geocodificação pela API do Google Maps."""
+
+    fonte = "google"
+
+    def __init__(self, client):
+        self.client = client
+
+    def geocode(self, address):
+        """Retorna ``(lat, lng)`` ou ``None`` se o endereço não for encontrado."""
+        result = self.client.geocode(address, region="br")
+        if not result:
+            return None
+        location = result[0]['geometry']['location']
+        return location['lat'], location['lng']
+
+
+class LocalGeocoder:
+    """
+    Cliente local, sem rede, para testes e execuções offline.
+
+    Parameters
+    ----------
+    table : dict, optional
+        ``endereço -> (lat, lng)``; as chaves são normalizadas.
+    """
+
+    fonte = "local"
+
+    def __init__(self, table=None):
+        self.table = {normalize_address(address): coords for address, coords in (table or {}).items()}
+
+    def geocode(self, address):
+        return self.table.get(normalize_address(address))
+
+
+class CepCentroids:
+    """
+    Centroides de CEP lidos de um CSV ``cep,lat,lng``.
+
+    Consultas por CEP exato; na falta dele, a média dos CEPs com o mesmo
+    prefixo de 5 dígitos (setor).
+    """
+
+    def __init__(self, path=GEOCODE_CEP_TABLE):
+        self.exact = {}
+        sectors = {}
+        if os.path.exists(path):
+            with open(path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    cep = normalize_cep(row["cep"])
+                    if cep is None:
+                        continue
+                    coords = float(row["lat"]), float(row["lng"])
+                    self.exact[cep] = coords
+                    sectors.setdefault(cep[:5], []).append(coords)
+        self.sectors = {
+            prefix: (sum(lat for lat, _ in points) / len(points), sum(lng for _, lng in points) / len(points))
+            for prefix, points in sectors.items()
+        }
+
+    def lookup(self, cep):
+        """Retorna ``(lat, lng)`` do CEP ou do seu setor, ou ``None``."""
+        cep = normalize_cep(cep)
+        if cep is None:
+            return None
+        return self.exact.get(cep) or self.sectors.get(cep[:5])
+
+
+class GeocodeStore:
+    """
+    Cache persistente de geocodificação em SQLite, com validade por entrada.
+
+    Entradas vencidas continuam guardadas: ``get(..., allow_expired=True)``
+    as devolve quando a API está indisponível.
+    """
+
+    def __init__(self, path=GEOCODE_CACHE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS GEOCODE (
+                    CHAVE TEXT PRIMARY KEY,
+                    LAT REAL,
+                    LNG REAL,
+                    FONTE TEXT NOT NULL,
+                    EXPIRA_EM REAL NOT NULL
+                )
+            """)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=10)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, key, allow_expired=False):
+        """
+        Lê uma entrada.
+
+        Returns
+        -------
+        tuple or None
+            ``(location, restante_s)``, onde ``location`` é ``None`` para
+            endereços sabidamente não encontrados e ``restante_s`` é a
+            validade restante em segundos (negativa se vencida); ``None`` se
+            não houver entrada.
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT LAT, LNG, FONTE, EXPIRA_EM FROM GEOCODE WHERE CHAVE = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        lat, lng, fonte, expires = row
+        remaining_s = expires - time.time()
+        if remaining_s <= 0 and not allow_expired:
+            return None
+        return (Location(lat, lng, fonte) if lat is not None else None), remaining_s
+
+    def put(self, key, location, ttl_s):
+        """Grava uma entrada; ``location=None`` registra um endereço não encontrado."""
+        lat, lng, fonte = (location.lat, location.lng, location.fonte) if location else (None, None, "")
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO GEOCODE (CHAVE, LAT, LNG, FONTE, EXPIRA_EM) VALUES (?, ?, ?, ?, ?)",
+                (key, lat, lng, fonte, time.time() + ttl_s))
+
+
+class Geocoder:
+    """
+    Geocodificador com LRU em memória, cache persistente e fallback por CEP.
+
+    Parameters
+    ----------
+    client : object
+        Objeto com ``geocode(address) -> (lat, lng) | None`` e atributo ``fonte``.
+    store : GeocodeStore
+        Cache persistente.
+    centroids : CepCentroids, optional
+        Tabela de centroides de CEP para o fallback.
+    lru_size : int, optional
+        Número de entradas do LRU em memória.
+    """
+
+    def __init__(self, client, store, centroids=None, lru_size=GEOCODE_LRU_SIZE):
+        self.client = client
+        self.store = store
+        self.centroids = centroids or CepCentroids()
+        self._lru = TTLCache(lru_size, GEOCODE_TTL_DAYS * 86400)
+        self._lock = threading.Lock()
+        self._counts = {"consultas": 0, "lru": 0, "persistente": 0, "api": 0, "cep": 0, "falhas_api": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def locate(self, address, cep=None):
+        """
+        Retorna as coordenadas de um endereço.
+
+        Parameters
+        ----------
+        address : str
+            Endereço digitado.
+        cep : str, optional
+            CEP informado à parte; se omitido, é procurado no endereço.
+
+        Returns
+        -------
+        Location or None
+            As coordenadas e sua origem (``google``, ``local`` ou ``cep``),
+            ou ``None`` se nada for encontrado.
+        """
+        self._count("consultas")
+        cep = normalize_cep(cep) or extract_cep(address)
+        key = f"{normalize_address(address)}|{cep or ''}"
+
+        # Valores em tupla: ``(None,)`` guarda um endereço não encontrado
+        entry = self._lru.get(key)
+        if entry is not None:
+            self._count("lru")
+            return entry[0]
+
+        cached = self.store.get(key)
+        if cached is not None:
+            self._count("persistente")
+            # No LRU, vale o que resta da validade gravada no cache persistente
+            self._lru.put(key, (cached[0],), cached[1])
+            return cached[0]
+
+        try:
+            self._count("api")
+            coords = self.client.geocode(address)
+        except Exception as e:
+            # Sem rede ou cota esgotada: entrada vencida ou centroide do CEP,
+            # sem gravar nada, para tentar a API de novo na próxima vez
+            self._count("falhas_api")
+            logger.warning("Falha na geocodificação de %r: %s", key, e)
+            stale = self.store.get(key, allow_expired=True)
+            if stale is not None and stale[0] is not None:
+                return stale[0]
+            return self._from_cep(cep)
+
+        if coords is not None:
+            location = Location(coords[0], coords[1], self.client.fonte)
+            ttl_s = GEOCODE_TTL_DAYS * 86400
+        else:
+            location = self._from_cep(cep)
+            ttl_s = GEOCODE_NEGATIVE_TTL_H * 3600
+        self.store.put(key, location, ttl_s)
+        self._lru.put(key, (location,), ttl_s)
+        return location
+
+    def _from_cep(self, cep):
+        coords = self.centroids.lookup(cep)
+        if coords is None:
+            return None
+        self._count("cep")
+        return Location(coords[0], coords[1], "cep")
+
+    def metrics(self):
+        """
+        Contadores e taxas de acerto do cache.
+
+        Returns
+        -------
+        dict
+            Consultas, acertos no LRU e no cache persistente, chamadas e
+            falhas da API, respostas pelo CEP e a taxa de acerto total.
+        """
+        with self._lock:
+            counts = dict(self._counts)
+        total = counts["consultas"]
+        counts["taxa_acerto"] = (counts["lru"] + counts["persistente"]) / total if total else 0.0
+        return counts
+
+
+def _build_client(name):
+    if name == "local":
+        return LocalGeocoder()
+    if name == "google":
+        from utils.paciente import get_gmaps
+        return GoogleGeocoder(get_gmaps())
+    raise ValueError(f"geocodificador desconhecido: {name!r}")
+
+
+@st.cache_resource(show_spinner=False)
+def get_geocoder(name=GEOCODER):
+    """Retorna o geocodificador compartilhado do processo."""
+    geocoder = Geocoder(_build_client(name), GeocodeStore())
+    add_collector("geocoding", geocoder.metrics)
+    return geocoder
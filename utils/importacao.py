@@ -0,0 +1,414 @@
+"""
+Importação em lote de pacientes coletados pelos ACS em campo.
+
+O arquivo é um CSV (com as imagens enviadas à parte) ou um ZIP com um
+``.csv`` e as imagens. Colunas do CSV, na ordem do formulário de cadastro::
+
+    nome;senha;data_nascimento;endereco;cep;telefone;tempo_lesao;
+    historico_diabetes;historico_cancer;anti_inflamatorio;imagem
+
+``imagem`` é o nome do arquivo da foto; as colunas de histórico aceitam
+``Sim``/``Não``. O separador (``;`` ou ``,``) é detectado automaticamente.
+
+A importação acontece em etapas, para que o trabalho caro seja feito em lote:
+
+1. todas as linhas são validadas antes de qualquer escrita, inclusive nomes
+   repetidos no arquivo ou já cadastrados;
+2. imagens são normalizadas e senhas passam pelo bcrypt em paralelo;
+3. as lesões são classificadas em lotes de ``BATCH_SIZE`` imagens;
+4. cada bloco de ``IMPORT_CHUNK_SIZE`` pacientes é gravado com INSERTs de
+   várias linhas numa única transação.
+
+Erros ficam associados à linha do CSV e não interrompem o restante: uma
+imagem corrompida vira erro da sua linha e, se um bloco falhar, suas linhas
+são regravadas uma a uma para isolar a culpada. Cada entrada do ZIP tem o
+tamanho descompactado limitado (``MAX_UPLOAD_BYTES`` para imagens,
+``MAX_CSV_BYTES`` para o CSV) antes de ser lida para a memória.
+"""
+import csv
+import io
+import logging
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import bcrypt
+import numpy as np
+import streamlit as st
+from sqlalchemy import column, insert, table, text
+from sqlalchemy.exc import IntegrityError
+
+from utils.auth import BCRYPT_ROUNDS
+from utils.blobstore import get_store
+from utils.classifier import BATCH_SIZE, MODEL_VERSION
+from utils.ingest import MAX_UPLOAD_BYTES, InvalidImage, ingest_image
+from utils.similarity import classify_and_embed, index_embeddings
+
+logger = logging.getLogger(__name__)
+
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', os.cpu_count() or 1))
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 50))
+MAX_IMPORT_ROWS = int(os.getenv('MAX_IMPORT_ROWS', 1000))
+MAX_CSV_BYTES = int(os.getenv('MAX_CSV_BYTES', 5 * 1024 * 1024))
+
+COLUMNS = ["nome", "senha", "data_nascimento", "endereco", "cep", "telefone", "tempo_lesao",
+           "historico_diabetes", "historico_cancer", "anti_inflamatorio", "imagem"]
+BOOLEAN_COLUMNS = ["historico_diabetes", "historico_cancer", "anti_inflamatorio"]
+_TRUE = {"sim", "s", "true", "1"}
+_FALSE = {"não", "nao", "n", "false", "0"}
+
+# Construções leves do SQLAlchemy Core: com elas, uma lista de parâmetros
+# vira um único INSERT de várias linhas ("insertmanyvalues")
+_paciente = table(
+    "paciente",
+    column("paciente_id"), column("nome"), column("senha"), column("data_de_nascimento"),
+    column("endereco"), column("cep"), column("telefone"), column("tempo_com_a_lesao"),
+    column("historico_diabetes"), column("historico_cancer"), column("anti_inflamatorio_sem_efeito"),
+    column("imagem_hash"), column("miniatura_hash"), column("entrada_modelo_hash"), column("captura_id"),
+)
+_predicao = table(
+    "predicao",
+    column("paciente_id"), column("versao_modelo"), column("classe"),
+    column("probabilidade"), column("probabilidades"),
+)
+_embedding = table("embedding_lesao", column("paciente_id"), column("versao_modelo"), column("vetor"))
+
+
+@dataclass
+class ImportRow:
+    """Uma linha válida do CSV e os artefatos calculados para ela."""
+
+    linha: int
+    values: dict
+    imagem_bytes: bytes
+    imagem: object = None
+    senha_hash: bytes = None
+    predicao: object = None
+    embedding: np.ndarray = None
+
+
+@dataclass(frozen=True)
+class RowError:
+    """Erro associado a uma linha do CSV (a linha 1 é o cabeçalho)."""
+
+    linha: int
+    nome: str
+    mensagem: str
+
+
+@dataclass
+class ImportReport:
+    """Resultado de uma importação."""
+
+    importados: list = field(default_factory=list)
+    erros: list = field(default_factory=list)
+
+
+def read_zip(data):
+    """
+    Extrai o CSV e as imagens de um arquivo ZIP.
+
+    Parameters
+    ----------
+    data : bytes
+        Conteúdo do ZIP.
+
+    Returns
+    -------
+    tuple of (str, dict)
+        O texto do CSV e um dicionário ``nome do arquivo -> bytes``. As
+        imagens são indexadas pelo nome sem diretório; imagens maiores que
+        ``MAX_UPLOAD_BYTES`` descompactadas não são lidas e ficam como
+        ``InvalidImage``, reportado na linha que as usa.
+
+    Raises
+    ------
+    ValueError
+        Se não houver exatamente um CSV ou se ele exceder ``MAX_CSV_BYTES``.
+    """
+    csv_text, images = None, {}
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or os.path.basename(info.filename).startswith("."):
+                continue
+            name = os.path.basename(info.filename)
+            if name.lower().endswith(".csv"):
+                if csv_text is not None:
+                    raise ValueError("O ZIP deve conter um único arquivo CSV.")
+                content = _read_entry(archive, info, MAX_CSV_BYTES)
+                if content is None:
+                    raise ValueError(f"O CSV excede {MAX_CSV_BYTES // (1024 * 1024)} MB.")
+                csv_text = content.decode("utf-8-sig")
+            else:
+                content = _read_entry(archive, info, MAX_UPLOAD_BYTES)
+                images[name] = content if content is not None else InvalidImage(
+                    f"Arquivo maior que {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+    if csv_text is None:
+        raise ValueError("Nenhum arquivo CSV encontrado no ZIP.")
+    return csv_text, images
+
+
+def _read_entry(archive, info, limit):
+    """Lê uma entrada do ZIP, ou retorna None se ela passar de ``limit`` bytes descompactada."""
+    # O tamanho declarado no cabeçalho pode mentir: a leitura também é limitada
+    if info.file_size > limit:
+        return None
+    with archive.open(info) as entry:
+        content = entry.read(limit + 1)
+    return content if len(content) <= limit else None
+
+
+def _parse_bool(value):
+    value = value.strip().lower()
+    if value in _TRUE:
+        return True
+    if value in _FALSE:
+        return False
+    raise ValueError(value)
+
+
+def parse_rows(csv_text, images):
+    """
+    Valida todas as linhas do CSV antes de qualquer processamento.
+
+    Parameters
+    ----------
+    csv_text : str
+        Conteúdo do CSV, com cabeçalho.
+    images : dict
+        ``nome do arquivo -> bytes`` das imagens disponíveis.
+
+    Returns
+    -------
+    tuple of (list of ImportRow, list of RowError)
+    """
+    try:
+        dialect = csv.Sniffer().sniff(csv_text[:4096], delimiters=";,")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(csv_text), dialect=dialect)
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+    missing = [name for name in COLUMNS if name not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"Colunas ausentes no CSV: {', '.join(missing)}")
+
+    rows, errors, seen = [], [], set()
+    for linha, record in enumerate(reader, start=2):
+        if len(rows) + len(errors) >= MAX_IMPORT_ROWS:
+            raise ValueError(f"O arquivo excede o limite de {MAX_IMPORT_ROWS} pacientes.")
+        values = {name: (record.get(name) or "").strip() for name in COLUMNS}
+        nome = values["nome"]
+
+        vazios = [name for name in COLUMNS if not values[name]]
+        if vazios:
+            errors.append(RowError(linha, nome, f"Campos obrigatórios vazios: {', '.join(vazios)}"))
+            continue
+        if nome in seen:
+            errors.append(RowError(linha, nome, "Nome repetido no arquivo."))
+            continue
+        try:
+            values["data_nascimento"] = datetime.strptime(values["data_nascimento"], "%d/%m/%Y").date()
+        except ValueError:
+            errors.append(RowError(linha, nome, "Data de nascimento inválida. Use DD/MM/AAAA."))
+            continue
+        try:
+            for name in BOOLEAN_COLUMNS:
+                values[name] = _parse_bool(values[name])
+        except ValueError as e:
+            errors.append(RowError(linha, nome, f"Valor inválido '{e}' em {name}; use Sim ou Não."))
+            continue
+        imagem_bytes = images.get(os.path.basename(values["imagem"]))
+        if imagem_bytes is None:
+            errors.append(RowError(linha, nome, f"Imagem '{values['imagem']}' não encontrada."))
+            continue
+        if isinstance(imagem_bytes, InvalidImage):
+            errors.append(RowError(linha, nome, f"Imagem inválida: {imagem_bytes}"))
+            continue
+
+        seen.add(nome)
+        rows.append(ImportRow(linha, values, imagem_bytes))
+    return rows, errors
+
+
+def _existing_names(session, nomes):
+    query = text("SELECT NOME FROM PACIENTE WHERE NOME = ANY(:nomes)")
+    return {row[0] for row in session.execute(query, {"nomes": list(nomes)})}
+
+
+@st.cache_resource(show_spinner=False)
+def _get_import_pool():
+    """Pool de threads para normalizar imagens e gerar hashes de senha."""
+    return ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="importacao")
+
+
+def _hash_password(senha):
+    # Fora do pool de login (utils.auth), para que uma importação grande
+    # não atrase quem está entrando no sistema
+    return bcrypt.hashpw(senha.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS))
+
+
+def _prepare(rows, errors, progress):
+    pool = _get_import_pool()
+    imagens = pool.map(lambda row: _try(ingest_image, row.imagem_bytes), rows)
+    senhas = pool.map(lambda row: _hash_password(row.values["senha"]), rows)
+
+    prontas = []
+    for i, (row, imagem, senha_hash) in enumerate(zip(rows, imagens, senhas), start=1):
+        if isinstance(imagem, Exception):
+            mensagem = (f"Imagem inválida: {imagem}" if isinstance(imagem, InvalidImage)
+                        else f"Erro ao processar a imagem: {imagem}")
+            errors.append(RowError(row.linha, row.values["nome"], mensagem))
+            continue
+        row.imagem, row.senha_hash = imagem, senha_hash
+        row.imagem_bytes = None
+        prontas.append(row)
+        progress(i / len(rows) / 3)
+
+    for start in range(0, len(prontas), BATCH_SIZE):
+        batch = prontas[start:start + BATCH_SIZE]
+        predicoes, embeddings = classify_and_embed([row.imagem.model_input for row in batch])
+        for row, predicao, embedding in zip(batch, predicoes, embeddings):
+            row.predicao, row.embedding = predicao, embedding
+        progress(1 / 3 + min(start + BATCH_SIZE, len(prontas)) / len(prontas) / 3)
+    return prontas
+
+
+def _try(fn, *args):
+    # Qualquer falha vira erro da linha, em vez de interromper a importação
+    try:
+        return fn(*args)
+    except Exception as e:
+        logger.debug("Falha ao processar imagem da importação", exc_info=True)
+        return e
+
+
+def _insert_chunk(session, store, chunk):
+    pacientes = [{
+        "nome": row.values["nome"],
+        "senha": row.senha_hash,
+        "data_de_nascimento": row.values["data_nascimento"],
+        "endereco": row.values["endereco"],
+        "cep": row.values["cep"],
+        "telefone": row.values["telefone"],
+        "tempo_com_a_lesao": row.values["tempo_lesao"],
+        "historico_diabetes": row.values["historico_diabetes"],
+        "historico_cancer": row.values["historico_cancer"],
+        "anti_inflamatorio_sem_efeito": row.values["anti_inflamatorio"],
+        "imagem_hash": store.put(row.imagem.canonical),
+        "miniatura_hash": store.put(row.imagem.thumbnail),
+        "entrada_modelo_hash": store.put(row.imagem.model_input_bytes),
+    } for row in chunk]
+    return insert_patients(session, pacientes, [row.predicao for row in chunk],
+                           [row.embedding for row in chunk])
+
+
+def insert_patients(session, pacientes, predicoes, embeddings):
+    """
+    Grava pacientes, predições e embeddings com um INSERT de várias linhas por tabela.
+
+    Não faz commit: participa da transação do chamador.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Sessão aberta com o banco de dados.
+    pacientes : list of dict
+        Colunas da tabela PACIENTE (em minúsculas), todas com as mesmas chaves.
+    predicoes : list of Prediction
+        Predição de cada paciente, do modelo ``MODEL_VERSION``.
+    embeddings : sequence of np.ndarray
+        Embedding de cada paciente.
+
+    Returns
+    -------
+    list of int
+        Os ``PACIENTE_ID`` gerados, na ordem de ``pacientes``.
+    """
+    ids = session.execute(
+        insert(_paciente).returning(_paciente.c.paciente_id, sort_by_parameter_order=True),
+        pacientes).scalars().all()
+    session.execute(insert(_predicao), [{
+        "paciente_id": paciente_id,
+        "versao_modelo": MODEL_VERSION,
+        "classe": predicao.label,
+        "probabilidade": predicao.probability,
+        "probabilidades": list(predicao.probabilities),
+    } for paciente_id, predicao in zip(ids, predicoes)])
+    session.execute(insert(_embedding), [{
+        "paciente_id": paciente_id,
+        "versao_modelo": MODEL_VERSION,
+        "vetor": np.asarray(embedding, dtype=np.float32).tobytes(),
+    } for paciente_id, embedding in zip(ids, embeddings)])
+    return ids
+
+
+def _write(session, store, chunk, report):
+    try:
+        ids = _insert_chunk(session, store, chunk)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        if len(chunk) == 1:
+            row = chunk[0]
+            mensagem = ("Já existe um cadastro com esse nome." if isinstance(e, IntegrityError)
+                        else f"Erro ao gravar: {e}")
+            report.erros.append(RowError(row.linha, row.values["nome"], mensagem))
+            return
+        logger.warning("Bloco de %d pacientes falhou; gravando linha a linha.", len(chunk), exc_info=True)
+        for row in chunk:
+            _write(session, store, [row], report)
+        return
+
+    index_embeddings(ids, np.stack([row.embedding for row in chunk]))
+    report.importados.extend(
+        (row.linha, row.values["nome"], paciente_id, row.predicao.label)
+        for paciente_id, row in zip(ids, chunk))
+
+
+def import_patients(session, csv_text, images, progress=lambda fraction: None):
+    """
+    Importa pacientes em lote.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Sessão aberta com o banco de dados; cada bloco é uma transação.
+    csv_text : str
+        Conteúdo do CSV.
+    images : dict
+        ``nome do arquivo -> bytes`` das imagens.
+    progress : callable, optional
+        Recebe a fração concluída, entre 0 e 1.
+
+    Returns
+    -------
+    ImportReport
+        Pacientes gravados ``(linha, nome, paciente_id, classe)`` e erros por linha.
+
+    Raises
+    ------
+    ValueError
+        Se o CSV não tiver as colunas esperadas ou exceder ``MAX_IMPORT_ROWS``.
+    """
+    report = ImportReport()
+    rows, report.erros = parse_rows(csv_text, images)
+
+    if rows:
+        existentes = _existing_names(session, [row.values["nome"] for row in rows])
+        session.rollback()
+        for row in rows:
+            if row.values["nome"] in existentes:
+                report.erros.append(RowError(row.linha, row.values["nome"], "Já existe um cadastro com esse nome."))
+        rows = [row for row in rows if row.values["nome"] not in existentes]
+
+    rows = _prepare(rows, report.erros, progress)
+    store = get_store()
+    for start in range(0, len(rows), IMPORT_CHUNK_SIZE):
+        _write(session, store, rows[start:start + IMPORT_CHUNK_SIZE], report)
+        progress(2 / 3 + min(start + IMPORT_CHUNK_SIZE, len(rows)) / len(rows) / 3)
+
+    report.erros.sort(key=lambda erro: erro.linha)
+    progress(1.0)
+    return report
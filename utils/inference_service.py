@@ -0,0 +1,301 @@
+"""
+Serviço local de inferência com micro-batching dinâmico.
+
+Um único processo é dono do modelo e atende todas as sessões do Streamlit.
+Requisições concorrentes entram numa fila limitada e são agrupadas em
+micro-lotes (até ``max_batch`` imagens ou ``max_wait_ms`` de espera), que
+passam por um único forward. Com a fila cheia, o serviço responde
+``503`` (backpressure) e o cliente cai no modelo em processo.
+
+Protocolo (HTTP/1.1 mínimo, em TCP ou socket Unix):
+
+- ``POST /predict``: corpo com a imagem BGR uint8 já redimensionada para
+  224x224 (``224 * 224 * 3`` bytes); responde JSON com ``probabilities`` e
+  ``model_version``;
+- ``GET /metrics``: JSON com profundidade da fila e estatísticas dos lotes.
+
+Uso::
+
+    python -m utils.inference_service --unix-socket /tmp/leishticia.sock
+
+e, no Streamlit, ``INFERENCE_SERVICE_URL=unix:///tmp/leishticia.sock``.
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.preprocess import INPUT_SIZE, resize_for_model
+
+IMAGE_BYTES = INPUT_SIZE * INPUT_SIZE * 3
+SERVICE_URL = os.getenv('INFERENCE_SERVICE_URL')
+SERVICE_TIMEOUT = float(os.getenv('INFERENCE_SERVICE_TIMEOUT', 10))
+
+
+class ServiceUnavailable(Exception):
+    """O serviço de inferência não está acessível ou recusou a requisição."""
+
+
+class MicroBatcher:
+    """
+    Agrupa requisições concorrentes em micro-lotes para um único forward.
+
+    Parameters
+    ----------
+    predict : callable
+        Função síncrona ``(list of np.ndarray) -> list of Prediction``.
+    max_batch : int
+        Número máximo de imagens por lote.
+    max_wait_ms : float
+        Tempo máximo que a primeira requisição espera por companhia.
+    max_queue : int
+        Tamanho máximo da fila; acima disso as requisições são recusadas.
+    """
+
+    def __init__(self, predict, max_batch=32, max_wait_ms=10, max_queue=256):
+        self.predict = predict
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        # Um único worker: lotes em série não disputam as threads do torch
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.batches = 0
+        self.images = 0
+        self.rejected = 0
+        self.max_batch_seen = 0
+
+    def submit(self, image):
+        """
+        Enfileira uma imagem e retorna o future da sua predição.
+
+        Raises
+        ------
+        asyncio.QueueFull
+            Se a fila estiver cheia.
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((image, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise
+        return future
+
+    async def run(self):
+        """Laço principal: monta os lotes e executa o forward fora do event loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            images = [image for image, _ in batch]
+            try:
+                predictions = await loop.run_in_executor(self.executor, self.predict, images)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.images += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            for (_, future), prediction in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(prediction)
+
+    def metrics(self):
+        """Retorna profundidade da fila e estatísticas dos lotes."""
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "batches": self.batches,
+            "images": self.images,
+            "rejected": self.rejected,
+            "mean_batch_size": self.images / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+        }
+
+
+async def _respond(writer, status, payload):
+    body = json.dumps(payload).encode()
+    reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}[status]
+    writer.write(f"HTTP/1.1 {status} {reason}\r\n"
+                 f"Content-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+
+
+def make_handler(batcher, model_version):
+    """Cria o handler de conexões HTTP (keep-alive) do serviço."""
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    key, _, value = line.decode().partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if method == "GET" and path == "/metrics":
+                    await _respond(writer, 200, batcher.metrics())
+                elif method == "POST" and path == "/predict":
+                    if len(body) != IMAGE_BYTES:
+                        await _respond(writer, 400, {"error": f"esperados {IMAGE_BYTES} bytes"})
+                        continue
+                    image = np.frombuffer(body, dtype=np.uint8).reshape(INPUT_SIZE, INPUT_SIZE, 3)
+                    try:
+                        future = batcher.submit(image)
+                    except asyncio.QueueFull:
+                        await _respond(writer, 503, {"error": "fila cheia", **batcher.metrics()})
+                        continue
+                    try:
+                        prediction = await future
+                    except Exception as e:
+                        await _respond(writer, 503, {"error": f"falha na inferência: {e}"})
+                        continue
+                    await _respond(writer, 200, {"probabilities": list(prediction.probabilities),
+                                                 "model_version": model_version})
+                else:
+                    await _respond(writer, 404, {"error": "rota desconhecida"})
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def serve(host="127.0.0.1", port=8765, unix_socket=None, max_batch=32, max_wait_ms=10, max_queue=256):
+    """
+    Carrega o modelo e atende requisições até o processo ser encerrado.
+    """
+    from utils.classifier import MODEL_VERSION, classify_batch_local
+
+    batcher = MicroBatcher(classify_batch_local, max_batch, max_wait_ms, max_queue)
+    # Aquece o modelo antes de aceitar conexões
+    classify_batch_local([np.zeros((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)])
+
+    handler = make_handler(batcher, MODEL_VERSION)
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        server = await asyncio.start_unix_server(handler, path=unix_socket)
+    else:
+        server = await asyncio.start_server(handler, host, port)
+
+    async with server:
+        await asyncio.gather(server.serve_forever(), batcher.run())
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class InferenceClient:
+    """
+    Cliente do serviço de inferência, com uma conexão persistente por thread.
+
+    Parameters
+    ----------
+    url : str
+        ``http://host:porta`` ou ``unix:///caminho/do/socket``.
+    timeout : float, optional
+        Timeout de cada requisição, em segundos.
+    """
+
+    def __init__(self, url, timeout=SERVICE_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.url.startswith("unix://"):
+                conn = _UnixHTTPConnection(self.url[len("unix://"):], self.timeout)
+            else:
+                host = self.url.removeprefix("http://").rstrip("/")
+                conn = http.client.HTTPConnection(host, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, method, path, body=None):
+        conn = self._connection()
+        try:
+            conn.request(method, path, body=body,
+                         headers={"Content-Type": "application/octet-stream"})
+            response = conn.getresponse()
+            payload = json.loads(response.read())
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            self._local.conn = None
+            raise ServiceUnavailable(str(e)) from e
+        except ValueError as e:
+            # Resposta que não é JSON (proxy, página de erro): usa o modelo local
+            raise ServiceUnavailable(f"resposta inválida do serviço (HTTP {response.status})") from e
+        if response.status != 200:
+            raise ServiceUnavailable(payload.get("error", response.status) if isinstance(payload, dict)
+                                     else response.status)
+        return payload
+
+    def predict(self, image):
+        """
+        Envia uma imagem BGR e retorna o vetor de probabilidades e a versão do modelo.
+
+        Raises
+        ------
+        ServiceUnavailable
+            Se o serviço estiver fora do ar ou com a fila cheia.
+        """
+        resized = np.ascontiguousarray(resize_for_model(image))
+        payload = self._request("POST", "/predict", resized.tobytes())
+        return payload["probabilities"], payload["model_version"]
+
+    def metrics(self):
+        """Retorna as métricas do serviço."""
+        return self._request("GET", "/metrics")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serviço local de inferência com micro-batching.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--max-queue", type=int, default=256)
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.host, args.port, args.unix_socket,
+                      args.max_batch, args.max_wait_ms, args.max_queue))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Normalização das imagens de lesão no momento do cadastro.
+
+O upload é validado, tem a orientação EXIF aplicada e os metadados
+removidos, e gera três artefatos gravados junto com o paciente:
+
+- a imagem canônica, em JPEG com o maior lado limitado a ``CANONICAL_MAX_SIDE``;
+- uma miniatura JPEG para exibição na interface;
+- a entrada do modelo: 224x224x3 uint8 BGR, já redimensionada.
+
+Leituras posteriores (área do médico, reclassificação) usam a miniatura e a
+entrada do modelo, sem buscar nem decodificar a foto original.
+"""
+import io
+import os
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from utils.preprocess import INPUT_SIZE, resize_for_model
+
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+MAX_PIXELS = 50_000_000
+MIN_SIDE = 64
+CANONICAL_MAX_SIDE = int(os.getenv('CANONICAL_MAX_SIDE', 1024))
+THUMBNAIL_SIDE = 256
+ALLOWED_FORMATS = {"JPEG", "PNG", "WEBP", "MPO"}
+
+
+class InvalidImage(ValueError):
+    """O arquivo enviado não é uma imagem de lesão aceitável."""
+
+
+@dataclass(frozen=True)
+class IngestedImage:
+    """
+    Artefatos gerados a partir de um upload.
+
+    Attributes
+    ----------
+    canonical : bytes
+        JPEG sem EXIF, orientado e com resolução limitada.
+    thumbnail : bytes
+        JPEG pequeno para a interface.
+    model_input : np.ndarray
+        Imagem BGR uint8 ``(224, 224, 3)`` pronta para ``classify_batch``.
+    """
+    canonical: bytes
+    thumbnail: bytes
+    model_input: np.ndarray
+
+    @property
+    def model_input_bytes(self):
+        """A entrada do modelo serializada para a coluna ENTRADA_MODELO."""
+        return self.model_input.tobytes()
+
+
+def model_input_from_bytes(data):
+    """Reconstrói a entrada do modelo gravada em ENTRADA_MODELO (sem cópia)."""
+    return np.frombuffer(data, dtype=np.uint8).reshape(INPUT_SIZE, INPUT_SIZE, 3)
+
+
+def _encode_jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def ingest_image(data):
+    """
+    Valida e normaliza uma imagem enviada.
+
+    Parameters
+    ----------
+    data : bytes
+        Conteúdo do arquivo enviado.
+
+    Returns
+    -------
+    IngestedImage
+
+    Raises
+    ------
+    InvalidImage
+        Se o arquivo for grande demais, não for uma imagem suportada ou
+        tiver dimensões fora dos limites.
+    """
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise InvalidImage(f"Arquivo maior que {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+
+    try:
+        with Image.open(io.BytesIO(data)) as probe:
+            if probe.format not in ALLOWED_FORMATS:
+                raise InvalidImage(f"Formato {probe.format} não suportado.")
+            width, height = probe.size
+            probe.verify()
+    except InvalidImage:
+        raise
+    except Exception as e:
+        raise InvalidImage("O arquivo não é uma imagem válida.") from e
+
+    if width * height > MAX_PIXELS:
+        raise InvalidImage("Imagem com resolução grande demais.")
+    if min(width, height) < MIN_SIDE:
+        raise InvalidImage(f"Imagem muito pequena (mínimo de {MIN_SIDE} pixels por lado).")
+
+    # ``verify()`` não decodifica os pixels: um JPEG truncado só falha aqui
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Reduz já na decodificação (JPEG), depois aplica a orientação EXIF
+            image.draft("RGB", (CANONICAL_MAX_SIDE, CANONICAL_MAX_SIDE))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+
+        # Recria a imagem sem metadados (EXIF, GPS, perfil de câmera)
+        image.thumbnail((CANONICAL_MAX_SIDE, CANONICAL_MAX_SIDE), Image.LANCZOS)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise InvalidImage("O arquivo de imagem está corrompido ou incompleto.") from e
+    canonical = _encode_jpeg(image, quality=90)
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail((THUMBNAIL_SIDE, THUMBNAIL_SIDE), Image.LANCZOS)
+
+    bgr = np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
+    return IngestedImage(canonical=canonical,
+                         thumbnail=_encode_jpeg(thumbnail, quality=80),
+                         model_input=np.ascontiguousarray(resize_for_model(bgr)))
@@ -1,40 +1,18 @@
-import os
-import io
-from PIL import Image
-import bcrypt
 import streamlit as st
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
+from utils.auth import AuthBusy, authenticate, current_user, hash_password, login
+from utils.db import get_session
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 import time
-import numpy as np
-import cv2
-from utils.classifier import classify_image
-
-load_dotenv()
-
-# Obtendo os valores das variáveis de ambiente
-host = os.getenv('DB_HOST', 'localhost')
-port = os.getenv('DB_PORT', 5432)
-database = os.getenv('DB_DATABASE', 'LeisHticIA_gold')
-user = os.getenv('DB_USER', 'postgres')
-password = os.environ.get("PG_PASSWORD")
-
-# Configurando a conexão com o banco de dados usando SQLAlchemy
-DATABASE_URL = f"postgresql://{user}:{password}@{host}:{port}/{database}"
-
-
-@st.cache_resource
-def get_engine():
-    """
-    Retorna o engine do SQLAlchemy para conexão com o banco de dados.
-    """
-    return create_engine(DATABASE_URL)
-
-
-# Inicializando o SessionMaker
-engine = get_engine()
-Session = sessionmaker(bind=engine)
+from utils.classifier import CLASSES, classify_batch, show_prediction
+from utils.explain import explain_image, image_hash
+from utils.predicao import load_prediction, save_prediction
+from utils.blobstore import get_store
+from utils.ingest import model_input_from_bytes
+from utils.preprocess import decode_upload
+from utils.rerun import forget, memo, record, section, upload_key
+from utils.similarity import embed_images, find_similar_cases
+from utils.tracing import span
 
 
 # Página de login/cadastro do médico
@@ -64,18 +42,17 @@ def medico_login():
     register_button = st.button("Cadastrar-se")
 
     if login_button:
-        session = Session()
+        session = get_session()
         try:
-            query = text("SELECT * FROM MEDICO WHERE NOME = :username")
-            result = session.execute(
-                query, {"username": username}).mappings().fetchone()
-
-            if result and bcrypt.checkpw(password.encode('utf-8'), bytes(result["senha"])):
+            user = authenticate(session, "medico", username, password)
+            if user:
+                login(user)
                 st.success("Login realizado com sucesso!")
-                st.session_state["medico_logged_in"] = True
-                st.session_state["medico_user"] = result
+                st.rerun()
             else:
                 st.error("Usuário ou senha inválidos!")
+        except AuthBusy:
+            st.warning("Muitos acessos no momento. Tente novamente em alguns segundos.")
         except Exception as e:
             st.error(f"Erro ao conectar ao banco: {e}")
         finally:
@@ -116,9 +93,12 @@ def medico_register():
         if not nome or not hospital or not senha:
             st.error("Por favor, preencha todos os campos.")
             return
-        hashed_password = bcrypt.hashpw(
-            senha.encode('utf-8'), bcrypt.gensalt(12))
-        session = Session()
+        try:
+            hashed_password = hash_password(senha)
+        except AuthBusy:
+            st.warning("Muitos acessos no momento. Tente novamente em alguns segundos.")
+            return
+        session = get_session()
         try:
             query = text("""
                 INSERT INTO MEDICO (NOME, SENHA, HOSPITAL)
@@ -134,6 +114,9 @@ def medico_register():
             time.sleep(2)
             st.session_state["show_register"] = False
             st.rerun()
+        except IntegrityError:
+            st.error("Já existe um cadastro com esse nome. Escolha outro nome de usuário.")
+            session.rollback()
         except Exception as e:
             st.error(f"Erro ao inserir dados: {e}")
             session.rollback()
@@ -141,6 +124,284 @@ def medico_register():
             session.close()
 
 
+PAGE_SIZE = 20
+
+
+def search_patients(session, termo, pagina=0, page_size=PAGE_SIZE):
+    """
+    Busca pacientes por trecho do nome, sem diferenciar acentos e maiúsculas.
+
+    Usa o índice de trigramas sobre ``F_UNACCENT(LOWER(NOME))`` (migração 0005).
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Sessão aberta com o banco de dados.
+    termo : str
+        Trecho do nome digitado pelo médico.
+    pagina : int, optional
+        Página de resultados, a partir de 0.
+    page_size : int, optional
+        Resultados por página.
+
+    Returns
+    -------
+    tuple of (list of dict, bool)
+        Os pacientes da página (id, nome e data de nascimento) e se há
+        uma próxima página.
+    """
+    # Escapa os curingas do LIKE digitados pelo usuário
+    trecho = termo.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    query = text("""
+        SELECT PACIENTE_ID, NOME, DATA_DE_NASCIMENTO
+        FROM PACIENTE
+        WHERE F_UNACCENT(LOWER(NOME)) LIKE F_UNACCENT(LOWER(:padrao))
+        ORDER BY NOME, PACIENTE_ID
+        LIMIT :limite OFFSET :deslocamento
+    """)
+    rows = session.execute(query, {
+        "padrao": f"%{trecho}%",
+        "limite": page_size + 1,
+        "deslocamento": pagina * page_size
+    }).mappings().fetchall()
+    return [dict(row) for row in rows[:page_size]], len(rows) > page_size
+
+
+def _search_patients(termo, pagina):
+    session = get_session()
+    try:
+        return search_patients(session, termo, pagina)
+    finally:
+        session.close()
+
+
+def patient_search():
+    """
+    Campo de busca de pacientes da área do médico.
+
+    Returns
+    -------
+    int or None
+        O ``PACIENTE_ID`` selecionado, ou None se nenhum paciente foi escolhido.
+    """
+    termo = st.text_input("Buscar paciente (nome ou parte do nome)")
+    if termo != st.session_state.get("busca_termo"):
+        st.session_state["busca_termo"] = termo
+        st.session_state["busca_pagina"] = 0
+    if not termo.strip():
+        return None
+
+    pagina = st.session_state["busca_pagina"]
+    try:
+        pacientes, tem_proxima = memo("busca de pacientes", (termo, pagina),
+                                      lambda: _search_patients(termo, pagina))
+    except Exception as e:
+        st.error(f"Erro ao buscar pacientes: {e}")
+        return None
+
+    if not pacientes:
+        st.warning("Paciente não encontrado.")
+        return None
+
+    escolhido = st.selectbox(
+        "Pacientes encontrados", pacientes,
+        format_func=lambda p: f"{p['nome']} (nascimento: {p['data_de_nascimento']:%d/%m/%Y})")
+
+    col_anterior, col_pagina, col_proxima = st.columns([1, 2, 1])
+    if col_anterior.button("⬅️ Anterior", disabled=pagina == 0):
+        st.session_state["busca_pagina"] -= 1
+        st.rerun()
+    col_pagina.write(f"Página {pagina + 1}")
+    if col_proxima.button("Próxima ➡️", disabled=not tem_proxima):
+        st.session_state["busca_pagina"] += 1
+        st.rerun()
+
+    return escolhido["paciente_id"]
+
+
+def _displayed_class():
+    # O mapa explica a classe exibida, que pode vir de outro backend que não
+    # o modelo eager usado pelo Grad-CAM
+    resultado = st.session_state.get("resultado")
+    return CLASSES.index(resultado[0]) if resultado else None
+
+
+def show_image_with_heatmap(image):
+    """
+    Exibe a imagem da lesão e, se habilitado, o mapa Grad-CAM ao lado.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        Imagem BGR da lesão.
+    """
+    if not st.session_state.get("mostrar_gradcam"):
+        st.image(image, channels="BGR", width=300)
+        return
+
+    with span("gradcam"):
+        _, mapa = explain_image(image, _displayed_class())
+    col_imagem, col_mapa = st.columns(2)
+    col_imagem.image(image, channels="BGR", width=300)
+    col_mapa.image(mapa, channels="BGR", width=300,
+                   caption="Regiões que mais influenciaram a predição (Grad-CAM)")
+
+
+def _classify_capture(captured_image):
+    """Decodifica e classifica uma foto da câmera; memorizado pelo id e hash do arquivo."""
+    with span("decode"):
+        image = decode_upload(captured_image)
+    if image is None:
+        raise ValueError("arquivo não é uma imagem válida")
+    return image, classify_batch([image])[0]
+
+
+@section("Câmera")
+def camera_section():
+    """Captura, classificação e exibição da imagem, com o Grad-CAM opcional."""
+    # Botão para abrir/fechar câmera
+    if st.button("📷 Abrir/Fechar Câmera"):
+        st.session_state["camera_open"] = not st.session_state["camera_open"]
+
+    # Exibir câmera se estiver aberta
+    if st.session_state["camera_open"]:
+        captured_image = st.camera_input("Tire uma foto!")
+        if captured_image:
+            try:
+                captura = upload_key(captured_image)
+                image, predicao = memo("classificação", captura, lambda: _classify_capture(captured_image))
+            except Exception as e:
+                st.error(f"Erro ao processar a imagem: {e}")
+            else:
+                if st.session_state.get("captura") != captura:
+                    # Foto nova: ela substitui o paciente carregado e alimenta
+                    # os casos semelhantes, que são outro fragmento
+                    st.session_state["captura"] = captura
+                    st.session_state["image"] = image
+                    st.session_state["resultado"] = (predicao.label, predicao.probability)
+                    st.session_state["paciente_id"] = None
+                    st.session_state.pop("ficha_paciente", None)
+                    st.rerun()
+                show_prediction(predicao)
+
+    # Mostrar imagem capturada, com o mapa de calor ao lado se pedido
+    st.checkbox("🔥 Mostrar mapa de calor (Grad-CAM)", key="mostrar_gradcam")
+    if st.session_state["image"] is not None:
+        show_image_with_heatmap(st.session_state["image"])
+
+    # Botão para limpar
+    if st.button("❌ Limpar"):
+        st.session_state["image"] = None
+        st.session_state["resultado"] = None
+        st.session_state["paciente_id"] = None
+        st.session_state.pop("ficha_paciente", None)
+        forget("classificação", "casos semelhantes")
+        st.rerun()
+
+
+def _load_patient(paciente_id):
+    """
+    Carrega o cadastro, a imagem e a predição do paciente para o session_state.
+
+    Returns
+    -------
+    bool
+        Se o paciente foi encontrado.
+    """
+    session = get_session()
+    try:
+        query = text('''SELECT  PACIENTE_ID, NOME, DATA_DE_NASCIMENTO, ENDERECO, CEP, TELEFONE,
+                        TEMPO_COM_A_LESAO, HISTORICO_DIABETES, HISTORICO_CANCER,
+                        ANTI_INFLAMATORIO_SEM_EFEITO, MINIATURA_HASH, ENTRADA_MODELO_HASH
+                        FROM PACIENTE
+                        WHERE PACIENTE_ID = :paciente_id''')
+        result = session.execute(query, {"paciente_id": paciente_id}).mappings().fetchone()
+        if not result:
+            return False
+        store = get_store()
+        image = model_input_from_bytes(store.get(result["entrada_modelo_hash"]))
+
+        # Usa a predição gravada no cadastro; só reclassifica se o modelo mudou
+        predicao = load_prediction(session, result["paciente_id"])
+        if predicao is None:
+            predicao = classify_batch([image])[0]
+            record("classificação")
+            save_prediction(session, result["paciente_id"], predicao)
+            session.commit()
+    finally:
+        session.close()
+
+    st.session_state["paciente_id"] = result["paciente_id"]
+    st.session_state["image"] = image
+    st.session_state["resultado"] = (predicao.label, predicao.probability)
+    st.session_state["ficha_paciente"] = {
+        "dados": {key: value for key, value in result.items()
+                  if key not in ("paciente_id", "miniatura_hash", "entrada_modelo_hash")},
+        "miniatura": store.get(result["miniatura_hash"]),
+        "predicao": predicao,
+    }
+    forget("casos semelhantes")
+    return True
+
+
+@section("Paciente")
+def patient_section():
+    """Busca do paciente e exibição do cadastro e da predição gravada."""
+    # Busca do paciente por trecho do nome, com paginação
+    paciente_id = patient_search()
+    if paciente_id is not None and st.button("🔍 Informações do Paciente"):
+        try:
+            encontrado = _load_patient(paciente_id)
+        except Exception as e:
+            st.error(f"Erro ao obter dados do paciente: {e}")
+        else:
+            if not encontrado:
+                st.warning("Paciente não encontrado.")
+            else:
+                # A imagem do paciente alimenta a câmera e os casos
+                # semelhantes, que são outros fragmentos: rerun da página
+                st.rerun()
+
+    ficha = st.session_state.get("ficha_paciente")
+    if ficha is not None:
+        st.table([ficha["dados"]])
+        st.image(ficha["miniatura"], caption="Imagem da Lesão registrada em nosso sistema")
+        show_prediction(ficha["predicao"])
+        if st.session_state["mostrar_gradcam"]:
+            with span("gradcam"):
+                _, mapa = explain_image(st.session_state["image"], ficha["predicao"].index)
+            st.image(mapa, channels="BGR", use_container_width=True,
+                     caption="Regiões que mais influenciaram a predição (Grad-CAM)")
+
+
+def _similar_cases(image, exclude):
+    session = get_session()
+    try:
+        with span("similar_cases"):
+            embeddings = embed_images([image])
+            return find_similar_cases(session, embeddings[0], k=5, exclude=exclude)
+    finally:
+        session.close()
+
+
+@section("Casos semelhantes")
+def similar_cases_section():
+    """Casos anteriores mais parecidos com a imagem atual, memorizados pela imagem."""
+    if st.session_state["image"] is not None and st.button("🧬 Casos semelhantes"):
+        try:
+            exclude = [st.session_state["paciente_id"]] if st.session_state.get("paciente_id") else []
+            image = st.session_state["image"]
+            casos = memo("casos semelhantes", (image_hash(image), tuple(exclude)),
+                         lambda: _similar_cases(image, exclude))
+            if casos:
+                st.subheader("Casos semelhantes registrados")
+                st.table(casos)
+            else:
+                st.info("Nenhum caso semelhante encontrado.")
+        except Exception as e:
+            st.error(f"Erro ao buscar casos semelhantes: {e}")
+
+
 def medico_area():
     """
     Página principal da área do médico.
@@ -148,6 +409,11 @@ def medico_area():
     Essa página permite que o médico cadastre pacientes, visualize as informações
     do paciente e faça upload de imagens para análise.
 
+    Câmera, busca de paciente e casos semelhantes são fragmentos
+    independentes (``utils.rerun``): interagir com um não refaz os outros.
+    Quando a imagem atual muda (foto nova, paciente carregado ou limpeza), a
+    seção que a mudou pede um rerun da página, pois as demais dependem dela.
+
     Parameters
     ----------
     None
@@ -156,13 +422,14 @@ def medico_area():
     -------
     None
     """
-    if "medico_logged_in" not in st.session_state or not st.session_state["medico_logged_in"]:
+    user = current_user("medico")
+    if user is None:
         if "show_register" in st.session_state and st.session_state["show_register"]:
             medico_register()
         else:
             medico_login()
     else:
-        st.success(f"Bem-vindo, Dr(a). {st.session_state['medico_user']['nome']}!")
+        st.success(f"Bem-vindo, Dr(a). {user.nome}!")
         st.write("Agora você pode melhorar a qualidade de vida dos pacientes!")
 
         # Inicializa estados no session_state
@@ -173,57 +440,6 @@ def medico_area():
         if "camera_open" not in st.session_state:
             st.session_state["camera_open"] = False
 
-        # Botão para abrir/fechar câmera
-        if st.button("📷 Abrir/Fechar Câmera"):
-            st.session_state["camera_open"] = not st.session_state["camera_open"]
-            st.rerun()
-
-        # Exibir câmera se estiver aberta
-        if st.session_state["camera_open"]:
-            captured_image = st.camera_input("Tire uma foto!")
-            if captured_image:
-                try:
-                    file_bytes = np.asarray(bytearray(captured_image.read()), dtype=np.uint8)
-                    st.session_state["image"] = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-                    resultado = classify_image(st.session_state["image"])
-                    st.session_state["resultado"] = resultado
-                except Exception as e:
-                    st.error(f"Erro ao processar a imagem: {e}")
-
-        # Mostrar imagem capturada
-        if st.session_state["image"] is not None:
-            st.image(st.session_state["image"], channels="BGR", width=300)
-
-        # Botão para limpar
-        if st.button("❌ Limpar"):
-            st.session_state["image"] = None
-            st.session_state["resultado"] = None
-            st.rerun()
-
-        # Entrada e busca de informações do paciente
-        paciente_name = st.text_input("Nome do Paciente")
-        if st.button("🔍 Informações do Paciente"):
-            session = Session()
-            try:
-                query = text('''SELECT  NOME, DATA_DE_NASCIMENTO, ENDERECO, CEP, TELEFONE,
-                                TEMPO_COM_A_LESAO, HISTORICO_DIABETES, HISTORICO_CANCER,
-                                ANTI_INFLAMATORIO_SEM_EFEITO, IMAGEM_LESAO
-                                FROM PACIENTE
-                                WHERE NOME = :nome''')
-                result = session.execute(query, {"nome": paciente_name}).mappings().fetchone()
-                if result:
-                    dados_paciente = {key: value for key, value in result.items() if key != "imagem_lesao"}
-                    st.table([dados_paciente])
-                    imagem_lesao_bytes = result["imagem_lesao"]
-                    imagem_lesao = Image.open(io.BytesIO(imagem_lesao_bytes))
-                    st.image(imagem_lesao, caption="Imagem da Lesão registrada em nosso sistema", use_container_width=True)
-                    file_bytes = np.asarray(bytearray(imagem_lesao_bytes), dtype=np.uint8)
-                    st.session_state["image"] = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-                    classificacao = classify_image(st.session_state["image"])
-                    st.session_state["resultado"] = classificacao
-                else:
-                    st.warning("Paciente não encontrado.")
-            except Exception as e:
-                st.error(f"Erro ao obter dados do paciente: {e}")
-            finally:
-                session.close()
+        camera_section()
+        patient_section()
+        similar_cases_section()
@@ -0,0 +1,155 @@
+"""
+Migrações versionadas do banco e checagem dos planos das consultas críticas.
+
+Os arquivos ``sql/migrations/NNNN_nome.sql`` são aplicados em ordem, cada um
+na sua transação, e registrados na tabela SCHEMA_MIGRATIONS. Bancos novos
+partem dos scripts ``sql/create_db_*.sql``; as migrações são idempotentes e
+também podem ser aplicadas sobre eles.
+
+Uso::
+
+    python -m utils.migrations            # aplica as pendentes
+    python -m utils.migrations --status   # lista aplicadas e pendentes
+    python -m utils.migrations --explain  # confere que as consultas usam índices
+"""
+import argparse
+import json
+import os
+import re
+
+from sqlalchemy import text
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'sql', 'migrations')
+_MIGRATION_FILE = re.compile(r"^(\d{4})_[\w-]+\.sql$")
+
+# Consultas críticas, com parâmetros de exemplo e a tabela que deve ser lida por índice
+HOT_QUERIES = {
+    # Mesma forma da consulta de ``utils.auth.authenticate``
+    "login_paciente": ("SELECT PACIENTE_ID AS id, NOME AS nome, SENHA AS senha FROM PACIENTE WHERE NOME = :nome",
+                       {"nome": "exemplo"}, "paciente"),
+    "login_medico": ("SELECT MEDICO_ID AS id, NOME AS nome, SENHA AS senha FROM MEDICO WHERE NOME = :nome",
+                     {"nome": "exemplo"}, "medico"),
+    "login_acs": ("SELECT ACS_ID AS id, NOME AS nome, SENHA AS senha FROM AGENTE_COMUNITARIO WHERE NOME = :nome",
+                  {"nome": "exemplo"}, "agente_comunitario"),
+    "busca_paciente_trecho": ("SELECT PACIENTE_ID FROM PACIENTE "
+                              "WHERE F_UNACCENT(LOWER(NOME)) LIKE F_UNACCENT(LOWER(:padrao))",
+                              {"padrao": "%joao%"}, "paciente"),
+    "predicao_paciente": ("SELECT * FROM PREDICAO WHERE PACIENTE_ID = :paciente_id",
+                          {"paciente_id": 1}, "predicao"),
+}
+
+
+def available_migrations(directory=MIGRATIONS_DIR):
+    """Retorna ``[(versão, caminho)]`` das migrações, em ordem."""
+    migrations = []
+    for name in sorted(os.listdir(directory)):
+        match = _MIGRATION_FILE.match(name)
+        if match:
+            migrations.append((name[:-len(".sql")], os.path.join(directory, name)))
+    return migrations
+
+
+def applied_migrations(conn):
+    """Retorna as versões já aplicadas (criando a tabela de controle se preciso)."""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS SCHEMA_MIGRATIONS (
+            VERSION VARCHAR(255) PRIMARY KEY,
+            APPLIED_AT TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """))
+    return {row[0] for row in conn.execute(text("SELECT VERSION FROM SCHEMA_MIGRATIONS"))}
+
+
+def migrate(engine, directory=MIGRATIONS_DIR):
+    """
+    Aplica as migrações pendentes, cada uma na sua transação.
+
+    Returns
+    -------
+    list of str
+        Versões aplicadas nesta execução.
+    """
+    with engine.begin() as conn:
+        done = applied_migrations(conn)
+
+    applied = []
+    for version, path in available_migrations(directory):
+        if version in done:
+            continue
+        with open(path, encoding="utf-8") as f:
+            sql = f.read()
+        with engine.begin() as conn:
+            conn.exec_driver_sql(sql)
+            conn.execute(text("INSERT INTO SCHEMA_MIGRATIONS (VERSION) VALUES (:version)"),
+                         {"version": version})
+        applied.append(version)
+        print(f"Migração aplicada: {version}")
+    return applied
+
+
+def _scanned_tables(plan, scans=None):
+    """Percorre o plano JSON e coleta ``(tipo de nó, tabela)`` dos nós de leitura."""
+    scans = [] if scans is None else scans
+    if "Relation Name" in plan:
+        scans.append((plan["Node Type"], plan["Relation Name"].lower()))
+    for child in plan.get("Plans", []):
+        _scanned_tables(child, scans)
+    return scans
+
+
+def check_query_plans(engine, queries=HOT_QUERIES):
+    """
+    Roda ``EXPLAIN`` nas consultas críticas e confere que usam índices.
+
+    Em tabelas pequenas o planejador prefere varredura sequencial mesmo com
+    índice disponível; por isso a checagem desliga ``enable_seqscan`` dentro
+    da transação, o que responde se existe um índice utilizável.
+
+    Returns
+    -------
+    dict
+        Por consulta: nós de leitura do plano e se a tabela-alvo é lida por índice.
+    """
+    report = {}
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(text("SET LOCAL enable_seqscan = off"))
+            for name, (sql, params, table) in queries.items():
+                plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar_one()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                scans = _scanned_tables(plan[0]["Plan"])
+                report[name] = {
+                    "scans": [f"{node} on {relation}" for node, relation in scans],
+                    "uses_index": all(node != "Seq Scan" for node, relation in scans if relation == table),
+                }
+    return report
+
+
+def main():
+    from utils.db import get_engine
+
+    parser = argparse.ArgumentParser(description="Migrações versionadas do banco.")
+    parser.add_argument("--status", action="store_true", help="Lista migrações aplicadas e pendentes.")
+    parser.add_argument("--explain", action="store_true", help="Confere os planos das consultas críticas.")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    if args.status:
+        with engine.begin() as conn:
+            done = applied_migrations(conn)
+        for version, _ in available_migrations():
+            print(f"[{'x' if version in done else ' '}] {version}")
+    elif args.explain:
+        report = check_query_plans(engine)
+        print(json.dumps(report, indent=2))
+        missing = [name for name, result in report.items() if not result["uses_index"]]
+        if missing:
+            raise SystemExit(f"Consultas sem índice: {', '.join(missing)}")
+    else:
+        migrate(engine)
+
+
+if __name__ == "__main__":
+    main()
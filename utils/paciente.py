@@ -1,54 +1,58 @@
+import logging
 import os
 import time
-import bcrypt
 import streamlit as st
-from dotenv import load_dotenv
-import cv2
-import numpy as np
-from utils.classifier import classify_image
+from utils.auth import AuthBusy, authenticate, current_user, hash_password, login
+from utils.db import get_session
+from utils.geocoding import get_geocoder
+from utils.places import nearby_place_ids, place_details
+from utils.estabelecimentos import find_nearby_facilities
+from utils.classifier import classify_batch, show_prediction
+from utils.predicao import save_prediction
+from utils.blobstore import get_store
+from utils.ingest import InvalidImage, ingest_image
+from utils.preprocess import decode_upload
+from utils.rerun import forget, memo, section, upload_key
+from utils.similarity import classify_and_embed, index_embeddings, save_embedding
+from utils.tracing import span
 from datetime import datetime
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 import folium
 from streamlit_folium import st_folium
 import googlemaps
+from dotenv import load_dotenv
 
 load_dotenv()
 
-# Obtendo os valores das variáveis de ambiente
-host = os.getenv('DB_HOST', 'localhost')
-port = os.getenv('DB_PORT', 5432)
-database = os.getenv('DB_DATABASE', 'LeisHticIA_gold')
-user = os.getenv('DB_USER', 'postgres')
-password = os.environ.get("PG_PASSWORD")
+logger = logging.getLogger(__name__)
 
-# Configuração da API do Google Maps
-gmaps = googlemaps.Client(key=os.getenv('GOOGLE_MAPS_API_KEY'))
-
-# Configurando a conexão com o banco de dados usando SQLAlchemy
-DATABASE_URL = f"postgresql://{user}:{password}@{host}:{port}/{database}"
+# Origem da busca de hospitais: "google" (Places) ou "local" (índice do CNES)
+HOSPITAL_SEARCH = os.getenv('HOSPITAL_SEARCH', 'google')
 
 
+# Configuração da API do Google Maps
 @st.cache_resource
-def get_engine():
+def get_gmaps():
     """
-    Retorna o engine do SQLAlchemy para conexão com o banco de dados.
+    Retorna o cliente da API do Google Maps, criado apenas no primeiro uso.
     """
-    return create_engine(DATABASE_URL)
-
-
-# Inicializando o SessionMaker
-engine = get_engine()
-Session = sessionmaker(bind=engine)
+    return googlemaps.Client(key=os.getenv('GOOGLE_MAPS_API_KEY'))
 
 
 # Funções auxiliares locais
-def get_location_from_address(address):
-    """Converte um endereço em coordenadas geográficas (latitude, longitude)."""
-    geocode_result = gmaps.geocode(address)
-    if geocode_result:
-        location = geocode_result[0]['geometry']['location']
-        return location['lat'], location['lng']
+def get_location_from_address(address, cep=None):
+    """
+    Converte um endereço em coordenadas geográficas (latitude, longitude).
+
+    Usa o geocodificador com cache (``utils.geocoding``): reruns e endereços
+    já consultados não chamam a API, e sem rede é usado o centroide do CEP
+    informado (o do cadastro) ou, na falta dele, do CEP digitado no endereço.
+    """
+    with span("geocoding"):
+        location = get_geocoder().locate(address, cep)
+    if location:
+        return location.lat, location.lng
     return None, None
 
 
@@ -76,49 +80,66 @@ def format_hours(hours):
     return hours
 
 
+def _parse_place(result):
+    """Converte os detalhes de um lugar na tupla exibida, com o horário já traduzido."""
+    name = result.get('name', 'Nome não disponível')
+    address = result.get('vicinity', 'Endereço não disponível')
+    rating = result.get('rating', 'N/A')
+    location = result['geometry']['location']
+
+    # Obtém o horário de funcionamento
+    opening_hours = result.get('opening_hours', {})
+    if opening_hours:
+        hours = opening_hours.get('weekday_text', ['Horário não disponível'])
+        # Traduz os dias da semana e formata o horário
+        hours_pt_br = []
+        for day in hours:
+            if ":" in day:  # Verifica se é um dia com horário
+                day_name, time = day.split(":", 1)
+                day_name = days_translation.get(day_name.strip(), day_name.strip())
+                time = format_hours(time.strip())
+                hours_pt_br.append(f"{day_name}: {time}")
+            else:
+                hours_pt_br.append(day)
+    else:
+        hours_pt_br = ['Horário não disponível']
+
+    return (name, address, rating, location['lat'], location['lng'], hours_pt_br)
+
+
 def find_nearby_hospitals(latitude, longitude, radius=5000):
-    """Encontra hospitais próximos à localização fornecida, especializados em feridas e edemas."""
-    # Palavras-chave para filtrar hospitais especializados
-    keyword = "tratamento de feridas, tratamento de edemas, tratamento de cancer, tratamento de diabetes"
-
-    # Realiza a busca na API do Google Places
-    places_result = gmaps.places_nearby(
-        location=(latitude, longitude),
-        radius=radius,
-        type='hospital',
-        keyword=keyword  # Filtra por palavras-chave
-    )
-
-    hospitals = []
-    for place in places_result.get('results', []):
-        # Obtém detalhes adicionais do lugar, incluindo o horário de funcionamento
-        place_details = gmaps.place(place['place_id'], fields=["name", "vicinity", "rating", "geometry", "opening_hours"])
-
-        name = place_details['result'].get('name', 'Nome não disponível')
-        address = place_details['result'].get('vicinity', 'Endereço não disponível')
-        rating = place_details['result'].get('rating', 'N/A')
-        location = place_details['result']['geometry']['location']
-        
-        # Obtém o horário de funcionamento
-        opening_hours = place_details['result'].get('opening_hours', {})
-        if opening_hours:
-            hours = opening_hours.get('weekday_text', ['Horário não disponível'])
-            # Traduz os dias da semana e formata o horário
-            hours_pt_br = []
-            for day in hours:
-                if ":" in day:  # Verifica se é um dia com horário
-                    day_name, time = day.split(":", 1)
-                    day_name = days_translation.get(day_name.strip(), day_name.strip())
-                    time = format_hours(time.strip())
-                    hours_pt_br.append(f"{day_name}: {time}")
-                else:
-                    hours_pt_br.append(day)
-        else:
-            hours_pt_br = ['Horário não disponível']
+    """
+    Encontra hospitais próximos à localização fornecida, especializados em feridas e edemas.
+
+    A busca é guardada por célula de ~1 km e os detalhes de cada hospital por
+    ``place_id`` (``utils.places``); os detalhes que faltam são buscados em
+    paralelo, em vez de uma chamada por vez.
+
+    Com ``HOSPITAL_SEARCH=local``, ou se a API falhar (sem rede, cota), usa o
+    índice local de estabelecimentos do CNES (``utils.estabelecimentos``).
+
+    Raises
+    ------
+    Exception
+        Se o índice local também falhar. A falha não é convertida em lista
+        vazia, para que não seja memorizada como "nenhum hospital".
+    """
+    if HOSPITAL_SEARCH != "local":
+        # Palavras-chave para filtrar hospitais especializados
+        keyword = "tratamento de feridas, tratamento de edemas, tratamento de cancer, tratamento de diabetes"
+        try:
+            gmaps = get_gmaps()
+            with span("places_nearby"):
+                place_ids = nearby_place_ids(gmaps, latitude, longitude, radius, type='hospital', keyword=keyword)
+            with span("place_details"):
+                return place_details(gmaps, place_ids, _parse_place)
+        except Exception as e:
+            logger.warning("Google Places indisponível (%s); usando o índice local.", e)
 
-        hospitals.append((name, address, rating, location['lat'], location['lng'], hours_pt_br))
-    
-    return hospitals
+    # Sem a importação do CNES (``python -m utils.estabelecimentos --import``)
+    # o índice local também falha
+    with span("facility_search"):
+        return find_nearby_facilities(latitude, longitude, radius)
 
 
 # Página de login para o paciente
@@ -146,24 +167,18 @@ def patient_login():
     register_button = st.button("Cadastrar-se")
 
     if login_button:
-        session = Session()
+        session = get_session()
         try:
-            query = text("SELECT * FROM PACIENTE WHERE NOME = :username")
-            result = session.execute(
-                query, {"username": username}).mappings().fetchone()
-
-            # Converte a senha armazenada para bytes, se necessário
-            stored_password = result["senha"]
-            stored_password = bytes(stored_password)
-
-            if result and bcrypt.checkpw(password.encode('utf-8'), stored_password):
+            user = authenticate(session, "paciente", username, password)
+            if user:
+                login(user)
                 st.success("Login realizado com sucesso!")
-                st.session_state["logged_in"] = True
-                st.session_state["user"] = result
-
+                st.rerun()
             else:
                 st.error(
                     "Usuário ou senha inválidos! Já é cadastrado em nosso sistema? Se não, cadastre-se!")
+        except AuthBusy:
+            st.warning("Muitos acessos no momento. Tente novamente em alguns segundos.")
         except Exception as e:
             st.error(f"Erro ao conectar ao banco de dados: {e}")
         finally:
@@ -175,7 +190,7 @@ def patient_login():
 
 
 # Página de cadastro
-def register():
+def register(fila=None, acs_id=None):
     """
     Fun o que permite o cadastro de pacientes.
 
@@ -184,7 +199,11 @@ def register():
 
     Parameters
     ----------
-    None
+    fila : CaptureQueue, optional
+        Se informada (ACS sem conexão), o cadastro vai para a fila offline do
+        aparelho em vez do banco; é sincronizado quando a conexão voltar.
+    acs_id : int, optional
+        ACS que fez o cadastro, registrado na fila offline.
 
     Returns
     -------
@@ -224,27 +243,60 @@ def register():
                 return
 
             try:
-                datetime.strptime(data_nascimento, "%d/%m/%Y")
+                nascimento = datetime.strptime(data_nascimento, "%d/%m/%Y").date()
             except ValueError:
                 st.error("Data de nascimento inválida. Use o formato DD/MM/AAAA.")
                 return
 
+            # Classifica a lesão uma única vez, no momento do cadastro
+            try:
+                imagem = ingest_image(st.session_state.imagem_bytes)
+            except InvalidImage as e:
+                st.error(f"Imagem inválida: {e}")
+                return
+            predicoes, embeddings = classify_and_embed([imagem.model_input])
+            predicao = predicoes[0]
+
             # Gera o hash da senha
-            hashed_password = bcrypt.hashpw(senha.encode('utf-8'), bcrypt.gensalt(12))
-            session = Session()
+            try:
+                hashed_password = hash_password(senha)
+            except AuthBusy:
+                st.warning("Muitos acessos no momento. Tente novamente em alguns segundos.")
+                return
+
+            if fila is not None:
+                fila.enqueue({
+                    "nome": nome,
+                    "data_nascimento": nascimento,
+                    "endereco": endereco,
+                    "cep": cep,
+                    "telefone": telefone,
+                    "tempo_lesao": tempo_lesao,
+                    "historico_diabetes": historico_diabetes == "Sim",
+                    "historico_cancer": historico_cancer == "Sim",
+                    "anti_inflamatorio": anti_inflamatorio == "Sim",
+                }, hashed_password, imagem, predicao, embeddings[0], acs_id=acs_id)
+                st.session_state.imagem_bytes = None
+                st.success(f"Cadastro salvo no aparelho ({predicao.label}). "
+                           "Ele será enviado ao banco quando a conexão voltar.")
+                return
+
+            session = get_session()
+            store = get_store()
 
             try:
                 query = text("""
                 INSERT INTO PACIENTE
                 (NOME, SENHA, DATA_DE_NASCIMENTO, ENDERECO, CEP, TELEFONE,
                 TEMPO_COM_A_LESAO, HISTORICO_DIABETES, HISTORICO_CANCER,
-                ANTI_INFLAMATORIO_SEM_EFEITO, IMAGEM_LESAO)
+                ANTI_INFLAMATORIO_SEM_EFEITO, IMAGEM_HASH, MINIATURA_HASH, ENTRADA_MODELO_HASH)
                 VALUES
                 (:nome, :senha, :data_nascimento, :endereco, :cep, :telefone,
                 :tempo_lesao, :historico_diabetes, :historico_cancer,
-                :anti_inflamatorio, :imagem_lesao)
+                :anti_inflamatorio, :imagem_hash, :miniatura_hash, :entrada_modelo_hash)
+                RETURNING PACIENTE_ID
                 """)
-                session.execute(query, {
+                paciente_id = session.execute(query, {
                     "nome": nome,
                     "senha": hashed_password,  # Armazena o hash como bytes
                     "data_nascimento": data_nascimento,
@@ -255,19 +307,158 @@ def register():
                     "historico_diabetes": historico_diabetes == "Sim",
                     "historico_cancer": historico_cancer == "Sim",
                     "anti_inflamatorio": anti_inflamatorio == "Sim",
-                    "imagem_lesao": st.session_state.imagem_bytes
-                })
+                    "imagem_hash": store.put(imagem.canonical),
+                    "miniatura_hash": store.put(imagem.thumbnail),
+                    "entrada_modelo_hash": store.put(imagem.model_input_bytes)
+                }).scalar_one()
+                save_prediction(session, paciente_id, predicao)
+                save_embedding(session, paciente_id, embeddings[0])
                 session.commit()
-                st.success("Paciente cadastrado com sucesso!")
-                time.sleep(2)
-                st.session_state["show_register"] = False
-                st.rerun()
+            except IntegrityError:
+                st.error("Já existe um cadastro com esse nome. Escolha outro nome de usuário.")
+                session.rollback()
+                return
             except Exception as e:
                 st.error(f"Erro ao inserir dados no banco: {e}")
                 session.rollback()
+                return
             finally:
                 session.close()
 
+            # O cadastro já está salvo: falhas no índice só vão para o log
+            index_embeddings([paciente_id], embeddings[:1])
+            st.success("Paciente cadastrado com sucesso!")
+            time.sleep(2)
+            st.session_state["show_register"] = False
+            st.rerun()
+
+
+def _classify_upload(uploaded_image):
+    """Decodifica e classifica um upload; memorizado pelo id e hash do arquivo."""
+    with span("decode"):
+        image = decode_upload(uploaded_image)
+    if image is None:
+        raise ValueError("arquivo não é uma imagem válida")
+    return image, classify_batch([image])[0]
+
+
+@section("Análise da imagem")
+def image_section():
+    """Upload e classificação da imagem; outros widgets da página não a reexecutam."""
+    st.write("Faça upload de uma imagem para análise:")
+
+    # Garantir que a variável de imagem esteja no session state
+    if "image" not in st.session_state:
+        st.session_state["image"] = None
+    if "resultado" not in st.session_state:
+        st.session_state["resultado"] = None
+
+    # Exibir o upload de imagem logo após o login
+    uploaded_image = st.file_uploader(
+        "Escolha uma imagem", type=["jpg", "jpeg", "png"])
+
+    if uploaded_image is not None:
+        try:
+            # Processar a imagem enviada
+            image, predicao = memo("classificação", upload_key(uploaded_image),
+                                   lambda: _classify_upload(uploaded_image))
+            st.session_state["image"] = image
+            show_prediction(predicao)
+            st.session_state["resultado"] = (predicao.label, predicao.probability)
+        except Exception as e:
+            st.error(f"Erro ao processar a imagem: {e}")
+
+    if st.session_state["image"] is not None:
+        st.image(st.session_state["image"], channels="BGR", width=300)
+
+        if st.button("Limpar"):
+            st.session_state["image"] = None
+            st.session_state["resultado"] = None
+            forget("classificação")
+            st.rerun()
+
+    if st.session_state["image"] is None:
+        st.info("Faça o upload de uma imagem de alta qualidade da lesão para classificá-la.")
+
+
+def _build_map(latitude, longitude, hospitals):
+    # Criar um mapa centrado na localização do paciente
+    m = folium.Map(location=[latitude, longitude], zoom_start=13)
+
+    # Adicionar marcador para a localização do paciente
+    folium.Marker(
+        location=[latitude, longitude],
+        popup="Sua Localização",
+        icon=folium.Icon(color="blue")
+    ).add_to(m)
+
+    # Adicionar marcadores para os hospitais
+    for hospital in hospitals:
+        folium.Marker(
+            location=[hospital[3], hospital[4]],
+            popup=f"{hospital[0]} - Avaliação: {hospital[2]}",
+            icon=folium.Icon(color="red")
+        ).add_to(m)
+    return m
+
+
+def _patient_cep(paciente_id):
+    """CEP do cadastro do paciente, para o fallback da geocodificação."""
+    session = get_session()
+    try:
+        return session.execute(text("SELECT CEP FROM PACIENTE WHERE PACIENTE_ID = :paciente_id"),
+                               {"paciente_id": paciente_id}).scalar_one_or_none()
+    except Exception as e:
+        logger.warning("CEP do paciente %s indisponível: %s", paciente_id, e)
+        return None
+    finally:
+        session.close()
+
+
+@section("Hospitais próximos")
+def hospitals_section(paciente_id):
+    """Geocodificação, busca de hospitais e mapa, memorizados pelo endereço."""
+    # Coletar localização do paciente
+    st.subheader("Localização do Paciente")
+    patient_address = st.text_input("Digite seu endereço para encontrar hospitais próximos:")
+
+    if patient_address:
+        cep = memo("CEP do paciente", paciente_id, lambda: _patient_cep(paciente_id))
+        latitude, longitude = memo("geocodificação", (patient_address, cep),
+                                   lambda: get_location_from_address(patient_address, cep))
+        if latitude and longitude:
+            st.write(f"Coordenadas: Latitude {latitude}, Longitude {longitude}")
+            # Uma busca que falhou não é memorizada: o próximo rerun tenta de novo
+            try:
+                hospitals = memo("busca de hospitais", (latitude, longitude),
+                                 lambda: find_nearby_hospitals(latitude, longitude))
+            except Exception as e:
+                logger.warning("Índice local de estabelecimentos indisponível: %s", e)
+                st.error("Não foi possível buscar hospitais no momento. Tente novamente mais tarde.")
+                return
+            if hospitals:
+                st.subheader("Hospitais Especializados Próximos:")
+
+                # Exibir o mapa no Streamlit; interações com o mapa não
+                # disparam reruns
+                with span("map_render"):
+                    m = memo("mapa", (latitude, longitude), lambda: _build_map(latitude, longitude, hospitals))
+                    st_folium(m, width=700, height=500, returned_objects=[])
+
+                # Exibir detalhes dos hospitais
+                for hospital in hospitals:
+                    st.write(f"Nome: {hospital[0]}")
+                    st.write(f"Endereço: {hospital[1]}")
+                    st.write(f"Avaliação: {hospital[2]}")
+                    st.write("Horário de Funcionamento:")
+                    for day in hospital[5]:  # hospital[5] contém o horário de funcionamento
+                        st.write(f"- {day}")
+                    st.write("---")
+            else:
+                st.warning("Nenhum hospital especializado encontrado nas proximidades.")
+        else:
+            st.error("Não foi possível encontrar a localização. Verifique o endereço e tente novamente.")
+
 
 # Página principal da área do paciente
 def patient_area():
@@ -278,6 +469,10 @@ def patient_area():
     os resultados. Além disso, também permite que o paciente informe seu endereço e visualize
     hospitais especializados próximos.
 
+    A análise da imagem e a busca de hospitais são fragmentos independentes
+    (``utils.rerun``): digitar o endereço não reclassifica a imagem, e enviar
+    outra imagem não refaz a busca de hospitais.
+
     Parameters
     ----------
     None
@@ -286,92 +481,16 @@ def patient_area():
     -------
     None
     """
-    if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
+    user = current_user("paciente")
+    if user is None:
         if "show_register" in st.session_state and st.session_state["show_register"]:
             register()
         else:
             patient_login()
     else:
-        st.subheader(f"Bem-vindo, {st.session_state['user']['nome']}!")
-        st.write("Faça upload de uma imagem para análise:")
-
-        # Garantir que a variável de imagem esteja no session state
-        if "image" not in st.session_state:
-            st.session_state["image"] = None
-        if "resultado" not in st.session_state:
-            st.session_state["resultado"] = None
-
-        # Exibir o upload de imagem logo após o login
-        uploaded_image = st.file_uploader(
-            "Escolha uma imagem", type=["jpg", "jpeg", "png"])
-
-        if uploaded_image is not None:
-            try:
-                # Processar a imagem enviada
-                file_bytes = np.asarray(bytearray(uploaded_image.read()), dtype=np.uint8)
-                st.session_state["image"] = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-                resultado = classify_image(st.session_state["image"])
-                st.session_state["resultado"] = resultado
-            except Exception as e:
-                st.error(f"Erro ao processar a imagem: {e}")
-
-        if st.session_state["image"] is not None:
-            st.image(st.session_state["image"], channels="BGR", width=300)
-
-            if st.button("Limpar"):
-                st.session_state["image"] = None
-                st.session_state["resultado"] = None
-                st.rerun()
-
-        if st.session_state["image"] is None:
-            st.info("Faça o upload de uma imagem de alta qualidade da lesão para classificá-la.")
-
-        # Coletar localização do paciente
-        st.subheader("Localização do Paciente")
-        patient_address = st.text_input("Digite seu endereço para encontrar hospitais próximos:")
-
-        if patient_address:
-            latitude, longitude = get_location_from_address(patient_address)
-            if latitude and longitude:
-                st.write(f"Coordenadas: Latitude {latitude}, Longitude {longitude}")
-                hospitals = find_nearby_hospitals(latitude, longitude)
-                if hospitals:
-                    st.subheader("Hospitais Especializados Próximos:")
-
-                    # Criar um mapa centrado na localização do paciente
-                    m = folium.Map(location=[latitude, longitude], zoom_start=13)
-
-                    # Adicionar marcador para a localização do paciente
-                    folium.Marker(
-                        location=[latitude, longitude],
-                        popup="Sua Localização",
-                        icon=folium.Icon(color="blue")
-                    ).add_to(m)
-
-                    # Adicionar marcadores para os hospitais
-                    for hospital in hospitals:
-                        folium.Marker(
-                            location=[hospital[3], hospital[4]],
-                            popup=f"{hospital[0]} - Avaliação: {hospital[2]}",
-                            icon=folium.Icon(color="red")
-                        ).add_to(m)
-
-                    # Exibir o mapa no Streamlit
-                    st_folium(m, width=700, height=500)
-
-                    # Exibir detalhes dos hospitais
-                    for hospital in hospitals:
-                        st.write(f"Nome: {hospital[0]}")
-                        st.write(f"Endereço: {hospital[1]}")
-                        st.write(f"Avaliação: {hospital[2]}")
-                        st.write("Horário de Funcionamento:")
-                        for day in hospital[5]:  # hospital[5] contém o horário de funcionamento
-                            st.write(f"- {day}")
-                        st.write("---")
-                else:
-                    st.warning("Nenhum hospital especializado encontrado nas proximidades.")
-            else:
-                st.error("Não foi possível encontrar a localização. Verifique o endereço e tente novamente.")
+        st.subheader(f"Bem-vindo, {user.nome}!")
+        image_section()
+        hospitals_section(user.id)
 
 
 # Executar o aplicativo
@@ -0,0 +1,170 @@
+"""
+Busca de hospitais próximos na API do Google Places, com cache e em paralelo.
+
+- a busca por proximidade é feita a partir do centro de uma célula de
+  ``NEARBY_CELL_DEG`` graus (~1 km), e o resultado é guardado por célula e
+  raio durante ``NEARBY_TTL_S``: buscas repetidas no mesmo bairro não
+  chamam a API;
+- os detalhes de cada lugar são buscados em paralelo num pool limitado de
+  ``PLACES_WORKERS`` threads, e guardados já formatados por ``place_id``
+  durante ``PLACE_DETAILS_TTL_S``, então o horário de funcionamento é
+  traduzido uma única vez por lugar.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from utils.tracing import add_collector
+
+logger = logging.getLogger(__name__)
+
+PLACES_WORKERS = int(os.getenv('PLACES_WORKERS', 8))
+PLACE_DETAILS_TTL_S = float(os.getenv('PLACE_DETAILS_TTL_S', 6 * 3600))
+NEARBY_TTL_S = float(os.getenv('NEARBY_TTL_S', 15 * 60))
+NEARBY_CELL_DEG = float(os.getenv('NEARBY_CELL_DEG', 0.01))
+PLACES_CACHE_SIZE = int(os.getenv('PLACES_CACHE_SIZE', 4096))
+
+DETAIL_FIELDS = ["name", "vicinity", "rating", "geometry", "opening_hours"]
+
+
+class TTLCache:
+    """
+    Cache LRU em memória com validade por entrada (thread-safe).
+
+    Parameters
+    ----------
+    maxsize : int
+        Número máximo de entradas.
+    ttl_s : float
+        Validade padrão das entradas, em segundos.
+    """
+
+    def __init__(self, maxsize, ttl_s):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Retorna o valor guardado, ou ``default`` se não existir ou tiver vencido."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, ttl_s=None):
+        """Guarda um valor, descartando o menos usado se o cache estiver cheio."""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl_s if ttl_s is None else ttl_s))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        """Retorna acertos, faltas, taxa de acerto e tamanho."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "taxa_acerto": self.hits / total if total else 0.0, "tamanho": len(self._data)}
+
+
+_nearby_cache = TTLCache(PLACES_CACHE_SIZE, NEARBY_TTL_S)
+_details_cache = TTLCache(PLACES_CACHE_SIZE, PLACE_DETAILS_TTL_S)
+
+
+@st.cache_resource(show_spinner=False)
+def _get_places_pool():
+    """Retorna o pool de threads das chamadas de detalhes de lugares."""
+    return ThreadPoolExecutor(max_workers=PLACES_WORKERS, thread_name_prefix="places")
+
+
+def cell_center(latitude, longitude, cell_deg=NEARBY_CELL_DEG):
+    """Retorna o centro da célula da grade que contém o ponto."""
+    return (round(latitude / cell_deg) * cell_deg, round(longitude / cell_deg) * cell_deg)
+
+
+def nearby_place_ids(gmaps, latitude, longitude, radius, **params):
+    """
+    Retorna os ``place_id`` da busca por proximidade, com cache por célula.
+
+    Parameters
+    ----------
+    gmaps : googlemaps.Client
+        Cliente da API.
+    latitude, longitude : float
+        Localização do paciente.
+    radius : int
+        Raio da busca, em metros.
+    **params
+        Demais parâmetros de ``places_nearby`` (``type``, ``keyword``).
+
+    Returns
+    -------
+    list of str
+    """
+    center = cell_center(latitude, longitude)
+    key = (round(center[0], 6), round(center[1], 6), radius, tuple(sorted(params.items())))
+    place_ids = _nearby_cache.get(key)
+    if place_ids is None:
+        result = gmaps.places_nearby(location=center, radius=radius, **params)
+        place_ids = [place['place_id'] for place in result.get('results', [])]
+        _nearby_cache.put(key, place_ids)
+    return place_ids
+
+
+def _fetch_detail(gmaps, place_id, parse):
+    result = gmaps.place(place_id, fields=DETAIL_FIELDS)['result']
+    return parse(result)
+
+
+def place_details(gmaps, place_ids, parse):
+    """
+    Busca os detalhes de vários lugares, em paralelo e com cache.
+
+    Parameters
+    ----------
+    gmaps : googlemaps.Client
+        Cliente da API.
+    place_ids : sequence of str
+        Lugares a detalhar.
+    parse : callable
+        Converte o ``result`` da API no valor guardado em cache.
+
+    Returns
+    -------
+    list
+        Os valores de ``parse``, na ordem de ``place_ids``. Lugares cuja
+        consulta falhou são omitidos.
+    """
+    details = {place_id: _details_cache.get(place_id) for place_id in place_ids}
+    missing = [place_id for place_id, detail in details.items() if detail is None]
+    if missing:
+        futures = {place_id: _get_places_pool().submit(_fetch_detail, gmaps, place_id, parse)
+                   for place_id in missing}
+        for place_id, future in futures.items():
+            try:
+                details[place_id] = future.result()
+            except Exception as e:
+                logger.warning("Falha ao buscar detalhes do lugar %s: %s", place_id, e)
+                continue
+            _details_cache.put(place_id, details[place_id])
+    return [details[place_id] for place_id in place_ids if details[place_id] is not None]
+
+
+def places_metrics():
+    """Taxas de acerto dos caches de busca por proximidade e de detalhes."""
+    return {"nearby": _nearby_cache.stats(), "details": _details_cache.stats()}
+
+
+add_collector("places", places_metrics)
@@ -0,0 +1,71 @@
+from sqlalchemy import text
+from utils.classifier import MODEL_VERSION, Prediction
+
+
+def save_prediction(session, paciente_id, prediction, model_version=MODEL_VERSION):
+    """
+    Grava (ou substitui) a predição de um paciente na tabela PREDICAO.
+
+    A função não faz commit: ela participa da transação do chamador, de modo
+    que o paciente e sua predição sejam gravados juntos.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Sessão aberta com o banco de dados.
+    paciente_id : int
+        Identificador do paciente.
+    prediction : Prediction
+        Predição retornada por ``classify_batch``.
+    model_version : str, optional
+        Versão do modelo que gerou a predição.
+    """
+    query = text("""
+        INSERT INTO PREDICAO
+        (PACIENTE_ID, VERSAO_MODELO, CLASSE, PROBABILIDADE, PROBABILIDADES)
+        VALUES
+        (:paciente_id, :versao_modelo, :classe, :probabilidade, :probabilidades)
+        ON CONFLICT (PACIENTE_ID) DO UPDATE SET
+            VERSAO_MODELO = EXCLUDED.VERSAO_MODELO,
+            CLASSE = EXCLUDED.CLASSE,
+            PROBABILIDADE = EXCLUDED.PROBABILIDADE,
+            PROBABILIDADES = EXCLUDED.PROBABILIDADES,
+            CRIADO_EM = NOW()
+    """)
+    session.execute(query, {
+        "paciente_id": paciente_id,
+        "versao_modelo": model_version,
+        "classe": prediction.label,
+        "probabilidade": prediction.probability,
+        "probabilidades": list(prediction.probabilities)
+    })
+
+
+def load_prediction(session, paciente_id, model_version=MODEL_VERSION):
+    """
+    Lê a predição armazenada de um paciente.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Sessão aberta com o banco de dados.
+    paciente_id : int
+        Identificador do paciente.
+    model_version : str, optional
+        Versão do modelo carregado. Predições de outras versões são ignoradas.
+
+    Returns
+    -------
+    Prediction or None
+        A predição armazenada, ou None se não existir ou estiver desatualizada.
+    """
+    query = text("""
+        SELECT VERSAO_MODELO, PROBABILIDADES
+        FROM PREDICAO
+        WHERE PACIENTE_ID = :paciente_id
+    """)
+    result = session.execute(query, {"paciente_id": paciente_id}).mappings().fetchone()
+    if result is None or result["versao_modelo"] != model_version:
+        return None
+    return Prediction.from_probabilities(result["probabilidades"])
+
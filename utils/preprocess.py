@@ -0,0 +1,186 @@
+"""
+Pré-processamento vetorizado das imagens de entrada do classificador.
+
+Substitui a cadeia ``cv2.cvtColor -> PIL -> Resize -> ToTensor -> Normalize``
+por um único passo: a imagem BGR é redimensionada com ``cv2.resize`` e a
+troca de canais e a normalização são feitas por NumPy diretamente num
+buffer float32 pré-alocado ``(N, 3, 224, 224)``, que vira tensor sem cópia.
+
+Para conferir a paridade numérica com a cadeia antiga::
+
+    python -m utils.preprocess dataset_classifier/test
+"""
+import io
+import os
+import sys
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+INPUT_SIZE = 224
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# Escala e deslocamento por canal, já na ordem BGR da imagem decodificada:
+# (x / 255 - mean) / std == x * scale + bias
+_SCALE = (1.0 / (255.0 * STD))[::-1].reshape(3, 1, 1).copy()
+_BIAS = (-MEAN / STD)[::-1].reshape(3, 1, 1).copy()
+
+# Menor lado mínimo após a decodificação reduzida (2x a entrada do modelo)
+MIN_DECODE_SIDE = int(os.getenv('MIN_DECODE_SIDE', 2 * INPUT_SIZE))
+_HEADER_BYTES = 256 * 1024
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def _image_size(buffer):
+    """Lê apenas o cabeçalho da imagem e retorna ``(largura, altura)`` ou None."""
+    try:
+        with Image.open(io.BytesIO(buffer[:_HEADER_BYTES])) as header:
+            return header.size
+    except Exception:
+        return None
+
+
+def decode_upload(data, min_side=MIN_DECODE_SIDE):
+    """
+    Decodifica uma imagem enviada direto do buffer do upload.
+
+    Fotos de vários megapixels são decodificadas em resolução reduzida
+    (1/2, 1/4 ou 1/8, via ``IMREAD_REDUCED_COLOR_*``) mantendo o menor lado
+    acima de ``min_side``, o que é suficiente para a entrada 224x224.
+
+    Parameters
+    ----------
+    data : bytes, bytearray, memoryview or file-like
+        Conteúdo do arquivo. Objetos com ``getbuffer()`` (como o
+        ``UploadedFile`` do Streamlit) são lidos sem cópia.
+    min_side : int, optional
+        Menor lado mínimo desejado após a redução.
+
+    Returns
+    -------
+    np.ndarray or None
+        Imagem BGR uint8, ou None se o conteúdo não for uma imagem válida.
+    """
+    if hasattr(data, "getbuffer"):
+        data = data.getbuffer()
+    buffer = np.frombuffer(data, dtype=np.uint8)
+
+    flag = cv2.IMREAD_COLOR
+    size = _image_size(memoryview(buffer))
+    if size is not None:
+        for factor, reduced_flag in _REDUCED_FLAGS:
+            if min(size) // factor >= min_side:
+                flag = reduced_flag
+                break
+    return cv2.imdecode(buffer, flag)
+
+
+def resize_for_model(image):
+    """
+    Redimensiona uma imagem BGR uint8 para a entrada 224x224 do modelo.
+
+    Imagens que já estão no tamanho da entrada são devolvidas sem cópia.
+    """
+    height, width = image.shape[:2]
+    if (height, width) == (INPUT_SIZE, INPUT_SIZE):
+        return image
+    shrinking = height > INPUT_SIZE and width > INPUT_SIZE
+    return cv2.resize(image, (INPUT_SIZE, INPUT_SIZE),
+                      interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+
+
+def preprocess_into(image, out):
+    """
+    Redimensiona e normaliza uma imagem BGR dentro de um slot do buffer.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        Imagem BGR uint8 ``(H, W, 3)``.
+    out : np.ndarray
+        Slot float32 ``(3, 224, 224)`` do buffer do lote.
+    """
+    resized = resize_for_model(image)
+    # Escreve os canais BGR numa visão invertida do slot: a troca para RGB sai sem cópia
+    bgr = out[::-1]
+    np.multiply(resized.transpose(2, 0, 1), _SCALE, out=bgr)
+    np.add(bgr, _BIAS, out=bgr)
+
+
+def allocate_batch(n):
+    """Aloca o buffer float32 ``(n, 3, 224, 224)`` de um lote."""
+    return np.empty((n, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+
+
+def preprocess_batch(images, pool=None, out=None):
+    """
+    Pré-processa imagens BGR num único tensor de lote.
+
+    Parameters
+    ----------
+    images : sequence of np.ndarray
+        Imagens BGR uint8.
+    pool : concurrent.futures.Executor, optional
+        Pool para processar as imagens em paralelo.
+    out : np.ndarray, optional
+        Buffer pré-alocado com pelo menos ``len(images)`` slots.
+
+    Returns
+    -------
+    torch.Tensor
+        Tensor ``(N, 3, 224, 224)`` que compartilha memória com o buffer.
+    """
+    if out is None:
+        out = allocate_batch(len(images))
+    out = out[:len(images)]
+    if pool is None:
+        for image, slot in zip(images, out):
+            preprocess_into(image, slot)
+    else:
+        list(pool.map(preprocess_into, images, out))
+    return torch.from_numpy(out)
+
+
+def legacy_preprocess(image):
+    """Cadeia original (cv2 -> PIL -> torchvision), mantida como referência."""
+    from torchvision import transforms
+
+    transform = transforms.Compose([
+        transforms.Resize((INPUT_SIZE, INPUT_SIZE)),
+        transforms.ToTensor(),
+        transforms.Normalize(MEAN.tolist(), STD.tolist())
+    ])
+    return transform(Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)))
+
+
+def parity_report(images):
+    """
+    Compara o caminho vetorizado com a cadeia original.
+
+    Returns
+    -------
+    dict
+        Maior diferença absoluta e diferença média entre os tensores.
+    """
+    fast = preprocess_batch(images)
+    reference = torch.stack([legacy_preprocess(image) for image in images])
+    diff = (fast - reference).abs()
+    return {"max_abs_diff": diff.max().item(), "mean_abs_diff": diff.mean().item()}
+
+
+if __name__ == "__main__":
+    from utils.backends import load_test_set
+
+    root = sys.argv[1] if len(sys.argv) > 1 else 'dataset_classifier/test'
+    report = parity_report(load_test_set(root)[0])
+    print(report)
+    # Tolerância: diferenças de interpolação entre PIL e OpenCV (em unidades normalizadas)
+    if report["mean_abs_diff"] > 0.05:
+        raise SystemExit("Pré-processamento fora da tolerância.")
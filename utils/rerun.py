@@ -0,0 +1,136 @@
+"""
+Fragmentos de página e memoização por sessão, para que cada interação
+refaça apenas a sua própria seção.
+
+Sem isso, qualquer widget dispara um rerun do script inteiro: digitar o
+endereço decodificava e classificava de novo a imagem já enviada,
+geocodificava, buscava hospitais e remontava o mapa.
+
+- ``section`` transforma uma seção da página num fragmento do Streamlit:
+  interações dentro dela reexecutam só a própria seção;
+- ``memo`` guarda, por sessão, o último resultado de cada etapa cara,
+  indexado pelas entradas (id e hash do upload, endereço, coordenadas);
+- ``record`` conta o trabalho feito e o evitado em cada rerun. Com
+  ``SHOW_WORK_COUNTER=1`` (ou a opção na barra lateral), cada seção e a
+  página mostram o contador.
+"""
+import functools
+import hashlib
+import os
+from collections import Counter
+
+import streamlit as st
+
+SHOW_WORK_COUNTER = os.getenv('SHOW_WORK_COUNTER', '0') == '1'
+
+# st.fragment saiu do experimental no Streamlit 1.37
+_fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+
+def start_run():
+    """Zera o contador de trabalho; chamada no início de cada rerun completo."""
+    st.session_state["_trabalho"] = Counter()
+    st.session_state.setdefault("mostrar_trabalho", SHOW_WORK_COUNTER)
+
+
+def record(etapa, cached=False):
+    """
+    Registra uma etapa executada (ou evitada pelo cache) neste rerun.
+
+    Parameters
+    ----------
+    etapa : str
+        Nome da etapa, como ``"classificação"``.
+    cached : bool, optional
+        Se o resultado veio da memoização.
+    """
+    key = (etapa, cached)
+    st.session_state.setdefault("_trabalho", Counter())[key] += 1
+    secao = st.session_state.get("_trabalho_secao")
+    if secao is not None:
+        secao[key] += 1
+
+
+def memo(etapa, key, compute):
+    """
+    Retorna o resultado de ``compute()``, refazendo-o só quando ``key`` muda.
+
+    Guarda apenas o último resultado de cada etapa, por sessão: o suficiente
+    para que reruns provocados por outros widgets não repitam o trabalho.
+
+    Parameters
+    ----------
+    etapa : str
+        Nome da etapa; também é o nome no contador de trabalho.
+    key : hashable
+        Entradas da etapa.
+    compute : callable
+        Função sem argumentos que calcula o resultado.
+    """
+    cache = st.session_state.setdefault("_memo", {})
+    entry = cache.get(etapa)
+    if entry is not None and entry[0] == key:
+        record(etapa, cached=True)
+        return entry[1]
+    value = compute()
+    record(etapa)
+    cache[etapa] = (key, value)
+    return value
+
+
+def forget(*etapas):
+    """Descarta resultados memorizados, por exemplo ao limpar a imagem."""
+    cache = st.session_state.get("_memo", {})
+    for etapa in etapas:
+        cache.pop(etapa, None)
+
+
+def upload_key(uploaded):
+    """
+    Chave de um arquivo enviado: id do upload e SHA-256 do conteúdo.
+
+    O hash é calculado uma vez por id de upload.
+    """
+    file_id = getattr(uploaded, "file_id", None) or f"{uploaded.name}:{uploaded.size}"
+    digests = st.session_state.setdefault("_upload_digests", {})
+    if file_id not in digests:
+        digests.clear()
+        digests[file_id] = hashlib.sha256(uploaded.getbuffer()).hexdigest()
+    return file_id, digests[file_id]
+
+
+def _summary(counter):
+    etapas = sorted({etapa for etapa, _ in counter})
+    return "; ".join(f"{etapa}: {counter[(etapa, False)]} feita(s), {counter[(etapa, True)]} evitada(s)"
+                     for etapa in etapas) or "nenhuma etapa cara"
+
+
+def section(nome):
+    """
+    Decorador que transforma uma função de página num fragmento isolado.
+
+    Parameters
+    ----------
+    nome : str
+        Nome da seção, exibido no contador de trabalho.
+    """
+    def decorate(fn):
+        @_fragment
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            st.session_state["_trabalho_secao"] = Counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                counter = st.session_state.pop("_trabalho_secao")
+                if st.session_state.get("mostrar_trabalho"):
+                    st.caption(f"⚙️ {nome} — {_summary(counter)}")
+        return run
+    return decorate
+
+
+def show_work():
+    """Mostra o trabalho do rerun completo na barra lateral, se habilitado."""
+    st.sidebar.checkbox("Mostrar contador de trabalho", key="mostrar_trabalho")
+    if st.session_state.get("mostrar_trabalho"):
+        st.sidebar.caption(f"Trabalho neste rerun: {_summary(st.session_state.get('_trabalho', Counter()))}")
@@ -0,0 +1,293 @@
+"""
+Índice de similaridade sobre os embeddings das imagens de lesão.
+
+Cada imagem cadastrada tem o embedding da penúltima camada da AlexNet
+(4096 dimensões, normalizado em L2) gravado na tabela EMBEDDING_LESAO e
+anexado a um índice local: uma matriz float32 contígua em disco, lida por
+memory map, com o vetor de ids de paciente ao lado. A busca é um produto
+matriz-vetor (similaridade de cosseno) em blocos, seguido de
+``argpartition`` para os k melhores, e continua na casa dos milissegundos
+com 100 mil+ imagens.
+
+O índice é atualizado incrementalmente a cada cadastro (append); se um
+paciente é reembeddado, vale a linha mais recente do seu id. Uma falha ao
+anexar não desfaz o cadastro, já gravado no banco: o índice pode ser
+reconstruído a partir de EMBEDDING_LESAO::
+
+    python -m utils.similarity --rebuild
+
+Antes de reconstruir, ``--rebuild`` calcula o embedding dos pacientes que
+ainda não têm um para a versão atual do modelo (cadastros anteriores a esta
+funcionalidade ou a uma troca de ``MODEL_VERSION``), a partir da entrada do
+modelo guardada no armazenamento de blobs.
+"""
+import argparse
+import logging
+import os
+
+import numpy as np
+import streamlit as st
+import torch
+import torch.nn.functional as F
+from sqlalchemy import text
+
+from utils.blobstore import BlobNotFound, get_store
+from utils.classifier import MODEL_VERSION, Prediction, classify_batch, load_eager_model
+from utils.ingest import model_input_from_bytes
+from utils.preprocess import preprocess_batch
+from utils.vector_index import SimilarityIndex
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = os.getenv('SIMILARITY_INDEX_DIR', '.cache/similarity')
+
+
+def embed_tensors(model, batch):
+    """
+    Calcula predições e embeddings normalizados de um lote em um único forward.
+
+    Returns
+    -------
+    tuple of (list of Prediction, np.ndarray)
+        As predições e os embeddings ``(N, 4096)`` float32 com norma 1.
+    """
+    with torch.no_grad():
+        x = torch.flatten(model.avgpool(model.features(batch)), 1)
+        embeddings = model.classifier[:6](x)
+        probabilities = F.softmax(model.classifier[6](embeddings), dim=1)
+        embeddings = F.normalize(embeddings, dim=1)
+
+    predictions = [Prediction.from_probabilities(row) for row in probabilities.tolist()]
+    return predictions, embeddings.numpy()
+
+
+def embed_images(images):
+    """
+    Calcula os embeddings de imagens BGR com o modelo eager.
+
+    Parameters
+    ----------
+    images : sequence of np.ndarray
+        Imagens BGR uint8.
+
+    Returns
+    -------
+    np.ndarray
+        Embeddings ``(N, 4096)`` float32 com norma 1.
+    """
+    return embed_tensors(load_eager_model(), preprocess_batch(list(images)))[1]
+
+
+def classify_and_embed(images):
+    """
+    Classifica imagens BGR e retorna também seus embeddings.
+
+    A predição vem de ``classify_batch``, com o backend configurado
+    (``CLASSIFIER_BACKEND``) ou o serviço de inferência compartilhado, a
+    mesma usada no restante do app; o modelo eager só calcula o embedding,
+    que os backends otimizados não expõem.
+
+    Parameters
+    ----------
+    images : sequence of np.ndarray
+        Imagens BGR uint8.
+
+    Returns
+    -------
+    tuple of (list of Prediction, np.ndarray)
+    """
+    images = list(images)
+    return classify_batch(images), embed_images(images)
+
+
+@st.cache_resource(show_spinner=False)
+def get_index():
+    """Retorna o índice de similaridade do modelo carregado."""
+    return SimilarityIndex(INDEX_DIR, MODEL_VERSION)
+
+
+def index_embeddings(ids, embeddings):
+    """
+    Anexa embeddings já gravados no banco ao índice local.
+
+    Chamada depois do commit; uma falha é registrada no log e não propaga,
+    pois o cadastro já está salvo e o índice pode ser reconstruído com
+    ``python -m utils.similarity --rebuild``.
+    """
+    try:
+        get_index().add(ids, embeddings)
+    except Exception:
+        logger.warning("Falha ao anexar %d embedding(s) ao índice; reconstrua-o com --rebuild.",
+                       len(ids), exc_info=True)
+
+
+def save_embedding(session, paciente_id, embedding, model_version=MODEL_VERSION):
+    """
+    Grava o embedding de um paciente na tabela EMBEDDING_LESAO.
+
+    Como ``save_prediction``, não faz commit: participa da transação do
+    chamador. Depois do commit, anexe o embedding ao índice com
+    ``index_embeddings``.
+    """
+    query = text("""
+        INSERT INTO EMBEDDING_LESAO (PACIENTE_ID, VERSAO_MODELO, VETOR)
+        VALUES (:paciente_id, :versao_modelo, :vetor)
+        ON CONFLICT (PACIENTE_ID) DO UPDATE SET
+            VERSAO_MODELO = EXCLUDED.VERSAO_MODELO,
+            VETOR = EXCLUDED.VETOR
+    """)
+    session.execute(query, {
+        "paciente_id": paciente_id,
+        "versao_modelo": model_version,
+        "vetor": np.asarray(embedding, dtype=np.float32).tobytes()
+    })
+
+
+def find_similar_cases(session, embedding, k=5, exclude=()):
+    """
+    Busca os casos anteriores mais parecidos com um embedding.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Sessão aberta com o banco de dados.
+    embedding : np.ndarray
+        Embedding ``(4096,)`` normalizado da imagem consultada.
+    k : int, optional
+        Número de casos.
+    exclude : collection of int, optional
+        Ids de paciente a ignorar.
+
+    Returns
+    -------
+    list of dict
+        Nome, diagnóstico previsto e similaridade de cada caso, em ordem
+        decrescente de similaridade.
+    """
+    neighbours = get_index().search(embedding, k, exclude)
+    if not neighbours:
+        return []
+
+    query = text("""
+        SELECT P.PACIENTE_ID, P.NOME, PR.CLASSE, PR.PROBABILIDADE
+        FROM PACIENTE P
+        LEFT JOIN PREDICAO PR ON PR.PACIENTE_ID = P.PACIENTE_ID
+        WHERE P.PACIENTE_ID = ANY(:ids)
+    """)
+    rows = session.execute(query, {"ids": [paciente_id for paciente_id, _ in neighbours]}).mappings()
+    by_id = {row["paciente_id"]: row for row in rows}
+    return [
+        {
+            "Nome": by_id[paciente_id]["nome"],
+            "Diagnóstico previsto": by_id[paciente_id]["classe"] or "—",
+            "Similaridade": f"{score * 100:.0f}%",
+        }
+        for paciente_id, score in neighbours
+        if paciente_id in by_id
+    ]
+
+
+def backfill_embeddings(session, store=None, chunk_size=64):
+    """
+    Calcula e grava os embeddings que faltam para a versão atual do modelo.
+
+    Pacientes sem linha em EMBEDDING_LESAO para ``MODEL_VERSION`` têm a
+    entrada do modelo lida do armazenamento de blobs e embeddada em blocos.
+    Cada bloco é uma transação.
+
+    Returns
+    -------
+    tuple of (int, list of int)
+        Número de embeddings gravados e ids de pacientes ignorados por não
+        terem a entrada do modelo no armazenamento.
+    """
+    store = store or get_store()
+    model = load_eager_model()
+    total, skipped, last_id = 0, [], 0
+    while True:
+        rows = session.execute(text("""
+            SELECT P.PACIENTE_ID, P.ENTRADA_MODELO_HASH
+            FROM PACIENTE P
+            LEFT JOIN EMBEDDING_LESAO E
+                ON E.PACIENTE_ID = P.PACIENTE_ID AND E.VERSAO_MODELO = :versao_modelo
+            WHERE E.PACIENTE_ID IS NULL AND P.PACIENTE_ID > :last_id
+            ORDER BY P.PACIENTE_ID
+            LIMIT :limit
+        """), {"versao_modelo": MODEL_VERSION, "last_id": last_id, "limit": chunk_size}).fetchall()
+        if not rows:
+            return total, skipped
+        last_id = rows[-1][0]
+
+        ids, images = [], []
+        for paciente_id, digest in rows:
+            try:
+                images.append(model_input_from_bytes(store.get(digest)))
+            except (BlobNotFound, TypeError, ValueError):
+                logger.warning("Paciente %s sem entrada do modelo no armazenamento.", paciente_id)
+                skipped.append(paciente_id)
+                continue
+            ids.append(paciente_id)
+        if not ids:
+            continue
+
+        _, embeddings = embed_tensors(model, preprocess_batch(images))
+        for paciente_id, embedding in zip(ids, embeddings):
+            save_embedding(session, paciente_id, embedding)
+        session.commit()
+        total += len(ids)
+        print(f"{total} embeddings calculados")
+
+
+def _stored_embeddings(session, model_version, chunk_size):
+    last_id = 0
+    while True:
+        rows = session.execute(text("""
+            SELECT PACIENTE_ID, VETOR FROM EMBEDDING_LESAO
+            WHERE VERSAO_MODELO = :versao_modelo AND PACIENTE_ID > :last_id
+            ORDER BY PACIENTE_ID
+            LIMIT :limit
+        """), {"versao_modelo": model_version, "last_id": last_id, "limit": chunk_size}).fetchall()
+        if not rows:
+            return
+        yield ([row[0] for row in rows],
+               np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows]))
+        last_id = rows[-1][0]
+
+
+def rebuild_index(session, index_dir=INDEX_DIR, model_version=MODEL_VERSION, chunk_size=1000):
+    """
+    Reconstrói o índice local a partir da tabela EMBEDDING_LESAO, em blocos.
+
+    A reconstrução acontece com o lock de escrita do índice: cadastros
+    simultâneos esperam e são anexados ao índice novo.
+
+    Returns
+    -------
+    int
+        Número de embeddings indexados.
+    """
+    index = SimilarityIndex(index_dir, model_version)
+    return index.reset(_stored_embeddings(session, model_version, chunk_size))
+
+
+def main():
+    from utils.db import get_session
+
+    parser = argparse.ArgumentParser(description="Manutenção do índice de similaridade.")
+    parser.add_argument("--rebuild", action="store_true", help="Reconstrói o índice a partir do banco.")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        session = get_session()
+        try:
+            calculados, ignorados = backfill_embeddings(session)
+            print(f"{calculados} embeddings calculados para pacientes sem embedding.")
+            if ignorados:
+                print(f"Pacientes sem entrada do modelo no armazenamento: {ignorados}")
+            print(f"{rebuild_index(session)} embeddings indexados.")
+        finally:
+            session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Instrumentação leve dos caminhos quentes: latência por etapa e contadores.
+
+Com ``TRACING=1``:
+
+- ``span("etapa")`` e ``@traced("etapa")`` medem a latência de cada etapa
+  (decodificação, pré-processamento, forward, bcrypt, Postgres,
+  geocodificação, detalhes de lugares, mapa...) num histograma;
+- ``count("evento")`` incrementa contadores;
+- ``serve_metrics()`` expõe tudo em formato texto do Prometheus em
+  ``http://METRICS_HOST:METRICS_PORT/metrics`` (``127.0.0.1:9464``), junto
+  com o estado do pool do banco e as taxas de acerto dos caches;
+- ``debug_panel()`` mostra um resumo por etapa na barra lateral do app.
+
+Desligado (padrão), ``span`` devolve um contexto nulo compartilhado,
+``@traced`` devolve a própria função e ``count`` retorna de imediato: o
+custo é uma chamada de função por etapa.
+"""
+import bisect
+import contextlib
+import functools
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+TRACING = os.getenv('TRACING', '0') == '1'
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9464))
+
+# Limites dos buckets do histograma, em segundos
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Registry:
+    """Histogramas de latência por etapa, contadores e coletores externos (thread-safe)."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = {}
+
+    def observe(self, stage, seconds):
+        """Registra uma duração da etapa."""
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def inc(self, name, n=1):
+        """Incrementa um contador."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def add_collector(self, name, fn):
+        """Registra uma função que retorna um ``dict`` de valores numéricos, lida a cada coleta."""
+        with self._lock:
+            self._collectors[name] = fn
+
+    def snapshot(self):
+        """Cópia dos histogramas, contadores e valores dos coletores."""
+        with self._lock:
+            histograms = {stage: (list(h[0]), h[1], h[2]) for stage, h in self._histograms.items()}
+            counters = dict(self._counters)
+            collectors = dict(self._collectors)
+        gauges = {}
+        for name, fn in collectors.items():
+            try:
+                gauges[name] = _flatten(fn())
+            except Exception as e:
+                logger.debug("Coletor %s falhou: %s", name, e)
+        return histograms, counters, gauges
+
+    def quantile(self, counts, q):
+        """Estima um quantil a partir dos buckets (limite superior do bucket)."""
+        total = sum(counts)
+        if not total:
+            return 0.0
+        target, seen = q * total, 0
+        for limit, n in zip(self.buckets + (float("inf"),), counts):
+            seen += n
+            if seen >= target:
+                return limit if limit != float("inf") else self.buckets[-1]
+        return self.buckets[-1]
+
+
+def _flatten(values, prefix=""):
+    flat = {}
+    for key, value in values.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}_"))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+registry = Registry()
+
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        registry.observe(self.stage, time.perf_counter() - self.start)
+        if exc_type is not None:
+            registry.inc(f"{self.stage}_errors")
+        return False
+
+
+def span(stage):
+    """
+    Contexto que mede a duração de uma etapa.
+
+    Parameters
+    ----------
+    stage : str
+        Nome da etapa (rótulo ``stage`` no Prometheus).
+    """
+    return _Span(stage) if TRACING else _NULL_SPAN
+
+
+def traced(stage):
+    """Decorador equivalente a ``span``; sem ``TRACING``, devolve a função original."""
+    def decorate(fn):
+        if not TRACING:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, n=1):
+    """Incrementa um contador de eventos."""
+    if TRACING:
+        registry.inc(name, n)
+
+
+def add_collector(name, fn):
+    """Registra métricas externas (pool do banco, caches) para a coleta."""
+    if TRACING:
+        registry.add_collector(name, fn)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus(reg=registry):
+    """
+    Gera as métricas no formato texto de exposição do Prometheus.
+
+    Returns
+    -------
+    str
+    """
+    histograms, counters, gauges = reg.snapshot()
+    lines = ["# HELP leishticia_stage_seconds Latência por etapa.",
+             "# TYPE leishticia_stage_seconds histogram"]
+    for stage, (counts, total, n) in sorted(histograms.items()):
+        cumulative = 0
+        for limit, c in zip(reg.buckets, counts):
+            cumulative += c
+            lines.append(f'leishticia_stage_seconds_bucket{{stage="{_label(stage)}",le="{limit}"}} {cumulative}')
+        lines.append(f'leishticia_stage_seconds_bucket{{stage="{_label(stage)}",le="+Inf"}} {n}')
+        lines.append(f'leishticia_stage_seconds_sum{{stage="{_label(stage)}"}} {total}')
+        lines.append(f'leishticia_stage_seconds_count{{stage="{_label(stage)}"}} {n}')
+
+    lines += ["# HELP leishticia_events_total Contadores de eventos.",
+              "# TYPE leishticia_events_total counter"]
+    for name, value in sorted(counters.items()):
+        lines.append(f'leishticia_events_total{{name="{_label(name)}"}} {value}')
+
+    lines += ["# HELP leishticia_gauge Estado do pool do banco e dos caches.",
+              "# TYPE leishticia_gauge gauge"]
+    for source, values in sorted(gauges.items()):
+        for name, value in sorted(values.items()):
+            lines.append(f'leishticia_gauge{{source="{_label(source)}",name="{_label(name)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+@st.cache_resource(show_spinner=False)
+def serve_metrics(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Inicia (uma vez por processo) o endpoint ``/metrics`` numa thread.
+
+    Returns
+    -------
+    ThreadingHTTPServer or None
+        O servidor, ou None se o tracing estiver desligado ou a porta ocupada.
+    """
+    if not TRACING:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.warning("Endpoint de métricas não iniciado em %s:%d: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Métricas em http://%s:%d/metrics", host, port)
+    return server
+
+
+def debug_panel():
+    """Resumo de latência por etapa na barra lateral, se o tracing estiver ligado."""
+    if not TRACING or not st.sidebar.checkbox("Painel de desempenho", key="painel_desempenho"):
+        return
+    histograms, counters, gauges = registry.snapshot()
+    st.sidebar.dataframe([{
+        "etapa": stage,
+        "n": n,
+        "média (ms)": round(total / n * 1000, 1) if n else 0.0,
+        "p50 (ms)": registry.quantile(counts, 0.5) * 1000,
+        "p95 (ms)": registry.quantile(counts, 0.95) * 1000,
+    } for stage, (counts, total, n) in sorted(histograms.items())], hide_index=True)
+    if counters:
+        st.sidebar.json(counters, expanded=False)
+    if gauges:
+        st.sidebar.json(gauges, expanded=False)
@@ -0,0 +1,195 @@
+"""
+Índice local de embeddings, lido por memory map.
+
+Só depende de NumPy e da biblioteca padrão, para poder ser usado (e
+testado) fora do app; ``utils.similarity`` cuida do modelo, do banco e do
+índice compartilhado do processo.
+"""
+import contextlib
+import fcntl
+import os
+
+import numpy as np
+
+EMBEDDING_DIM = 4096
+ROW_BYTES = EMBEDDING_DIM * 4
+SEARCH_CHUNK_ROWS = 65536
+
+
+class SimilarityIndex:
+    """
+    Índice append-only de embeddings em disco, lido por memory map.
+
+    Os arquivos ``vectors.f32`` (linhas de 4096 float32) e ``ids.i64`` ficam
+    em ``<index_dir>/<versão do modelo>``; embeddings de modelos diferentes
+    não se misturam. Escritas são serializadas por ``flock``, e leitores
+    remapeiam os arquivos quando eles crescem ou são substituídos, então
+    vários processos do Streamlit podem compartilhar o mesmo índice.
+
+    ``ids.i64`` define quantas linhas valem: cada escrita anexa os vetores
+    antes dos ids e, antes de anexar, descarta vetores sem id (sobra de uma
+    escrita interrompida), mantendo os dois arquivos alinhados.
+
+    Parameters
+    ----------
+    index_dir : str
+        Diretório raiz dos índices.
+    model_version : str
+        Versão do modelo que gerou os embeddings.
+    """
+
+    def __init__(self, index_dir, model_version):
+        self.path = os.path.join(index_dir, model_version)
+        os.makedirs(self.path, exist_ok=True)
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        self.ids_path = os.path.join(self.path, "ids.i64")
+        self._rows = 0
+        self._version = None
+        self._vectors = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._current = np.empty(0, dtype=bool)
+
+    def __len__(self):
+        self._refresh()
+        return len(self._ids)
+
+    def _refresh(self):
+        """Remapeia os arquivos se outro processo anexou linhas ou reconstruiu o índice."""
+        try:
+            stat = os.stat(self.ids_path)
+        except FileNotFoundError:
+            stat = None
+        version = (stat.st_ino, stat.st_size) if stat else None
+        if version == self._version:
+            return
+        rows = stat.st_size // 8 if stat else 0
+        if not rows:
+            self._vectors = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+            self._ids = np.empty(0, dtype=np.int64)
+            self._current = np.empty(0, dtype=bool)
+        else:
+            try:
+                vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                    shape=(rows, EMBEDDING_DIM))
+                ids = np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(rows,))
+            except (FileNotFoundError, ValueError):
+                # Reconstrução em andamento: mantém o mapeamento anterior
+                return
+            self._vectors, self._ids = vectors, ids
+            # Só a última linha de cada id vale: reembeddings anexam uma linha nova
+            _, last = np.unique(self._ids[::-1], return_index=True)
+            self._current = np.zeros(rows, dtype=bool)
+            self._current[rows - 1 - last] = True
+        self._version = version
+        self._rows = rows
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Lock exclusivo de escrita do índice, entre processos."""
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def add(self, ids, embeddings):
+        """
+        Anexa embeddings ao índice sem reconstruí-lo.
+
+        Parameters
+        ----------
+        ids : sequence of int
+            Ids dos pacientes.
+        embeddings : np.ndarray
+            Embeddings ``(N, 4096)`` normalizados.
+        """
+        with self.locked():
+            self._append(ids, embeddings)
+
+    def _append(self, ids, embeddings):
+        # Chamado com o lock: alinha os vetores aos ids e anexa
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        rows = os.path.getsize(self.ids_path) // 8 if os.path.exists(self.ids_path) else 0
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(rows * ROW_BYTES)
+            # Vetores antes dos ids: leitores só enxergam linhas completas
+            f.write(embeddings.tobytes())
+        with open(self.ids_path, "ab") as f:
+            f.truncate(rows * 8)
+            f.write(ids.tobytes())
+
+    def reset(self, chunks):
+        """
+        Substitui todo o conteúdo do índice, com o lock de escrita.
+
+        Parameters
+        ----------
+        chunks : iterable of tuple of (sequence of int, np.ndarray)
+            Blocos de ids e embeddings.
+
+        Returns
+        -------
+        int
+            Número de linhas gravadas.
+        """
+        total = 0
+        with self.locked():
+            # Leitores com os arquivos antigos mapeados continuam com eles
+            # até o próximo ``_refresh``, que detecta o inode novo
+            for path in (self.vectors_path, self.ids_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+            for ids, embeddings in chunks:
+                self._append(ids, embeddings)
+                total += len(ids)
+        return total
+
+    def search(self, query, k=5, exclude=()):
+        """
+        Retorna os ``k`` embeddings mais similares (cosseno) à consulta.
+
+        Parameters
+        ----------
+        query : np.ndarray
+            Embedding ``(4096,)`` normalizado.
+        k : int, optional
+            Número de vizinhos.
+        exclude : collection of int, optional
+            Ids de paciente a ignorar (por exemplo, o próprio paciente).
+
+        Returns
+        -------
+        list of tuple of (int, float)
+            Pares ``(paciente_id, similaridade)`` em ordem decrescente.
+        """
+        self._refresh()
+        if not self._rows:
+            return []
+
+        query = np.asarray(query, dtype=np.float32)
+        # Pede folga para compensar ids excluídos
+        want = min(k + len(exclude), self._rows)
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start in range(0, self._rows, SEARCH_CHUNK_ROWS):
+            scores = self._vectors[start:start + SEARCH_CHUNK_ROWS] @ query
+            scores[~self._current[start:start + SEARCH_CHUNK_ROWS]] = -np.inf
+            if len(scores) > want:
+                top = np.argpartition(scores, -want)[-want:]
+            else:
+                top = np.arange(len(scores))
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+            if len(best_scores) > want:
+                keep = np.argpartition(best_scores, -want)[-want:]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+
+        results, seen = [], set(exclude)
+        for i in np.argsort(-best_scores):
+            paciente_id = int(self._ids[best_rows[i]])
+            if paciente_id in seen or best_scores[i] == -np.inf:
+                continue
+            seen.add(paciente_id)
+            results.append((paciente_id, float(best_scores[i])))
+            if len(results) == k:
+                break
+        return results